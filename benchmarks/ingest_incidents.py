@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Ingest synthetic PagerDuty incidents through ingest_team
+
+Runs against a throwaway SQLite database unless DATABASE_URI is set. Pass
+--compare to also time the previous SELECT and COMMIT per incident loop.
+
+$ python benchmarks/ingest_incidents.py --incidents 100000 --compare
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from mock import MagicMock
+
+DATABASE = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+os.environ.setdefault('DATABASE_URI', f'sqlite:///{DATABASE}')
+os.environ.setdefault('FLASK_CONFIG', 'production')
+os.environ['PAGERDUTY_RATE_LIMIT'] = '0'
+
+from oncall import db  # noqa: E402
+from oncall.api.ingest import incident_row  # noqa: E402
+from oncall.api.models import Incidents, Teams  # noqa: E402
+from oncall.api.tasks import ingest_team  # noqa: E402
+from oncall.app import app  # noqa: E402
+
+
+def pages(count, page_size, prefix):
+    """
+    Generate PagerDuty pages of synthetic incidents
+    """
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    for offset in range(0, count, page_size):
+        yield [
+            {
+                'id': f'{prefix}{number}',
+                'title': 'The server is on fire.',
+                'summary': f'[#{number}] The server is on fire.',
+                'status': 'resolved',
+                'created_at': (start + timedelta(minutes=number)).isoformat(),
+                'urgency': 'high' if number % 3 else 'low',
+            }
+            for number in range(offset, min(offset + page_size, count))
+        ]
+
+
+def legacy_ingest(team, incident_pages):
+    """
+    The previous ingestion loop, one SELECT and one COMMIT per incident
+    """
+    for incidents in incident_pages:
+        for incident in incidents:
+            row = incident_row(incident, team)
+
+            if Incidents.query.filter_by(incident_id=row['incident_id']).one_or_none() is None:
+                db.session.add(Incidents(annotation=None, **{k: v for k, v in row.items() if k != 'annotation_id'}))
+                db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--incidents', type=int, default=100_000)
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--compare', action='store_true', help='also time the per incident loop')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        team = Teams(name='benchmark', team_id='BENCH', summary='', last_checked=datetime.now())
+        db.session.add(team)
+        db.session.commit()
+
+        now = datetime.now(timezone.utc)
+
+        pyduty = MagicMock()
+        pyduty.get_incidents.return_value = pages(args.incidents, args.page_size, 'B')
+
+        start = time.perf_counter()
+        ingest_team(pyduty, team_id=team.id, since=now, until=now)
+        bulk = time.perf_counter() - start
+
+        print(f'bulk upsert:          {args.incidents / bulk:10.1f} incidents/s ({bulk:.1f}s)')
+
+        if args.compare:
+            start = time.perf_counter()
+            legacy_ingest(team, pages(args.incidents, args.page_size, 'L'))
+            legacy = time.perf_counter() - start
+
+            print(f'per incident commit:  {args.incidents / legacy:10.1f} incidents/s ({legacy:.1f}s)')
+
+        print(f'{Incidents.query.count()} incidents stored')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Serialise a /incidents/<team_id> payload with each JSON provider
+
+Rows shaped like the listing query are turned into a response the way
+get_incidents does. "stock" is the previous path, Flask's default provider
+with created_at converted by pytz and formatted by isoformat for every
+incident. "json" and "orjson" are the providers registered by create_app,
+handed the fixed offset datetimes built by local_times as they are.
+
+$ python benchmarks/json_provider.py --incidents 50000
+$ python benchmarks/json_provider.py --incidents 50000 --fields incident_id,created_at,urgency,status
+"""
+
+import argparse
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytz
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from oncall.api.rollups import local_times
+from oncall.api.routes import INCIDENT_FIELDS, _incident_serialiser, _parse_fields
+from oncall.utils.json_provider import JSONProvider, ORJSONProvider, orjson
+
+Row = namedtuple(
+    'Row',
+    [
+        'id',
+        'title',
+        'description',
+        'summary',
+        'status',
+        'actionable',
+        'created_at',
+        'incident_id',
+        'urgency',
+        'team',
+        'annotation_id',
+        'annotation_summary',
+        'annotation_created_at',
+    ],
+)
+
+
+def rows(count):
+    """
+    Rows of the listing query, one incident in five annotated
+    """
+    start = datetime(2023, 1, 1)
+
+    return [
+        Row(
+            number,
+            'The server is on fire.',
+            'The server is on fire.',
+            f'[#{number}] The server is on fire.',
+            'resolved',
+            None if number % 2 else True,
+            start + timedelta(minutes=number),
+            f'P{number}_BENCH',
+            'high' if number % 3 else 'low',
+            1,
+            number if number % 5 == 0 else None,
+            'Disk full' if number % 5 == 0 else None,
+            start + timedelta(minutes=number, seconds=30) if number % 5 == 0 else None,
+        )
+        for number in range(count)
+    ]
+
+
+def serialise(app, provider, stock, incident_rows, target_timezone, fields):
+    """
+    Build the payload from the rows and serialise it
+
+    :return: (bytes) Response body
+    """
+    app.json = provider(app)
+
+    if stock:
+        # The previous path, a pytz conversion for every incident and times formatted in Python
+        incident_dict = _incident_serialiser(fields, lambda date: pytz.UTC.localize(date).astimezone(target_timezone))
+
+        def build(incident):
+            incident = incident_dict(incident)
+
+            if 'created_at' in incident:
+                incident['created_at'] = incident['created_at'].isoformat()
+
+            if incident.get('annotation'):
+                incident['annotation']['created_at'] = incident['annotation']['created_at'].isoformat()
+
+            return incident
+    else:
+        # Offsets worked out once per request, as get_incidents does
+        build = _incident_serialiser(
+            fields, local_times(target_timezone, incident_rows[0].created_at, incident_rows[-1].created_at)
+        )
+
+    with app.app_context():
+        payload = {
+            'incidents': [build(incident) for incident in incident_rows],
+            'summary': {},
+            'team': {'id': 1, 'name': 'benchmark'},
+        }
+
+        return app.json.response(payload).get_data()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--incidents', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many runs is reported')
+    parser.add_argument('--timezone', default='America/New_York')
+    parser.add_argument('--fields', default=','.join(INCIDENT_FIELDS), help='comma separated incident fields')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    incident_rows = rows(args.incidents)
+    target_timezone = pytz.timezone(args.timezone)
+    fields = _parse_fields(args.fields)
+
+    providers = [('stock', DefaultJSONProvider, True), ('json', JSONProvider, False)]
+
+    if orjson is not None:
+        providers.append(('orjson', ORJSONProvider, False))
+    else:
+        print('orjson is not installed, skipping it')
+
+    bodies = {}
+
+    for name, provider, stock in providers:
+        timings = []
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            bodies[name] = serialise(app, provider, stock, incident_rows, target_timezone, fields)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+
+        print(
+            f'{name:7} {best * 1000:8.1f} ms {args.incidents / best:12.1f} incidents/s '
+            f'{len(bodies[name]) / 1024 / 1024:6.1f} MiB'
+        )
+
+    assert len({bodies[name] for name in bodies}) == 1, 'providers wrote different bodies'
+
+
+if __name__ == '__main__':
+    main()
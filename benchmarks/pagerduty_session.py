@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Compare a fresh HTTP session per PagerDuty request against the pooled session
+
+A local stand-in for the PagerDuty API is started on a random port so the
+numbers only reflect client side connection handling. The stand-in speaks
+plain HTTP, real PagerDuty traffic also pays for a TLS handshake on every new
+connection so the gap in production is larger.
+
+$ python benchmarks/pagerduty_session.py --requests 2000
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests import Request, Session
+
+from oncall.utils.pagerduty import PagerDuty, close_sessions
+
+BODY = json.dumps({'teams': [], 'limit': 25, 'offset': 0, 'total': None, 'more': False}).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnpooledPagerDuty(PagerDuty):
+    """
+    The previous behaviour, a brand new session for every request
+    """
+
+    def _query(self, method, endpoint, payload=None, timeout=5):
+        session = Session()
+
+        request = Request(
+            method=method,
+            url=f'{self.endpoint}/{endpoint}',
+            params=payload or {},
+            headers={'Authorization': f'Token token={self.api}'},
+        )
+
+        resp = session.send(session.prepare_request(request), timeout=timeout)
+
+        return resp.json()
+
+
+def run(client, requests):
+    start = time.perf_counter()
+
+    for _ in range(requests):
+        next(client.get_teams())
+
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+
+    try:
+        before = run(UnpooledPagerDuty('benchmark', endpoint=endpoint), args.requests)
+        after = run(PagerDuty('benchmark', endpoint=endpoint), args.requests)
+    finally:
+        close_sessions()
+        server.shutdown()
+
+    print(f'session per request: {before:8.1f} req/s')
+    print(f'pooled session:      {after:8.1f} req/s ({after / before:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
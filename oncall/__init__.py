@@ -8,6 +8,7 @@ from flask_sqlalchemy import SQLAlchemy
 
 from oncall.config import config
 from oncall.utils.celery import make_celery
+from oncall.utils.json_provider import create_provider
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -26,12 +27,19 @@ def create_app(config_name=None):
 
     app.config.from_object(config[config_name])
 
+    app.json = create_provider(app)
+
     # app.register_blueprint(api)
 
     db.init_app(app)
     migrate.init_app(app, db)
     celery.init_app(app)
 
+    from oncall.commands import backfill_command, rollups_command
+
+    app.cli.add_command(backfill_command)
+    app.cli.add_command(rollups_command)
+
     @app.shell_context_processor
     def ctx():
         return {'app': app, 'db': db}
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from oncall import db
+from oncall.api.ingest import insert_ignore, store_incidents_concurrently
+from oncall.api.models import BackfillSlices, Teams
+from oncall.utils.dates import naive_utc
+from oncall.utils.pagerduty import RequestFailure
+
+logger = logging.getLogger(__name__)
+
+
+def plan_slices(team_id, since, until, slice_size):
+    """
+    Split a team's backfill range into slices, recording any that are not already planned
+
+    Slices are laid out on a grid starting at since, so planning the same range again
+    finds the slices (and checkpoints) of an earlier run instead of creating new ones.
+    Committing is left to the caller.
+
+    :param team_id: Team primary key
+    :param since: (datetime) Start of the range
+    :param until: (datetime) End of the range
+    :param slice_size: (timedelta) Length of each slice
+
+    :return: (list) Primary keys of the slices still to be backfilled
+    """
+    since, until = naive_utc(since), naive_utc(until)
+
+    boundaries = []
+
+    while since < until:
+        boundaries.append({'team': team_id, 'since': since, 'until': min(since + slice_size, until)})
+        since += slice_size
+
+    if not boundaries:
+        return []
+
+    db.session.execute(insert_ignore(BackfillSlices), boundaries)
+
+    return list(
+        db.session.scalars(
+            select(BackfillSlices.id)
+            .filter(
+                BackfillSlices.team == team_id,
+                BackfillSlices.since >= boundaries[0]['since'],
+                BackfillSlices.until <= until,
+                BackfillSlices.completed_at.is_(None),
+            )
+            .order_by(BackfillSlices.since)
+        )
+    )
+
+
+def backfill_slice(pyduty, slice_id):
+    """
+    Ingest the incidents of a single slice and checkpoint it
+
+    :param pyduty: (AsyncPagerDuty) Asyncio PagerDuty client, the pages of the slice are fetched concurrently
+    :param slice_id: Backfill slice primary key
+
+    :return: (bool) successful
+    """
+    backfill = db.session.get(BackfillSlices, slice_id)
+
+    if backfill is None:
+        logger.error(f'Failed to find backfill slice {slice_id}')
+        return False
+
+    if backfill.completed_at is not None:
+        return True
+
+    team = db.session.get(Teams, backfill.team)
+
+    try:
+        created = asyncio.run(
+            store_incidents_concurrently(
+                pyduty,
+                team,
+                since=backfill.since.replace(tzinfo=timezone.utc),
+                until=backfill.until.replace(tzinfo=timezone.utc),
+            )
+        )
+    except RequestFailure as err:
+        logger.error(f'Failed to backfill {backfill}: {err}')
+
+        return False
+
+    backfill.completed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.session.commit()
+
+    logger.info(f'{created} incidents have been created backfilling {backfill}')
+
+    return True
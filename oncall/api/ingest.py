@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from oncall import db
+from oncall.api.models import Incidents, Teams
+from oncall.api.rollups import add_incidents
+from oncall.api.versions import touch_teams
+from oncall.utils.dates import naive_utc
+
+
+def incident_row(incident, team):
+    """
+    Map a PagerDuty incident onto an incidents row
+
+    :param incident: (dict) PagerDuty incident
+    :param team: (Teams) Team the incident was fetched for
+
+    :return: (dict) Column values
+    """
+    return {
+        # Create a unique identifier since incident ID can be duplicated across teams
+        'incident_id': f'{incident["id"]}_{team.team_id}',
+        'title': incident.get('title', 'No title'),
+        'description': incident.get('description', 'No description'),
+        'summary': incident.get('summary', 'No summary'),
+        'status': incident.get('status', 'No status'),
+        'actionable': None,
+        'created_at': datetime.fromisoformat(incident['created_at']),
+        'annotation_id': None,
+        'urgency': incident['urgency'],
+        'team': team.id,
+    }
+
+
+def status_changed_at(incident, default):
+    """
+    Get when PagerDuty last changed the status of a polled incident
+
+    :param incident: (dict) PagerDuty incident
+    :param default: (datetime) Naive UTC time used when PagerDuty does not say, e.g. the time of the poll
+
+    :return: (datetime) Naive UTC time
+    """
+    changed_at = incident.get('last_status_change_at')
+
+    if not changed_at:
+        return default
+
+    return naive_utc(datetime.fromisoformat(changed_at))
+
+
+def insert_ignore(model):
+    """
+    Build an INSERT that skips rows which already exist
+    """
+    dialect = db.session.get_bind().dialect
+
+    if dialect.name == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+
+    if dialect.name == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+
+    return insert(model)
+
+
+def insert_incidents(rows):
+    """
+    Insert the incidents that are not already stored and count them into the rollups
+
+    The batch is de-duplicated in memory, checked against the database with a single
+    lookup and written with one bulk INSERT ... ON CONFLICT DO NOTHING. Committing is
+    left to the caller, so the rollups change in the same transaction.
+
+    :param rows: (list) Column values built with incident_row
+
+    :return: (list) incident_ids that were inserted
+    """
+    rows = list({row['incident_id']: row for row in rows}.values())
+
+    if not rows:
+        return []
+
+    existing = set(
+        db.session.scalars(
+            select(Incidents.incident_id).where(Incidents.incident_id.in_([row['incident_id'] for row in rows]))
+        )
+    )
+
+    rows = [row for row in rows if row['incident_id'] not in existing]
+
+    if not rows:
+        return []
+
+    stmt = insert_ignore(Incidents)
+
+    if not db.session.get_bind().dialect.insert_executemany_returning:
+        db.session.execute(stmt, rows)
+
+        inserted = [row['incident_id'] for row in rows]
+    else:
+        inserted = list(db.session.scalars(stmt.returning(Incidents.incident_id), rows))
+
+    created = set(inserted)
+
+    add_incidents([row for row in rows if row['incident_id'] in created])
+    touch_teams({row['team'] for row in rows if row['incident_id'] in created})
+
+    return inserted
+
+
+def upsert_incident(incident, team, changed_at):
+    """
+    Store an incident pushed by PagerDuty, or apply its latest status
+
+    Inserting is idempotent and the status only changes when the event is newer than the
+    last change applied by a webhook, a poll or the log entries feed, so retried or out of
+    order deliveries never move an incident back. Committing is left to the caller.
+
+    :param incident: (dict) PagerDuty incident
+    :param team: (Teams) Team the incident belongs to
+    :param changed_at: (datetime) Naive UTC time PagerDuty recorded the change
+
+    :return: (bool) The incident was created or changed
+    """
+    row = incident_row(incident, team)
+
+    created = insert_incidents([row])
+
+    changed = db.session.execute(
+        update(Incidents)
+        .where(
+            Incidents.incident_id == row['incident_id'],
+            or_(Incidents.updated_at.is_(None), Incidents.updated_at < changed_at),
+        )
+        .values(status=row['status'], updated_at=changed_at, refreshed_at=changed_at)
+    )
+
+    if changed.rowcount:
+        touch_teams([team.id])
+
+    return bool(created) or changed.rowcount > 0
+
+
+def store_incidents(pyduty, team, since, until):
+    """
+    Fetch a team's incidents from PagerDuty and store the new ones, committing every page
+
+    :param pyduty: (PagerDuty) PagerDuty client
+    :param team: (Teams) Team to fetch incidents for
+    :param since: (datetime) Start of the window
+    :param until: (datetime) End of the window
+
+    :return: (int) Number of incidents created
+    """
+    created = 0
+
+    for incidents in pyduty.get_incidents(team_id=team.team_id, since=since, until=until):
+        created += len(insert_incidents([incident_row(incident, team) for incident in incidents]))
+
+        # One commit per PagerDuty page
+        db.session.commit()
+
+    return created
+
+
+async def store_incidents_concurrently(pyduty, team, since, until):
+    """
+    Fetch a team's incidents with pages requested concurrently and store the new ones, committing every page
+
+    Pages are stored in offset order as they arrive, while the pages after them are still being fetched.
+
+    :param pyduty: (AsyncPagerDuty) Asyncio PagerDuty client
+    :param team: (Teams) Team to fetch incidents for
+    :param since: (datetime) Start of the window
+    :param until: (datetime) End of the window
+
+    :return: (int) Number of incidents created
+    """
+    created = 0
+
+    async for incidents in pyduty.get_incidents(team_id=team.team_id, since=since, until=until):
+        created += len(insert_incidents([incident_row(incident, team) for incident in incidents]))
+
+        # One commit per PagerDuty page
+        db.session.commit()
+
+    return created
+
+
+def sync_teams(teams, last_checked):
+    """
+    Insert new teams and refresh the name and summary of existing ones
+
+    Existing teams are loaded with one query, new teams are written with one bulk
+    INSERT and changed teams with one bulk UPDATE. Committing is left to the caller.
+
+    :param teams: (list) PagerDuty teams
+    :param last_checked: (datetime) Last checked time given to new teams
+
+    :return: (tuple) Column values of the created and updated teams
+    """
+    existing = {
+        team.team_id: team for team in db.session.execute(select(Teams.id, Teams.team_id, Teams.name, Teams.summary))
+    }
+
+    created, updated = {}, {}
+
+    for team in teams:
+        current = existing.get(team['id'])
+
+        if current is None:
+            created[team['id']] = {
+                'name': team['name'],
+                'team_id': team['id'],
+                'summary': team['summary'],
+                'last_checked': last_checked,
+            }
+        elif (current.name, current.summary) != (team['name'], team['summary']):
+            updated[team['id']] = {'id': current.id, 'name': team['name'], 'summary': team['summary']}
+
+    if created:
+        db.session.execute(insert(Teams), list(created.values()))
+
+    if updated:
+        db.session.execute(update(Teams), list(updated.values()))
+
+    return list(created.values()), list(updated.values())
+
+
+def mark_refreshed(incident_ids, refreshed_at):
+    """
+    Record when incidents were last checked against PagerDuty
+
+    :param incident_ids: (list) Incident primary keys
+    :param refreshed_at: (datetime) Naive UTC time of the check
+
+    :return: None
+    """
+    if incident_ids:
+        db.session.execute(update(Incidents).where(Incidents.id.in_(incident_ids)).values(refreshed_at=refreshed_at))
+
+
+def update_statuses(changes):
+    """
+    Apply incident status changes with one bulk UPDATE
+
+    :param changes: (list) Dicts holding the incident primary key, its new status and when it changed
+
+    :return: None
+    """
+    if changes:
+        db.session.execute(update(Incidents), changes)
@@ -36,13 +36,20 @@ class Teams(db.Model):
     alias = db.Column(db.String(30), unique=True, nullable=True)
 
     name = db.Column(db.String(255))
-    team_id = db.Column(db.String(255))
+    team_id = db.Column(db.String(255), unique=True, index=True)
 
     summary = db.Column(db.String(255))
 
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     last_checked = db.Column(db.DateTime)
 
+    # Adaptive polling, when the team is next due and the interval (seconds) used to schedule it
+    next_poll_at = db.Column(db.DateTime, nullable=True)
+    poll_interval = db.Column(db.Integer, nullable=True)
+
+    # Bumped by every write to the team's incidents, together with last_checked it versions the team's responses
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     def __init__(self, name, team_id, summary, last_checked):
         self.name = name
         self.team_id = team_id
@@ -66,6 +73,19 @@ class Teams(db.Model):
 
 class Incidents(db.Model):
     __tablename__ = 'incidents'
+    __table_args__ = (
+        # Range scans of a team's incidents
+        db.Index('ix_incidents_team_created_at', 'team', 'created_at'),
+        # The partial hour of every team counted by /mostincidents
+        db.Index('ix_incidents_created_at_team', 'created_at', 'team'),
+        # Refresh scans only ever look for unresolved incidents
+        db.Index(
+            'ix_incidents_unresolved',
+            'status',
+            postgresql_where=db.text("status != 'resolved'"),
+            sqlite_where=db.text("status != 'resolved'"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -79,8 +99,10 @@ class Incidents(db.Model):
 
     created_at = db.Column(db.DateTime)
     updated_at = db.Column(db.DateTime, nullable=True)
+    # Last time the status was checked against PagerDuty
+    refreshed_at = db.Column(db.DateTime, nullable=True)
 
-    incident_id = db.Column(db.String(50))
+    incident_id = db.Column(db.String(50), unique=True, index=True)
 
     urgency = db.Column(db.String(15))
 
@@ -130,3 +152,61 @@ class Incidents(db.Model):
 
     def __repr__(self):
         return f'<Incident ID: {self.incident_id} - {self.title}>'
+
+
+class BackfillSlices(db.Model):
+    __tablename__ = 'backfill_slices'
+    __table_args__ = (db.UniqueConstraint('team', 'since', 'until'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    team = db.Column(db.Integer, db.ForeignKey('teams.id'), nullable=False)
+
+    since = db.Column(db.DateTime, nullable=False)
+    until = db.Column(db.DateTime, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Backfill Slice: {self.team} {self.since} - {self.until}>'
+
+
+class SyncCursors(db.Model):
+    __tablename__ = 'sync_cursors'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Feed the cursor belongs to, e.g. log_entries
+    name = db.Column(db.String(50), unique=True, nullable=False)
+
+    # Time the feed has been read up to
+    position = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Sync Cursor: {self.name} {self.position}>'
+
+
+class TeamDailyRollups(db.Model):
+    __tablename__ = 'team_daily_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('team', 'bucket', 'urgency'),
+        # The whole hours of every team counted by /mostincidents
+        db.Index('ix_team_daily_rollups_bucket', 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    team = db.Column(db.Integer, db.ForeignKey('teams.id'), nullable=False)
+
+    # Start of the UTC hour the incidents were created in, hours add up to the days of any whole hour timezone
+    bucket = db.Column(db.DateTime, nullable=False)
+
+    urgency = db.Column(db.String(15), nullable=False)
+
+    incidents = db.Column(db.Integer, nullable=False, default=0)
+    actionable = db.Column(db.Integer, nullable=False, default=0)
+    not_actionable = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<Team Rollup: {self.team} {self.bucket} {self.urgency}>'
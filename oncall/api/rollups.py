@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta, timezone
+
+import pytz
+from sqlalchemy import case, delete, func, literal, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from oncall import db
+from oncall.api.models import Incidents, TeamDailyRollups
+from oncall.utils.dates import naive_utc
+
+HOUR = timedelta(hours=1)
+
+COUNTS = ('incidents', 'actionable', 'not_actionable')
+
+
+def hour_bucket(date):
+    """
+    Truncate a time to the start of its UTC hour
+    """
+    return naive_utc(date).replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(date):
+    """
+    Round a time up to the start of the next UTC hour, unless it already starts one
+    """
+    bucket = hour_bucket(date)
+
+    return bucket if bucket == naive_utc(date) else bucket + HOUR
+
+
+def _counts(actionable):
+    """
+    Counts a single incident adds to its rollup
+    """
+    return {'incidents': 1, 'actionable': int(actionable is True), 'not_actionable': int(actionable is False)}
+
+
+def _upsert(deltas):
+    """
+    Add counts to the rollups, creating the rows that do not exist yet
+
+    :param deltas: (dict) (team, bucket, urgency) mapped to the counts to add
+
+    :return: None
+    """
+    rows = [
+        {'team': team, 'bucket': bucket, 'urgency': urgency, **counts}
+        for (team, bucket, urgency), counts in deltas.items()
+        if any(counts.values())
+    ]
+
+    if not rows:
+        return
+
+    table = TeamDailyRollups.__table__
+    dialect = db.session.get_bind().dialect
+
+    if dialect.name in ('postgresql', 'sqlite'):
+        stmt = (postgresql if dialect.name == 'postgresql' else sqlite).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['team', 'bucket', 'urgency'],
+            set_={column: table.c[column] + stmt.excluded[column] for column in COUNTS},
+        )
+
+        db.session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        changed = db.session.execute(
+            update(table)
+            .where(table.c.team == row['team'], table.c.bucket == row['bucket'], table.c.urgency == row['urgency'])
+            .values({column: table.c[column] + row[column] for column in COUNTS})
+        )
+
+        if not changed.rowcount:
+            db.session.execute(table.insert(), row)
+
+
+def add_incidents(rows):
+    """
+    Count newly stored incidents into the rollups, committing is left to the caller
+
+    :param rows: (list) Column values built with incident_row
+
+    :return: None
+    """
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTS, 0))
+
+    for row in rows:
+        if row['team'] is None or row['urgency'] is None:
+            continue
+
+        counts = deltas[(row['team'], hour_bucket(row['created_at']), row['urgency'])]
+
+        for column, count in _counts(row['actionable']).items():
+            counts[column] += count
+
+    _upsert(deltas)
+
+
+def change_actionable(incident, actionable):
+    """
+    Move an incident between the actionable counts of its rollup, committing is left to the caller
+
+    :param incident: (Incidents) Incident before the change
+    :param actionable: (bool) New actionable value
+
+    :return: None
+    """
+    if incident.team is None or incident.urgency is None or incident.actionable is actionable:
+        return
+
+    before, after = _counts(incident.actionable), _counts(actionable)
+
+    _upsert(
+        {
+            (incident.team, hour_bucket(incident.created_at), incident.urgency): {
+                column: after[column] - before[column] for column in COUNTS
+            }
+        }
+    )
+
+
+def rebuild_rollups(team_id=None):
+    """
+    Recount the rollups from the incidents table, committing is left to the caller
+
+    :param team_id: Team primary key, every team when None
+
+    :return: (int) Number of rollup rows written
+    """
+    deleted = delete(TeamDailyRollups)
+    incidents = select(Incidents.team, Incidents.created_at, Incidents.urgency, Incidents.actionable).where(
+        Incidents.team.isnot(None), Incidents.urgency.isnot(None), Incidents.created_at.isnot(None)
+    )
+
+    if team_id is not None:
+        deleted = deleted.where(TeamDailyRollups.team == team_id)
+        incidents = incidents.where(Incidents.team == team_id)
+
+    db.session.execute(deleted)
+
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTS, 0))
+
+    for incident in db.session.execute(incidents.execution_options(yield_per=10000)):
+        counts = deltas[(incident.team, hour_bucket(incident.created_at), incident.urgency)]
+
+        for column, count in _counts(incident.actionable).items():
+            counts[column] += count
+
+    _upsert(deltas)
+
+    return len(deltas)
+
+
+def team_counts(since):
+    """
+    Count every team's incidents created since a time
+
+    Whole hours are read from the rollups, only the incidents of the first partial hour
+    are counted from the incidents table.
+
+    :param since: (datetime) Start of the window
+
+    :return: Subquery of team and incident_count
+    """
+    since = naive_utc(since)
+    edge = _ceil_hour(since)
+
+    counts = union_all(
+        select(TeamDailyRollups.team.label('team'), TeamDailyRollups.incidents.label('incidents')).where(
+            TeamDailyRollups.bucket >= edge
+        ),
+        select(Incidents.team.label('team'), literal(1).label('incidents')).where(
+            Incidents.created_at >= since, Incidents.created_at < edge
+        ),
+    ).subquery()
+
+    return (
+        select(counts.c.team, func.sum(counts.c.incidents).label('incident_count')).group_by(counts.c.team).subquery()
+    )
+
+
+def _utc_offset(target_timezone, date):
+    """
+    Offset from UTC, in seconds, of a timezone at a naive UTC time
+    """
+    return int(pytz.UTC.localize(date).astimezone(target_timezone).utcoffset().total_seconds())
+
+
+def utc_offsets(target_timezone, since, until):
+    """
+    Work out the offsets from UTC a timezone uses over a window
+
+    Each day is checked, and days where the offset changes are searched to the minute.
+
+    :param target_timezone: Timezone to check
+    :param since: (datetime) Naive UTC start of the window
+    :param until: (datetime) Naive UTC end of the window
+
+    :return: (list) Naive UTC time each offset starts at, and the offset in seconds, oldest first
+    """
+    offsets = [(since, _utc_offset(target_timezone, since))]
+
+    day = since
+
+    while day < until:
+        following = min(day + timedelta(days=1), until)
+
+        if _utc_offset(target_timezone, following) != offsets[-1][1]:
+            low, high = day, following
+
+            while high - low > timedelta(minutes=1):
+                middle = low + (high - low) / 2
+
+                if _utc_offset(target_timezone, middle) == offsets[-1][1]:
+                    low = middle
+                else:
+                    high = middle
+
+            high = high.replace(second=0, microsecond=0)
+            offsets.append((high, _utc_offset(target_timezone, high)))
+
+        day = following
+
+    return offsets
+
+
+def local_times(target_timezone, since, until):
+    """
+    Build a converter of naive UTC times in a window to aware times in a timezone
+
+    The offsets the timezone uses over the window are worked out once, each time is then
+    shifted with a fixed offset instead of a pytz conversion.
+
+    :param target_timezone: Timezone to convert to
+    :param since: (datetime) Naive UTC start of the window
+    :param until: (datetime) Naive UTC end of the window
+
+    :return: Callable taking a naive UTC datetime and returning it in the timezone
+    """
+    offsets = utc_offsets(target_timezone, since, until)
+
+    starts = [start for start, _ in offsets]
+    shifts = [(timedelta(seconds=offset), timezone(timedelta(seconds=offset))) for _, offset in offsets]
+
+    def local_time(date):
+        shift, zone = shifts[max(bisect_right(starts, date) - 1, 0)]
+
+        return (date + shift).replace(tzinfo=zone)
+
+    return local_time
+
+
+def local_date(column, target_timezone, since, until):
+    """
+    SQL expression for the date, in a timezone, of a naive UTC column
+
+    PostgreSQL converts with the timezone itself, other databases shift by the UTC
+    offsets the timezone uses over the window.
+
+    :param column: Naive UTC datetime column
+    :param target_timezone: Timezone of the dates
+    :param since: (datetime) Naive UTC start of the window
+    :param until: (datetime) Naive UTC end of the window
+
+    :return: SQL expression
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.date(func.timezone(target_timezone.zone, func.timezone('UTC', column)))
+
+    offsets = utc_offsets(target_timezone, since, until)
+
+    shifted = [(start, func.date(column, f'{offset:+d} seconds')) for start, offset in offsets]
+
+    if len(shifted) == 1:
+        return shifted[0][1]
+
+    return case(*[(column >= start, date) for start, date in reversed(shifted[1:])], else_=shifted[0][1])
+
+
+def _count_raw(team_id, since, until, target_timezone, summary, inclusive=True):
+    """
+    Count a team's incidents per day from the incidents table with one GROUP BY
+    """
+    end = Incidents.created_at <= until if inclusive else Incidents.created_at < until
+    day = local_date(Incidents.created_at, target_timezone, since, until).label('day')
+
+    for date, urgency, incidents in db.session.execute(
+        select(day, Incidents.urgency, func.count(Incidents.id))
+        .where(Incidents.team == team_id, Incidents.created_at >= since, end)
+        .group_by(day, Incidents.urgency)
+    ):
+        counts = summary.get(str(date))
+
+        if counts is not None and urgency and urgency.lower() in counts:
+            counts[urgency.lower()] += incidents
+
+
+def daily_summary(team_id, since, until, target_timezone, summary):
+    """
+    Count a team's low and high urgency incidents per day of a timezone
+
+    Whole hours are read from the rollups and only the incidents of the partial hours
+    at either end are counted from the incidents table. Timezones that are not a whole
+    number of hours from UTC are counted from the incidents table.
+
+    :param team_id: Team primary key
+    :param since: (datetime) Start of the window, inclusive
+    :param until: (datetime) End of the window, inclusive
+    :param target_timezone: Timezone the days are in
+    :param summary: (dict) Days, as YYYY-MM-DD, mapped to their low and high counts, filled in place
+
+    :return: (dict) summary
+    """
+    since, until = naive_utc(since), naive_utc(until)
+    start, end = _ceil_hour(since), hour_bucket(until)
+
+    if start >= end:
+        _count_raw(team_id, since, until, target_timezone, summary)
+
+        return summary
+
+    counts = defaultdict(int)
+
+    for bucket, urgency, incidents in db.session.execute(
+        select(TeamDailyRollups.bucket, TeamDailyRollups.urgency, TeamDailyRollups.incidents).where(
+            TeamDailyRollups.team == team_id, TeamDailyRollups.bucket >= start, TeamDailyRollups.bucket < end
+        )
+    ):
+        local = pytz.UTC.localize(bucket).astimezone(target_timezone)
+
+        if local.minute or local.second:
+            # The hour straddles two local days
+            _count_raw(team_id, since, until, target_timezone, summary)
+
+            return summary
+
+        counts[(local.strftime('%Y-%m-%d'), urgency.lower())] += incidents
+
+    for (date, urgency), incidents in counts.items():
+        day = summary.get(date)
+
+        if day is not None and urgency in day:
+            day[urgency] += incidents
+
+    _count_raw(team_id, since, start, target_timezone, summary, inclusive=False)
+    _count_raw(team_id, end, until, target_timezone, summary)
+
+    return summary
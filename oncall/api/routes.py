@@ -1,20 +1,31 @@
 from datetime import datetime, timedelta
 from http import HTTPStatus
+import csv
+import io
+import json
 import pytz
+from operator import attrgetter
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from werkzeug.exceptions import BadRequest
 
 from oncall import db
 from oncall.api.models import Annotations, Incidents, Teams
+from oncall.api.rollups import change_actionable, daily_summary, local_times, team_counts
+from oncall.api.versions import team_version, teams_version, touch_teams
+from oncall.utils import metrics
+from oncall.utils.cache import conditional, get_cache
+from oncall.utils.pagination import InvalidCursor, decode_cursor, encode_cursor
+from oncall.utils.redis import get_redis
 
-from sqlalchemy import func, and_
+from sqlalchemy import and_, func, or_, select
 
 
 api = Blueprint('api', __name__, url_prefix='/api/v1')
 
 
 @api.route('/teams')
+@conditional(teams_version)
 def get_teams():
     """
     Get all teams
@@ -24,21 +35,45 @@ def get_teams():
     return jsonify({'teams': [{'id': team.id, 'name': team.name, 'alias': team.alias} for team in teams]})
 
 
+@api.route('/metrics')
+def get_metrics():
+    """
+    Get the ingestion counters, with the response cache counters of this process when it is kept in memory
+    """
+    counters = metrics.get_metrics(get_redis())
+
+    responses = get_cache()
+
+    if responses is not None:
+        counters.update(responses.counters())
+
+    return jsonify({'metrics': counters}), HTTPStatus.OK
+
+
+def _seven_days_ago():
+    """
+    Start of the /mostincidents window, whole minutes so its responses can be versioned
+    """
+    return (datetime.utcnow() - timedelta(days=7)).replace(second=0, microsecond=0)
+
+
 @api.route('/mostincidents', methods=['GET'])
+@conditional(lambda: f'{teams_version()}:{_seven_days_ago().isoformat()}')
 def mostincidents():
     """
     Get all teams with poor PagerDuty integration
     """
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
+    seven_days_ago = _seven_days_ago()
+
+    counts = team_counts(seven_days_ago)
 
-    incident_count = func.count(Incidents.id).label('incident_count')
+    incident_count = func.coalesce(counts.c.incident_count, 0).label('incident_count')
 
     query = (
         db.session.query(
             Teams.id.label('team_id'), Teams.name.label('team_name'), Teams.alias.label('alias'), incident_count
         )
-        .outerjoin(Incidents, and_(Teams.id == Incidents.team, Incidents.created_at >= seven_days_ago))
-        .group_by(Teams.id)
+        .outerjoin(counts, Teams.id == counts.c.team)
         .order_by(incident_count.desc())
     )
 
@@ -55,6 +90,7 @@ def mostincidents():
 
 
 @api.route('/incidents/<string:team_id>', methods=['POST'])
+@conditional(team_version)
 def get_incidents(team_id):
     """
     Get incidents for a specific team
@@ -76,10 +112,37 @@ def get_incidents(team_id):
     since = data.get('since')
     until = data.get('until')
     timezone = data.get('timezone', 'UTC')  # Default to UTC if not provided
+    include_incidents = data.get('include_incidents', True)
 
     if since is None or until is None:
         return jsonify({'error': 'since and until are required arguments'}), HTTPStatus.BAD_REQUEST
 
+    if not isinstance(include_incidents, bool):
+        return jsonify({'error': 'include_incidents must be either true or false'}), HTTPStatus.BAD_REQUEST
+
+    try:
+        fields = _parse_fields(data.get('fields'))
+    except ValueError:
+        return jsonify({'error': f'fields must be a list of {", ".join(INCIDENT_FIELDS)}'}), HTTPStatus.BAD_REQUEST
+
+    # Incidents are paged through when a page size or cursor is given
+    page_size = data.get('page_size')
+    cursor = data.get('cursor')
+    paginated = page_size is not None or cursor is not None
+
+    if page_size is None:
+        page_size = current_app.config['INCIDENT_PAGE_SIZE']
+
+    if isinstance(page_size, bool) or not isinstance(page_size, int) or page_size < 1:
+        return jsonify({'error': 'page_size must be a positive integer'}), HTTPStatus.BAD_REQUEST
+
+    page_size = min(page_size, current_app.config['INCIDENT_MAX_PAGE_SIZE'])
+
+    try:
+        after = decode_cursor(cursor) if cursor is not None else None
+    except InvalidCursor:
+        return jsonify({'error': 'invalid cursor'}), HTTPStatus.BAD_REQUEST
+
     try:
         target_timezone = pytz.timezone(timezone)
     except pytz.UnknownTimeZoneError:
@@ -124,44 +187,290 @@ def get_incidents(team_id):
 
     incidents = {'incidents': [], 'summary': {}, 'team': team.to_dict()}
 
-    # Generate summary dates in target timezone - loop over each day in the range
-    incidents['summary'] = {
-        (since_date_target_tz + timedelta(days=x)).strftime('%Y-%m-%d'): {
-            'low': 0,
-            'high': 0,
+    if after is None:
+        # Generate summary dates in target timezone - loop over each day in the range
+        incidents['summary'] = {
+            (since_date_target_tz + timedelta(days=x)).strftime('%Y-%m-%d'): {
+                'low': 0,
+                'high': 0,
+            }
+            for x in range((until_date_target_tz - since_date_target_tz).days + 1)
         }
-        for x in range((until_date_target_tz - since_date_target_tz).days + 1)
-    }
-
-    for incident in (
-        Incidents.query.filter_by(team=team_id)
-        .filter(Incidents.created_at.between(since_date_utc, until_date_utc))
-        .order_by('created_at')
-    ):
-        incident_date_utc = pytz.UTC.localize(incident.created_at)
-        incident_date_target_tz = incident_date_utc.astimezone(target_timezone)
-
-        incident_date_str = incident_date_target_tz.strftime('%Y-%m-%d')
-
-        # Only add to summary if the date exists in our summary dict
-        if incident_date_str in incidents['summary']:
-            incidents['summary'][incident_date_str][incident.urgency.lower()] += 1
-
-        # Convert incident times to target timezone and add to response
-        incident_dict = incident.to_dict()
-        if incident.created_at:
-            if incident.created_at.tzinfo is not None:
-                incident_dict['created_at'] = incident.created_at.astimezone(target_timezone).isoformat()
-            else:
-                # Assume UTC and convert
-                incident_utc = pytz.UTC.localize(incident.created_at)
-                incident_dict['created_at'] = incident_utc.astimezone(target_timezone).isoformat()
-
-        incidents['incidents'].append(incident_dict)
+
+        daily_summary(team.id, since_date_utc, until_date_utc, target_timezone, incidents['summary'])
+    else:
+        # The summary covers the whole range, it is only returned with the first page
+        del incidents['summary']
+
+    # Summary only callers skip loading the incidents
+    if not include_incidents:
+        del incidents['incidents']
+
+        return jsonify(incidents)
+
+    # Only the columns of the requested fields, with annotations joined in the same query when asked for
+    query = (
+        select(*_incident_columns(fields))
+        .filter(Incidents.team == team_id, Incidents.created_at.between(since_date_utc, until_date_utc))
+        .order_by(Incidents.created_at, Incidents.id)
+    )
+
+    if 'annotation' in fields:
+        query = query.outerjoin(Annotations, Incidents.annotation_id == Annotations.id)
+
+    if after is not None:
+        # Keyset on (created_at, id), the range scan starts at the cursor
+        query = query.filter(
+            Incidents.created_at >= after[0],
+            or_(Incidents.created_at > after[0], and_(Incidents.created_at == after[0], Incidents.id > after[1])),
+        )
+
+    if paginated:
+        # Fetch one extra incident to know if there is another page
+        query = query.limit(page_size + 1)
+        incidents['next_cursor'] = None
+
+    serialise = _incident_serialiser(
+        fields, local_times(target_timezone, since_date_utc.replace(tzinfo=None), until_date_utc.replace(tzinfo=None))
+    )
+
+    last = None
+
+    for incident in db.session.execute(query):
+        if paginated and len(incidents['incidents']) == page_size:
+            # The next page starts after the last incident returned
+            incidents['next_cursor'] = encode_cursor(last.created_at, last.id)
+            break
+
+        incidents['incidents'].append(serialise(incident))
+        last = incident
 
     return jsonify(incidents)
 
 
+# Fields of a serialised incident, clients may ask for a subset of them with fields
+INCIDENT_FIELDS = (
+    'id',
+    'incident_id',
+    'team',
+    'title',
+    'description',
+    'summary',
+    'status',
+    'urgency',
+    'actionable',
+    'created_at',
+    'annotation',
+)
+
+# Fields that are not copied from their column as they are
+CONVERTED_FIELDS = ('incident_id', 'created_at', 'annotation')
+
+
+def _parse_fields(fields):
+    """
+    Parse the incident fields a client asked for
+
+    :param fields: (list|str) Field names, as a list or comma separated, None for every field
+
+    :return: (tuple) Field names, in the order asked for
+    """
+    if fields is None:
+        return INCIDENT_FIELDS
+
+    if isinstance(fields, str):
+        fields = fields.split(',')
+
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise ValueError('fields must be a list of field names')
+
+    fields = tuple(dict.fromkeys(field.strip() for field in fields if field.strip()))
+
+    if not fields or not set(fields) <= set(INCIDENT_FIELDS):
+        raise ValueError(f'unknown fields {fields}')
+
+    return fields
+
+
+def _incident_columns(fields):
+    """
+    Columns of the incident listing query for the requested fields, always with the keyset columns
+    """
+    columns = [Incidents.id, Incidents.created_at]
+
+    for field in fields:
+        if field == 'annotation':
+            columns += [
+                Incidents.annotation_id,
+                Annotations.summary.label('annotation_summary'),
+                Annotations.created_at.label('annotation_created_at'),
+            ]
+        elif field not in ('id', 'created_at'):
+            columns.append(getattr(Incidents, field))
+
+    return columns
+
+
+def _incident_serialiser(fields, local_time):
+    """
+    Build a serialiser of incident rows into the requested fields, the way Incidents.to_dict does with created_at in
+    the target timezone
+
+    :param fields: (tuple) Fields to serialise
+    :param local_time: Converter of naive UTC times to the target timezone, built with local_times
+
+    :return: Callable taking a row of the incident listing query and returning a dict
+    """
+    plain = [field for field in fields if field not in CONVERTED_FIELDS]
+
+    if len(plain) > 1:
+        values = attrgetter(*plain)
+    else:
+        # attrgetter returns a single value rather than a tuple
+        def values(incident):
+            return tuple(getattr(incident, name) for name in plain)
+
+    created_at, incident_id, annotation = ('created_at' in fields, 'incident_id' in fields, 'annotation' in fields)
+
+    def serialise(incident):
+        serialised = dict(zip(plain, values(incident)))
+
+        if created_at:
+            # The JSON provider writes the aware time as ISO 8601
+            serialised['created_at'] = local_time(incident.created_at) if incident.created_at else None
+
+        if incident_id:
+            serialised['incident_id'] = incident.incident_id.split('_')[0]
+
+        if annotation:
+            serialised['annotation'] = (
+                {'summary': incident.annotation_summary, 'created_at': incident.annotation_created_at}
+                if incident.annotation_id
+                else None
+            )
+
+        return serialised
+
+    return serialise
+
+
+def _parse_utc(date):
+    """
+    Parse an optional ISO date into the naive UTC form stored in the database, assuming UTC when no offset is given
+    """
+    if date is None:
+        return None
+
+    date = datetime.fromisoformat(date)
+
+    if date.tzinfo is not None:
+        date = date.astimezone(pytz.UTC).replace(tzinfo=None)
+
+    return date
+
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _export_version():
+    """
+    Version of the incidents an export covers
+    """
+    team_id = request.args.get('team')
+
+    return teams_version() if team_id is None else team_version(team_id)
+
+
+@api.route('/export/incidents', methods=['GET'])
+@conditional(_export_version, cache=False)
+def export_incidents():
+    """
+    Stream incidents, for one team or every team, as NDJSON or CSV
+    """
+    export_format = request.args.get('format', 'ndjson')
+
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be either ndjson or csv'}), HTTPStatus.BAD_REQUEST
+
+    try:
+        fields = _parse_fields(request.args.get('fields'))
+    except ValueError:
+        return jsonify({'error': f'fields must be a list of {", ".join(INCIDENT_FIELDS)}'}), HTTPStatus.BAD_REQUEST
+
+    # Annotations are exported as their summary
+    columns = [
+        Annotations.summary.label('annotation') if field == 'annotation' else getattr(Incidents, field)
+        for field in fields
+    ]
+
+    query = select(*columns).select_from(Incidents).order_by(Incidents.created_at, Incidents.id)
+
+    if 'annotation' in fields:
+        query = query.outerjoin(Annotations, Incidents.annotation_id == Annotations.id)
+
+    team_id = request.args.get('team')
+
+    if team_id is not None:
+        if Teams.query.filter_by(id=team_id).one_or_none() is None:
+            return jsonify({'error': 'team does not exist'}), HTTPStatus.NOT_FOUND
+
+        query = query.filter(Incidents.team == team_id)
+
+    try:
+        since = _parse_utc(request.args.get('since'))
+        until = _parse_utc(request.args.get('until'))
+    except ValueError:
+        return jsonify(
+            {'error': 'since and until require ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS+TZ)'}
+        ), HTTPStatus.BAD_REQUEST
+
+    if since is not None:
+        query = query.filter(Incidents.created_at >= since)
+
+    if until is not None:
+        query = query.filter(Incidents.created_at <= until)
+
+    def rows():
+        # Server side cursor, rows are fetched and written a batch at a time
+        result = db.session.execute(query.execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE']))
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        if export_format == 'csv':
+            writer.writerow(fields)
+
+        for partition in result.partitions():
+            for row in partition:
+                incident = dict(zip(fields, row))
+
+                if 'incident_id' in incident:
+                    incident['incident_id'] = incident['incident_id'].split('_')[0]
+
+                if 'created_at' in incident:
+                    incident['created_at'] = incident['created_at'].isoformat() if incident['created_at'] else None
+
+                if export_format == 'csv':
+                    writer.writerow(incident.values())
+                else:
+                    buffer.write(json.dumps(incident) + '\n')
+
+            yield buffer.getvalue()
+
+            buffer.seek(0)
+            buffer.truncate()
+
+        # A CSV export without incidents still has its header
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(rows()),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename=incidents.{export_format}'},
+    )
+
+
 @api.route('/incident/<string:incident_id>/annotation', methods=['POST', 'PUT', 'DELETE'])
 def annotation(incident_id: str):
     """
@@ -185,9 +494,11 @@ def annotation(incident_id: str):
 
         if request.method in ['PUT', 'POST']:
             db.session.query(Annotations).filter_by(id=incident.annotation_id).update({'summary': description})
+            touch_teams([incident.team])
             db.session.commit()
         elif request.method == 'DELETE':
             db.session.delete(annotation)
+            touch_teams([incident.team])
             db.session.commit()
 
             return jsonify({'annotation': None}), HTTPStatus.OK
@@ -196,6 +507,7 @@ def annotation(incident_id: str):
         annotation.incidents.append(incident)
 
         db.session.add(annotation)
+        touch_teams([incident.team])
         db.session.commit()
 
     return jsonify({'annotation': annotation.to_dict()}), HTTPStatus.OK
@@ -224,7 +536,10 @@ def actionable_incident(incident_id: str):
     if actionable.lower() not in ['true', 'false']:
         return jsonify({'error': 'actionable must be either true or false'}), HTTPStatus.BAD_REQUEST
 
+    change_actionable(incident, actionable.lower() == 'true')
+
     db.session.query(Incidents).filter_by(incident_id=incident_id).update({'actionable': actionable.lower() == 'true'})
+    touch_teams([incident.team])
     db.session.commit()
 
     return jsonify({'actionable': actionable.lower() == 'true'}), HTTPStatus.OK
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from oncall import db
+from oncall.api.models import Incidents, Teams
+
+# Refresh tiers of unresolved incidents, hottest first
+REFRESH_TIERS = ('hot', 'warm', 'cold')
+
+
+def next_poll_interval(previous, created, recent, min_interval, max_interval, window):
+    """
+    Work out how long to wait before polling a team again
+
+    A team that just raised incidents is polled as often as allowed. Otherwise the
+    interval backs off exponentially, capped by the team's average gap between
+    incidents over the rate window and by the maximum staleness.
+
+    :param previous: (int) Previous interval in seconds, None for a team never scheduled
+    :param created: (int) Incidents created by the poll that just finished
+    :param recent: (int) Incidents raised within the rate window
+    :param min_interval: (int) Shortest interval in seconds
+    :param max_interval: (int) Longest interval in seconds, bounding staleness
+    :param window: (timedelta) Window the recent incident rate is measured over
+
+    :return: (int) Interval in seconds
+    """
+    if created:
+        return min_interval
+
+    interval = (previous or min_interval) * 2
+
+    if recent:
+        interval = min(interval, window.total_seconds() / recent)
+
+    return int(max(min_interval, min(interval, max_interval)))
+
+
+def schedule_next_poll(team, created, now, config):
+    """
+    Record when a team should next be polled from its recent incident rate
+
+    :param team: (Teams) Team that was just polled
+    :param created: (int) Incidents created by the poll
+    :param now: (datetime) Naive UTC time of the poll
+    :param config: Application config holding the POLL_* settings
+
+    :return: (int) Interval in seconds
+    """
+    window = timedelta(hours=config['POLL_RATE_WINDOW_HOURS'])
+
+    recent = db.session.scalar(
+        select(func.count(Incidents.id)).filter(Incidents.team == team.id, Incidents.created_at >= now - window)
+    )
+
+    interval = next_poll_interval(
+        team.poll_interval,
+        created,
+        recent,
+        min_interval=config['POLL_MIN_INTERVAL'],
+        max_interval=config['POLL_MAX_INTERVAL'],
+        window=window,
+    )
+
+    db.session.query(Teams).filter_by(id=team.id).update(
+        {'poll_interval': interval, 'next_poll_at': now + timedelta(seconds=interval)}
+    )
+
+    return interval
+
+
+def refresh_tier(incident, now, config):
+    """
+    Work out the refresh tier of an unresolved incident, and whether it is due
+
+    Incidents open longer than INCIDENT_STALE_AGE_HOURS are "cold" and checked every
+    INCIDENT_STALE_REFRESH_INTERVAL seconds. Otherwise triggered or high urgency incidents
+    are "hot" and refreshed every cycle, while the rest are "warm" and refreshed less often
+    the older they get.
+
+    :param incident: Row holding the incident's status, urgency, created_at and refreshed_at
+    :param now: (datetime) Naive UTC time
+    :param config: Application config holding the INCIDENT_* settings
+
+    :return: (str) Refresh tier, None when the incident is not due
+    """
+    age = (now - incident.created_at).total_seconds()
+
+    if age > config['INCIDENT_STALE_AGE_HOURS'] * 3600:
+        tier, interval = 'cold', config['INCIDENT_STALE_REFRESH_INTERVAL']
+    elif incident.status == 'triggered' or incident.urgency == 'high':
+        return 'hot'
+    else:
+        tier = 'warm'
+        interval = min(
+            max(config['INCIDENT_REFRESH_WARM_INTERVAL'], age * config['INCIDENT_REFRESH_DECAY']),
+            config['INCIDENT_STALE_REFRESH_INTERVAL'],
+        )
+
+    if incident.refreshed_at is None or (now - incident.refreshed_at).total_seconds() >= interval:
+        return tier
+
+    return None
+
+
+def defer_next_poll(team_ids, until):
+    """
+    Push back the next poll of teams kept up to date by webhooks, polling becomes a reconciliation pass
+
+    :param team_ids: (list) Team primary keys
+    :param until: (datetime) Naive UTC time the teams are not due before
+
+    :return: None
+    """
+    if team_ids:
+        db.session.query(Teams).filter(
+            Teams.id.in_(team_ids), (Teams.next_poll_at.is_(None)) | (Teams.next_poll_at < until)
+        ).update({'next_poll_at': until}, synchronize_session=False)
+
+
+def due_teams(now):
+    """
+    Query the teams that are due to be polled
+
+    :param now: (datetime) Naive UTC time
+
+    :return: Query of teams
+    """
+    return Teams.query.filter((Teams.next_poll_at.is_(None)) | (Teams.next_poll_at <= now))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from oncall import db
+from oncall.api.ingest import update_statuses
+from oncall.api.models import Incidents, SyncCursors
+from oncall.api.versions import touch_teams
+
+LOG_ENTRIES_CURSOR = 'log_entries'
+
+# Status an incident is left in by each kind of log entry, reassigning an incident triggers it for the new assignee
+LOG_ENTRY_STATUSES = {
+    'trigger_log_entry': 'triggered',
+    'acknowledge_log_entry': 'acknowledged',
+    'unacknowledge_log_entry': 'triggered',
+    'reassign_log_entry': 'triggered',
+    'resolve_log_entry': 'resolved',
+}
+
+
+def latest_transitions(pages):
+    """
+    Reduce pages of log entries to the latest status of every incident
+
+    :param pages: Iterable of log entry pages
+    :return: (dict) incident_id mapped to the naive UTC time and status of its latest transition
+    """
+    transitions = {}
+
+    for log_entries in pages:
+        for log_entry in log_entries:
+            status = LOG_ENTRY_STATUSES.get(log_entry.get('type'))
+
+            if status is None:
+                continue
+
+            changed_at = datetime.fromisoformat(log_entry['created_at']).astimezone(timezone.utc).replace(tzinfo=None)
+
+            # Incidents are stored once per team
+            for team in log_entry.get('teams', []):
+                incident_id = f'{log_entry["incident"]["id"]}_{team["id"]}'
+
+                if incident_id not in transitions or transitions[incident_id][0] < changed_at:
+                    transitions[incident_id] = (changed_at, status)
+
+    return transitions
+
+
+def apply_transitions(transitions, refreshed_at):
+    """
+    Apply status transitions to the stored incidents with one lookup and one bulk UPDATE
+
+    Transitions older than the last change applied to an incident are skipped, so
+    reading an overlapping window again never moves an incident back. Committing is
+    left to the caller.
+
+    :param transitions: (dict) Built with latest_transitions
+    :param refreshed_at: (datetime) Naive UTC time of the sync
+
+    :return: (int) Number of incidents changed
+    """
+    if not transitions:
+        return 0
+
+    changes, teams = [], set()
+
+    for incident in db.session.execute(
+        select(Incidents.id, Incidents.incident_id, Incidents.status, Incidents.updated_at, Incidents.team).where(
+            Incidents.incident_id.in_(list(transitions))
+        )
+    ):
+        changed_at, status = transitions[incident.incident_id]
+
+        if incident.updated_at is not None and incident.updated_at >= changed_at:
+            continue
+
+        changes.append({'id': incident.id, 'status': status, 'updated_at': changed_at, 'refreshed_at': refreshed_at})
+        teams.add(incident.team)
+
+    update_statuses(changes)
+    touch_teams(teams)
+
+    return len(changes)
+
+
+def sync_log_entries(pyduty, now, config, reconcile=None):
+    """
+    Read the log entries feed from the stored cursor and apply the status transitions
+
+    Every sync re-reads LOG_ENTRIES_OVERLAP seconds before the cursor to pick up
+    entries PagerDuty recorded late. The first sync only reads that overlap, the
+    account wide feed of weeks of history would run past PagerDuty's pagination
+    limit, and hands the teams with unresolved incidents to reconcile instead so
+    changes made before the cursor are picked up by refreshing them once.
+
+    :param pyduty: (PagerDuty) PagerDuty client
+    :param now: (datetime) Naive UTC time to read the feed up to
+    :param config: Application config
+    :param reconcile: Callable taking the primary keys of the teams to refresh, called after the first sync commits
+
+    :return: (int) Number of incidents changed
+    """
+    cursor = db.session.scalars(select(SyncCursors).filter_by(name=LOG_ENTRIES_CURSOR)).one_or_none()
+    seeded = cursor is None
+
+    if seeded:
+        cursor = SyncCursors(name=LOG_ENTRIES_CURSOR, position=now)
+        db.session.add(cursor)
+
+    since = (now if seeded else cursor.position) - timedelta(seconds=config['LOG_ENTRIES_OVERLAP'])
+
+    changed = apply_transitions(
+        latest_transitions(
+            pyduty.get_log_entries(since=since.replace(tzinfo=timezone.utc), until=now.replace(tzinfo=timezone.utc))
+        ),
+        refreshed_at=now,
+    )
+
+    cursor.position = now
+    db.session.commit()
+
+    if seeded and reconcile is not None:
+        teams = select(Incidents.team).filter(Incidents.status != 'resolved', Incidents.team.is_not(None)).distinct()
+
+        reconcile(list(db.session.scalars(teams)))
+
+    return changed
@@ -4,153 +4,663 @@ import logging
 import os
 from datetime import datetime, timedelta, timezone
 
+from celery import chord
+from celery.signals import worker_process_shutdown
+from sqlalchemy import select
+
 from oncall import db
+from oncall.api.backfill import backfill_slice, plan_slices
+from oncall.api.ingest import mark_refreshed, status_changed_at, store_incidents, sync_teams, update_statuses
 from oncall.api.models import Incidents, Teams
+from oncall.api.scheduler import REFRESH_TIERS, due_teams, refresh_tier, schedule_next_poll
+from oncall.api.sync import sync_log_entries
+from oncall.api.versions import touch_teams
 from oncall.app import app, celery
-from oncall.utils.pagerduty import PagerDuty, RequestFailure
+from oncall.utils import metrics
+from oncall.utils.locks import Lease
+from oncall.utils.pagerduty import AsyncPagerDuty, PagerDuty, RateLimit, RequestFailure, close_sessions
+from oncall.utils.ratelimit import TokenBucket
+from oncall.utils.redis import get_redis
 
 logger = logging.getLogger(__name__)
 
+OPEN_STATUSES = ('triggered', 'acknowledged')
 
-@celery.task(bind=True)
-def populate_incidents(self):
+
+@worker_process_shutdown.connect
+def _close_pagerduty_sessions(**kwargs):
     """
-    Trigger a celery job for each team to populate alerts
+    Release the pooled PagerDuty connections when a worker process exits
     """
-    until = datetime.now(timezone.utc)
+    close_sessions()
 
-    for team in Teams.query.all():
-        # TODO(damian): Update the last checked time
-        _populate_incident.delay(
-            team_id=team.id,
-            since=team.last_checked.replace(tzinfo=timezone.utc),
-            until=until,
-        )
 
-    return True
+def _rate_limiter(api_key):
+    """
+    Get the cluster wide token bucket for a PagerDuty API key
+    """
+    rate = app.config['PAGERDUTY_RATE_LIMITS'].get(api_key, app.config['PAGERDUTY_RATE_LIMIT'])
+
+    if not api_key or not rate:
+        return None
+
+    return TokenBucket.for_api_key(get_redis(), api_key, rate, max_wait=app.config['PAGERDUTY_RATE_LIMIT_MAX_WAIT'])
+
+
+def pagerduty_client(concurrent=False):
+    """
+    Create a PagerDuty client backed by the worker's pooled session and the API key's rate limiter
+
+    :param concurrent: (bool) Create an asyncio client fetching PAGERDUTY_CONCURRENCY pages at once
+
+    :return: (PagerDuty|AsyncPagerDuty) PagerDuty client
+    """
+    api_key = os.getenv('PAGERDUTY_KEY')
+
+    options = {
+        'pool_size': app.config['PAGERDUTY_POOL_SIZE'],
+        'max_retries': app.config['PAGERDUTY_MAX_RETRIES'],
+        'rate_limiter': _rate_limiter(api_key),
+    }
+
+    if concurrent:
+        return AsyncPagerDuty(api_key, concurrency=app.config['PAGERDUTY_CONCURRENCY'], **options)
+
+    return PagerDuty(api_key, **options)
+
+
+def _retry_rate_limited(task, err, **kwargs):
+    """
+    Reschedule a rate limited task through Celery instead of sleeping in the worker
+    """
+    logger.warning(f'PagerDuty rate limited {task.name}, retrying in {err.retry_after}s')
+
+    return task.retry(
+        exc=err,
+        countdown=err.retry_after,
+        max_retries=app.config['PAGERDUTY_RATE_LIMIT_RETRIES'],
+        **kwargs,
+    )
+
+
+def _ingest_lease(team_id, token=None):
+    """
+    Get the lease allowing a single ingestion per team to be queued or running
+    """
+    return Lease(get_redis(), f'oncall:lease:ingest:{team_id}', app.config['INGEST_LEASE_TTL'], token=token)
+
+
+def _refresh_lease(name, token=None):
+    """
+    Get the lease allowing a single refresh of a team, incident or feed to be queued or running
+    """
+    return Lease(get_redis(), f'oncall:lease:refresh:{name}', app.config['REFRESH_LEASE_TTL'], token=token)
+
+
+def _lease_refreshes(kind, ids):
+    """
+    Take the refresh lease of each team or incident, skipping those whose last refresh is still queued or running
+
+    :param kind: (str) What is refreshed, team or incident
+    :param ids: (list) Team or incident primary keys
+
+    :return: (list) Dicts holding the primary key and refresh lease of each item to refresh
+    """
+    leased = []
+
+    for item_id in ids:
+        lease = _refresh_lease(f'{kind}:{item_id}')
+
+        if lease.acquire():
+            leased.append({f'{kind}_id': item_id, 'lease': lease.token})
+
+    skipped = len(ids) - len(leased)
+
+    if skipped:
+        logger.info(f'Skipped {skipped} {kind} refreshes already in progress')
+
+        metrics.incr(get_redis(), 'refresh_duplicates_skipped', skipped)
+
+    return leased
+
+
+def _process_leased(task, items, argument, processed, lease, process):
+    """
+    Process the items of a chunk, giving up each item's lease once it is done
+
+    A rate limited chunk is retried with the items left, which keep their leases, until it runs out of
+    retries and the leases are given up so the next cycle can dispatch the items again. An item failing
+    otherwise is logged and skipped, the rest of the chunk is still processed.
+
+    :param task: Celery task processing the chunk
+    :param items: (list) Dicts describing each item, with its lease token
+    :param argument: (str) Keyword argument the task takes the items as
+    :param processed: (int) Items already processed by earlier attempts
+    :param lease: Callable returning the lease of an item
+    :param process: Callable processing an item
+
+    :return: (int) Number of items processed
+    """
+    for position, item in enumerate(items):
+        try:
+            process(item)
+        except RateLimit as err:
+            if task.request.retries >= app.config['PAGERDUTY_RATE_LIMIT_RETRIES']:
+                for remaining in items[position:]:
+                    lease(remaining).release()
+
+            raise _retry_rate_limited(task, err, kwargs={argument: items[position:], 'processed': processed + position})
+        except Exception:
+            logger.exception(f'{task.name} failed to process {item}')
+
+            db.session.rollback()
+
+        lease(item).release()
+
+    return processed + len(items)
+
+
+def _chunks(items, size):
+    """
+    Split a list into lists of at most size items
+    """
+    return [items[position : position + size] for position in range(0, len(items), size)]
+
+
+def _fan_out(task, argument, items, size, kind, queue=None):
+    """
+    Dispatch items to a task in chunks, with a callback recording how many were processed
+
+    :param task: Celery task taking a chunk of items
+    :param argument: (str) Keyword argument the chunk is passed as
+    :param items: (list) Items to process
+    :param size: (int) Maximum items per task
+    :param kind: (str) What is being processed, the total is counted in the metrics under it with underscores
+    :param queue: (str) Celery queue the chunks are routed to, the default queue when None
+
+    :return: (int) Number of chunks dispatched
+    """
+    chunks = _chunks(items, size)
+
+    if chunks:
+        signatures = [task.s(**{argument: chunk}) for chunk in chunks]
+
+        if queue:
+            signatures = [signature.set(queue=queue) for signature in signatures]
+
+        chord(signatures)(_record_processed.s(kind=kind))
+
+    return len(chunks)
 
 
 @celery.task(bind=True)
-def _populate_incident(self, team_id: str, since: datetime, until: datetime):
+def _record_processed(self, results, kind):
     """
-    Populate team alerts
+    Record how many items a chunked fan-out processed
 
-    :param team: PagerDuty Team ID
-    :param since:
-    :param until:
+    :param results: (list) Number of items processed by each chunk
+    :param kind: (str) What was processed
 
-    :return: (bool) successful
+    :return: (int) Total processed
+    """
+    processed = sum(results)
+
+    logger.info(f'Processed {processed} {kind}')
+
+    metrics.incr(get_redis(), kind.replace(' ', '_'), processed)
+
+    return processed
+
+
+def ingest_team(pyduty, team_id, since, until):
     """
-    pyduty = PagerDuty(os.getenv('PAGERDUTY_KEY'))
+    Store a team's incidents raised between since and until
 
+    :param pyduty: (PagerDuty) PagerDuty client
+    :param team_id: Team primary key
+    :param since: (datetime) Start of the window
+    :param until: (datetime) End of the window
+
+    :return: (bool) successful
+    """
     team = Teams.query.filter_by(id=team_id).one_or_none()
 
     if team is None:
-        return
+        return False
 
     try:
-        for incidents in pyduty.get_incidents(team_id=team.team_id, since=since, until=until):
-            for incident in incidents:
-                # Create a unique identifier since incident ID can be duplicated across teams
-                incident_id = f'{incident["id"]}_{team.team_id}'
-
-                if Incidents.query.filter_by(incident_id=incident_id).one_or_none() is None:
-                    new_incident = Incidents(
-                        title=incident.get('title', 'No title'),
-                        description=incident.get('description', 'No description'),
-                        summary=incident.get('summary', 'No summary'),
-                        status=incident.get('status', 'No status'),
-                        actionable=None,
-                        created_at=datetime.fromisoformat(incident['created_at']),
-                        incident_id=incident_id,
-                        annotation=None,
-                        urgency=incident['urgency'],
-                        team=team.id,
-                    )
-
-                    db.session.add(new_incident)
-                    db.session.commit()
-
-                    logger.info(f'{incident_id} has been created')
+        created = store_incidents(pyduty, team, since=since, until=until)
     except RequestFailure as err:
         logger.error(f'Failed to query PagerDuty: {err}')
 
         return False
 
+    if created:
+        logger.info(f'{created} incidents have been created for {team.team_id}')
+
     # Update the last checked time
     db.session.query(Teams).filter_by(id=team_id).update({'last_checked': until})
+    schedule_next_poll(team, created, now=datetime.now(timezone.utc).replace(tzinfo=None), config=app.config)
+    db.session.commit()
+
+    return True
+
+
+def refresh_team(pyduty, team_id):
+    """
+    Refresh the status of a team's unresolved incidents from PagerDuty's incident list
+
+    A status older than the last change applied, e.g. by a webhook delivered during the poll, is skipped.
+
+    :param pyduty: (PagerDuty) PagerDuty client
+    :param team_id: Team primary key
+
+    :return: (bool) successful
+    """
+    team = Teams.query.filter_by(id=team_id).one_or_none()
+
+    if team is None:
+        logger.error(f'Failed to find team {team_id}')
+        return False
+
+    refreshed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    unresolved = {
+        incident.incident_id: incident
+        for incident in db.session.execute(
+            select(Incidents.id, Incidents.incident_id, Incidents.status, Incidents.updated_at).filter(
+                Incidents.team == team_id, Incidents.status != 'resolved'
+            )
+        )
+    }
+
+    try:
+        current = {
+            f'{incident["id"]}_{team.team_id}': incident
+            for incidents in pyduty.get_incidents_by_status(team_id=team.team_id, statuses=OPEN_STATUSES)
+            for incident in incidents
+        }
+
+        # Incidents missing from the open list have been resolved (or moved team), check those individually
+        for incident_id in unresolved.keys() - current.keys():
+            try:
+                current[incident_id] = pyduty.get_incident(incident_id=incident_id.split('_')[0])
+            except RequestFailure as err:
+                logger.error(f'Failed to query PagerDuty for {incident_id}: {err}')
+    except RequestFailure as err:
+        logger.error(f'Failed to query PagerDuty: {err}')
+
+        return False
+
+    changes = []
+
+    for incident_id, incident in unresolved.items():
+        latest = current.get(incident_id, {})
+
+        if latest.get('status', incident.status) == incident.status:
+            continue
+
+        changed_at = status_changed_at(latest, refreshed_at)
+
+        if incident.updated_at is None or incident.updated_at < changed_at:
+            changes.append({'id': incident.id, 'status': latest['status'], 'updated_at': changed_at})
+
+    update_statuses(changes)
+    mark_refreshed([incident.id for incident in unresolved.values()], refreshed_at)
+
+    if changes:
+        touch_teams([team_id])
+
+    db.session.commit()
+
+    if changes:
+        logger.info(f'Updated the status of {len(changes)} incidents for {team.team_id}')
+
+    return True
+
+
+def refresh_incident(pyduty, incident_id):
+    """
+    Check the status of a single incident and update it, unless the status is older than the last change applied
+
+    :param pyduty: (PagerDuty) PagerDuty client
+    :param incident_id: Incident primary key
+
+    :return: (bool) successful
+    """
+    incident = Incidents.query.filter_by(id=incident_id).one_or_none()
+
+    if incident is None:
+        logger.error(f'Failed to find incident {incident_id}')
+        return False
+
+    try:
+        resp = pyduty.get_incident(incident_id=incident.incident_id.split('_')[0])
+    except RequestFailure as err:
+        logger.error(f'Failed to query PagerDuty for {incident.incident_id}: {err}')
+
+        return False
+
+    refreshed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    changed_at = status_changed_at(resp, refreshed_at)
+
+    if resp['status'] != incident.status and (incident.updated_at is None or incident.updated_at < changed_at):
+        logger.info(f'Updated incident {incident.incident_id} with the new status of {resp["status"]}')
+
+        incident.status = resp['status']
+        incident.updated_at = changed_at
+
+        touch_teams([incident.team])
+
+    incident.refreshed_at = refreshed_at
     db.session.commit()
 
     return True
 
 
+@celery.task(bind=True)
+def populate_incidents(self):
+    """
+    Trigger celery jobs for batches of teams that are due to populate alerts
+    """
+    until = datetime.now(timezone.utc)
+
+    teams, skipped = [], 0
+
+    for team in due_teams(until.replace(tzinfo=None)):
+        lease = _ingest_lease(team.id)
+
+        # Coalesce with an ingestion for this team that is still queued or running
+        if not lease.acquire():
+            skipped += 1
+            continue
+
+        teams.append(
+            {
+                'team_id': team.id,
+                'since': team.last_checked.replace(tzinfo=timezone.utc),
+                'until': until,
+                'lease': lease.token,
+            }
+        )
+
+    if skipped:
+        logger.info(f'Skipped {skipped} teams with an ingestion already in progress')
+
+        metrics.incr(get_redis(), 'ingest_duplicates_skipped', skipped)
+
+    _fan_out(_populate_incidents_chunk, 'teams', teams, app.config['TEAM_CHUNK_SIZE'], 'teams ingested')
+
+    return True
+
+
+@celery.task(bind=True)
+def _populate_incidents_chunk(self, teams, processed=0):
+    """
+    Populate alerts for a batch of teams
+
+    :param teams: (list) Dicts holding the team_id, since, until and ingestion lease of each team
+    :param processed: (int) Teams already processed by earlier attempts
+
+    :return: (int) Number of teams processed
+    """
+    pyduty = pagerduty_client()
+
+    return _process_leased(
+        self,
+        teams,
+        'teams',
+        processed,
+        lambda team: _ingest_lease(team['team_id'], token=team.get('lease')),
+        lambda team: ingest_team(pyduty, team_id=team['team_id'], since=team['since'], until=team['until']),
+    )
+
+
 @celery.task(bind=True)
 def populate_teams(self):
     """
     Populate team details
     """
-    pyduty = PagerDuty(os.getenv('PAGERDUTY_KEY'))
+    pyduty = pagerduty_client()
 
     try:
-        for teams in pyduty.get_teams():
-            for team in teams:
-                if Teams.query.filter_by(team_id=team['id']).one_or_none() is None:
-                    new_team = Teams(
-                        name=team['name'],
-                        team_id=team['id'],
-                        summary=team['summary'],
-                        last_checked=datetime.now(),
-                    )
-
-                    if app.config.get('INITIAL_INCIDENT_LOOKBACK') is not None:
-                        # When the team bootstrap occurs query the past X days for incidents
-                        new_team.last_checked = new_team.last_checked - timedelta(
-                            days=int(app.config['INITIAL_INCIDENT_LOOKBACK'])
-                        )
-
-                    db.session.add(new_team)
-                    db.session.commit()
-
-                    logger.info(f'{team["name"]} has been created')
+        teams = [team for teams in pyduty.get_teams() for team in teams]
+    except RateLimit as err:
+        raise _retry_rate_limited(self, err)
     except RequestFailure as err:
         logger.error(f'Failed to query PagerDuty: {err}')
 
         return False
 
+    now = datetime.now(timezone.utc)
+
+    # New teams are polled from now on, their history is loaded by the backfill engine
+    created, updated = sync_teams(teams, last_checked=now.replace(tzinfo=None))
+    touch_teams([team['id'] for team in updated])
+    db.session.commit()
+
+    for team in created:
+        logger.info(f'{team["name"]} has been created')
+
+    if created and app.config.get('INITIAL_INCIDENT_LOOKBACK') is not None:
+        # When the team bootstrap occurs query the past X days for incidents
+        since = now - timedelta(days=int(app.config['INITIAL_INCIDENT_LOOKBACK']))
+
+        for team_id in db.session.scalars(
+            select(Teams.id).filter(Teams.team_id.in_([team['team_id'] for team in created]))
+        ):
+            backfill_team.delay(team_id=team_id, since=since, until=now)
+
+    for team in updated:
+        logger.info(f'{team["name"]} has been updated')
+
     return True
 
 
+@celery.task(bind=True)
+def backfill_team(self, team_id, since: datetime, until: datetime):
+    """
+    Backfill a team's incidents between since and until in parallel time slices
+
+    Finished slices are checkpointed, running the backfill again for the same range
+    only fetches the slices that have not completed.
+
+    :return: (int) Number of slices queued
+    """
+    slice_ids = plan_slices(team_id, since, until, timedelta(hours=app.config['BACKFILL_SLICE_HOURS']))
+    db.session.commit()
+
+    logger.info(f'Backfilling team {team_id} from {since} to {until} in {len(slice_ids)} slices')
+
+    _fan_out(_backfill_slices, 'slice_ids', slice_ids, app.config['BACKFILL_CHUNK_SIZE'], 'backfill slices loaded')
+
+    return len(slice_ids)
+
+
+@celery.task(bind=True)
+def _backfill_slices(self, slice_ids, processed=0):
+    """
+    Backfill a batch of time slices
+
+    :param slice_ids: (list) Backfill slice primary keys
+    :param processed: (int) Slices already processed by earlier attempts
+
+    :return: (int) Number of slices processed
+    """
+    pyduty = pagerduty_client(concurrent=True)
+
+    for position, slice_id in enumerate(slice_ids):
+        try:
+            backfill_slice(pyduty, slice_id)
+        except RateLimit as err:
+            raise _retry_rate_limited(
+                self, err, kwargs={'slice_ids': slice_ids[position:], 'processed': processed + position}
+            )
+
+    return processed + len(slice_ids)
+
+
 @celery.task(bind=True)
 def update_incidents(self):
     """
-    Check the status on unresolved tickets
+    Check the status on unresolved tickets that are due, routing each refresh tier to its own queue
     """
-    for incident in Incidents.query.filter(Incidents.status != 'resolved').all():
-        _update_incident.delay(incident_id=incident.id)
+    queues = app.config['INCIDENT_REFRESH_QUEUES']
+
+    if app.config['INCIDENT_REFRESH_MODE'] == 'log_entries':
+        lease = _refresh_lease('log_entries')
+
+        # One read of the log entries feed covers every incident, a sync still queued or running is not repeated
+        if lease.acquire():
+            _sync_log_entries.apply_async(kwargs={'lease': lease.token}, queue=queues.get('hot'))
+        else:
+            metrics.incr(get_redis(), 'refresh_duplicates_skipped')
+
+        return True
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    unresolved = db.session.execute(
+        select(
+            Incidents.id,
+            Incidents.team,
+            Incidents.status,
+            Incidents.urgency,
+            Incidents.created_at,
+            Incidents.refreshed_at,
+        ).filter(Incidents.status != 'resolved')
+    )
+
+    due = {tier: [] for tier in REFRESH_TIERS}
+
+    for incident in unresolved:
+        tier = refresh_tier(incident, now, app.config)
+
+        if tier is not None:
+            due[tier].append(incident)
+
+    if app.config['INCIDENT_REFRESH_MODE'] == 'batched':
+        dispatched = set()
+
+        # A team is refreshed once, in the hottest tier any of its due incidents belong to
+        for tier in REFRESH_TIERS:
+            team_ids = [
+                team_id
+                for team_id in dict.fromkeys(incident.team for incident in due[tier])
+                if team_id is not None and team_id not in dispatched
+            ]
+            dispatched.update(team_ids)
+
+            _fan_out(
+                _refresh_teams_chunk,
+                'teams',
+                _lease_refreshes('team', team_ids),
+                app.config['TEAM_CHUNK_SIZE'],
+                'teams refreshed',
+                queue=queues.get(tier),
+            )
+
+        return True
+
+    for tier in REFRESH_TIERS:
+        _fan_out(
+            _update_incidents_chunk,
+            'incidents',
+            _lease_refreshes('incident', [incident.id for incident in due[tier]]),
+            app.config['INCIDENT_CHUNK_SIZE'],
+            'incidents refreshed',
+            queue=queues.get(tier),
+        )
 
     return True
 
 
 @celery.task(bind=True)
-def _update_incident(self, incident_id):
+def _refresh_teams_chunk(self, teams, processed=0):
+    """
+    Refresh the unresolved incidents of a batch of teams
+
+    :param teams: (list) Dicts holding the team_id and refresh lease of each team
+    :param processed: (int) Teams already processed by earlier attempts
+
+    :return: (int) Number of teams processed
+    """
+    pyduty = pagerduty_client()
+
+    return _process_leased(
+        self,
+        teams,
+        'teams',
+        processed,
+        lambda team: _refresh_lease(f'team:{team["team_id"]}', token=team.get('lease')),
+        lambda team: refresh_team(pyduty, team['team_id']),
+    )
+
+
+@celery.task(bind=True)
+def _update_incidents_chunk(self, incidents, processed=0):
     """
-    Check the status of a ticket and update the status
+    Check the status of a batch of tickets
+
+    :param incidents: (list) Dicts holding the incident_id and refresh lease of each incident
+    :param processed: (int) Incidents already processed by earlier attempts
+
+    :return: (int) Number of incidents processed
     """
-    pyduty = PagerDuty(os.getenv('PAGERDUTY_KEY'))
+    pyduty = pagerduty_client()
 
-    incident = Incidents.query.filter_by(id=incident_id).one_or_none()
+    return _process_leased(
+        self,
+        incidents,
+        'incidents',
+        processed,
+        lambda incident: _refresh_lease(f'incident:{incident["incident_id"]}', token=incident.get('lease')),
+        lambda incident: refresh_incident(pyduty, incident['incident_id']),
+    )
 
-    if incident is None:
-        logger.error(f'Failed to find incident {incident_id}')
-        return False
 
-    resp = pyduty.get_incident(incident_id=incident.incident_id.split('_')[0])
+@celery.task(bind=True)
+def _sync_log_entries(self, lease=None):
+    """
+    Apply the status changes recorded in PagerDuty's log entries since the last sync
+
+    :param lease: (str) Token of the refresh lease held while the sync is queued or running
+    """
+    retrying = False
+
+    def reconcile(team_ids):
+        # The first sync only reads the recent feed, the incidents already open are refreshed once
+        _fan_out(
+            _refresh_teams_chunk,
+            'teams',
+            _lease_refreshes('team', team_ids),
+            app.config['TEAM_CHUNK_SIZE'],
+            'teams reconciled',
+            queue=app.config['INCIDENT_REFRESH_QUEUES'].get('warm'),
+        )
 
-    if resp['status'] != incident.status:
-        logger.info(f'Updated incident {incident.incident_id} with the new status of {resp["status"]}')
+    try:
+        changed = sync_log_entries(
+            pagerduty_client(), datetime.now(timezone.utc).replace(tzinfo=None), app.config, reconcile=reconcile
+        )
+    except RateLimit as err:
+        db.session.rollback()
 
-        incident.status = resp['status']
+        # The retry keeps the lease, unless the sync is out of retries
+        retrying = self.request.retries < app.config['PAGERDUTY_RATE_LIMIT_RETRIES']
+
+        raise _retry_rate_limited(self, err, kwargs={'lease': lease})
+    except RequestFailure as err:
+        db.session.rollback()
+
+        logger.error(f'Failed to query PagerDuty: {err}')
+
+        return False
+    finally:
+        if lease is not None and not retrying:
+            _refresh_lease('log_entries', token=lease).release()
 
-        db.session.commit()
+    if changed:
+        logger.info(f'Updated the status of {changed} incidents from the log entries feed')
 
     return True
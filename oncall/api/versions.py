@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import func, select, update
+
+from oncall import db
+from oncall.api.models import Teams
+
+
+def touch_teams(team_ids):
+    """
+    Bump the data version of teams whose incidents changed, committing is left to the caller
+
+    The version changes in the same transaction as the data, so a response is never
+    served under a version it was not built from.
+
+    :param team_ids: (list) Team primary keys
+
+    :return: None
+    """
+    team_ids = set(team_ids)
+
+    if team_ids:
+        db.session.execute(
+            update(Teams)
+            .where(Teams.id.in_(team_ids))
+            .values(data_version=Teams.data_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def team_version(team_id):
+    """
+    Get the version of a team's data with a single primary key lookup
+
+    Polling a team moves last_checked, every other write bumps data_version.
+
+    :param team_id: Team primary key
+
+    :return: (str) Version, None when the team does not exist
+    """
+    team = db.session.execute(select(Teams.last_checked, Teams.data_version).filter(Teams.id == team_id)).one_or_none()
+
+    if team is None:
+        return None
+
+    return f'{team.last_checked.isoformat() if team.last_checked else ""}:{team.data_version}'
+
+
+def teams_version():
+    """
+    Get the version of every team's data, changing whenever any team is added or changed
+
+    :return: (str) Version
+    """
+    teams = db.session.execute(
+        select(func.count(Teams.id), func.coalesce(func.sum(Teams.data_version), 0), func.max(Teams.last_checked))
+    ).one()
+
+    return ':'.join(str(value) for value in teams)
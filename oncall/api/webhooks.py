@@ -0,0 +1,68 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+
+from flask import Blueprint, current_app, jsonify, request
+
+from oncall import db
+from oncall.api.ingest import upsert_incident
+from oncall.api.models import Teams
+from oncall.api.scheduler import defer_next_poll
+from oncall.utils.pagerduty import verify_signature
+
+logger = logging.getLogger(__name__)
+
+webhooks = Blueprint('webhooks', __name__, url_prefix='/webhooks')
+
+
+@webhooks.route('/pagerduty', methods=['POST'])
+def pagerduty():
+    """
+    Receive PagerDuty v3 incident events
+    """
+    if not verify_signature(
+        current_app.config['PAGERDUTY_WEBHOOK_SECRETS'],
+        request.get_data(),
+        request.headers.get('X-PagerDuty-Signature'),
+    ):
+        return jsonify({'error': 'invalid signature'}), HTTPStatus.UNAUTHORIZED
+
+    event = (request.get_json(silent=True) or {}).get('event')
+
+    if not isinstance(event, dict):
+        return jsonify({'error': 'invalid event received'}), HTTPStatus.BAD_REQUEST
+
+    incident = event.get('data') or {}
+
+    # Only events carrying the incident itself change what is stored, e.g. not incident.annotated
+    if event.get('resource_type') != 'incident' or incident.get('type') != 'incident':
+        return jsonify({'incidents': 0}), HTTPStatus.OK
+
+    try:
+        changed_at = datetime.fromisoformat(event['occurred_at']).astimezone(timezone.utc).replace(tzinfo=None)
+        team_ids = [team['id'] for team in incident.get('teams', [])]
+
+        # Incident events carry no summary, build it the way the REST API does
+        incident = {'summary': f'[#{incident["number"]}] {incident["title"]}', **incident}
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'invalid event received'}), HTTPStatus.BAD_REQUEST
+
+    teams = Teams.query.filter(Teams.team_id.in_(team_ids)).all()
+
+    try:
+        changed = sum(upsert_incident(incident, team, changed_at) for team in teams)
+    except (KeyError, ValueError):
+        db.session.rollback()
+
+        return jsonify({'error': 'invalid incident received'}), HTTPStatus.BAD_REQUEST
+
+    defer_next_poll(
+        [team.id for team in teams],
+        datetime.now(timezone.utc).replace(tzinfo=None)
+        + timedelta(seconds=current_app.config['PAGERDUTY_WEBHOOK_RECONCILE_INTERVAL']),
+    )
+    db.session.commit()
+
+    logger.info(f'Applied {event.get("event_type")} for {incident["id"]} to {changed} incidents')
+
+    return jsonify({'incidents': changed}), HTTPStatus.OK
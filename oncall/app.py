@@ -1,8 +1,10 @@
 from oncall import celery as ext_celery
 from oncall import create_app
 from oncall.api.routes import api
+from oncall.api.webhooks import webhooks
 
 app = create_app()
 celery = ext_celery.celery
 
 app.register_blueprint(api)
+app.register_blueprint(webhooks)
@@ -0,0 +1,104 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from oncall import db
+from oncall.api.backfill import backfill_slice, plan_slices
+from oncall.api.models import Teams
+from oncall.utils.pagerduty import RateLimit
+
+
+def _find_team(team):
+    """
+    Find a team by primary key, PagerDuty team ID or alias
+    """
+    if team.isdigit():
+        return db.session.get(Teams, int(team))
+
+    return Teams.query.filter((Teams.team_id == team) | (Teams.alias == team)).one_or_none()
+
+
+@click.command('backfill')
+@click.argument('team')
+@click.option('--since', type=click.DateTime(), required=True, help='Start of the range in UTC')
+@click.option('--until', type=click.DateTime(), default=None, help='End of the range in UTC, defaults to now')
+@click.option('--sync', is_flag=True, help='Fetch the slices in this process instead of queueing them')
+@with_appcontext
+def backfill_command(team, since, until, sync):
+    """
+    Backfill a team's incidents between two dates
+    """
+    from oncall.api.tasks import backfill_team, pagerduty_client
+
+    record = _find_team(team)
+
+    if record is None:
+        raise click.ClickException(f'team {team} does not exist')
+
+    since = since.replace(tzinfo=timezone.utc)
+    until = until.replace(tzinfo=timezone.utc) if until else datetime.now(timezone.utc)
+
+    if since >= until:
+        raise click.ClickException('since must be before until')
+
+    if not sync:
+        backfill_team.delay(team_id=record.id, since=since, until=until)
+
+        click.echo(f'Queued a backfill of {record.name} from {since} to {until}')
+        return
+
+    slice_ids = plan_slices(record.id, since, until, timedelta(hours=current_app.config['BACKFILL_SLICE_HOURS']))
+    db.session.commit()
+
+    pyduty = pagerduty_client(concurrent=True)
+
+    for position, slice_id in enumerate(slice_ids, start=1):
+        while True:
+            try:
+                backfill_slice(pyduty, slice_id)
+                break
+            except RateLimit as err:
+                click.echo(f'Rate limited, retrying in {err.retry_after}s')
+                time.sleep(err.retry_after)
+
+        click.echo(f'Backfilled slice {position}/{len(slice_ids)}')
+
+
+@click.group('rollups')
+def rollups_command():
+    """
+    Manage the incident rollups
+    """
+
+
+@rollups_command.command('rebuild')
+@click.option('--team', default=None, help='Only rebuild this team, by ID, PagerDuty team ID or alias')
+@with_appcontext
+def rebuild_rollups_command(team):
+    """
+    Recount the incident rollups from the incidents table
+    """
+    from oncall.api.rollups import rebuild_rollups
+    from oncall.api.versions import touch_teams
+
+    team_id = None
+
+    if team is not None:
+        record = _find_team(team)
+
+        if record is None:
+            raise click.ClickException(f'team {team} does not exist')
+
+        team_id = record.id
+
+    rows = rebuild_rollups(team_id)
+
+    # Responses built from the old rollups are no longer served
+    touch_teams([team_id] if team_id is not None else db.session.scalars(select(Teams.id)))
+    db.session.commit()
+
+    click.echo(f'Rebuilt {rows} rollups')
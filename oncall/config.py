@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 
@@ -18,10 +19,97 @@ class BaseConfig:
 
     INITIAL_INCIDENT_LOOKBACK = os.getenv('INITIAL_INCIDENT_LOOKBACK', 90)
 
+    # Secrets of the PagerDuty v3 webhook subscriptions, comma separated, events signed by any of them are accepted
+    PAGERDUTY_WEBHOOK_SECRETS = [secret for secret in os.getenv('PAGERDUTY_WEBHOOK_SECRETS', '').split(',') if secret]
+    # Teams receiving webhooks are only polled every PAGERDUTY_WEBHOOK_RECONCILE_INTERVAL seconds to reconcile them
+    PAGERDUTY_WEBHOOK_RECONCILE_INTERVAL = int(os.getenv('PAGERDUTY_WEBHOOK_RECONCILE_INTERVAL', 3600))
+
+    # Adaptive polling, busy teams are polled every POLL_MIN_INTERVAL seconds while quiet teams back off
+    # exponentially up to POLL_MAX_INTERVAL seconds, the most stale a team is allowed to become
+    POLL_MIN_INTERVAL = int(os.getenv('POLL_MIN_INTERVAL', 60))
+    POLL_MAX_INTERVAL = int(os.getenv('POLL_MAX_INTERVAL', 1800))
+    # Window the recent incident rate of a team is measured over
+    POLL_RATE_WINDOW_HOURS = int(os.getenv('POLL_RATE_WINDOW_HOURS', 24))
+
+    # Backfills are split into slices of this many hours, small enough that a slice stays well under
+    # PagerDuty's pagination offset ceiling of 10,000 incidents
+    BACKFILL_SLICE_HOURS = int(os.getenv('BACKFILL_SLICE_HOURS', 24))
+    # Number of slices handled by a single celery task, 1 runs every slice in parallel
+    BACKFILL_CHUNK_SIZE = int(os.getenv('BACKFILL_CHUNK_SIZE', 1))
+
+    # How unresolved incidents are refreshed, "batched" lists each team's open incidents in one paginated
+    # query, "individual" fetches every incident on its own and "log_entries" reads the account's log entries
+    # feed from where the last sync stopped
+    INCIDENT_REFRESH_MODE = os.getenv('INCIDENT_REFRESH_MODE', 'batched')
+    # Seconds of the log entries feed read again on every sync, picking up entries PagerDuty recorded late
+    LOG_ENTRIES_OVERLAP = int(os.getenv('LOG_ENTRIES_OVERLAP', 60))
+
+    # Unresolved incidents are refreshed by tier. Triggered or high urgency incidents are refreshed every cycle,
+    # other incidents every INCIDENT_REFRESH_WARM_INTERVAL seconds or INCIDENT_REFRESH_DECAY of their age, whichever
+    # is longer, and incidents open for more than INCIDENT_STALE_AGE_HOURS every INCIDENT_STALE_REFRESH_INTERVAL seconds
+    INCIDENT_REFRESH_WARM_INTERVAL = int(os.getenv('INCIDENT_REFRESH_WARM_INTERVAL', 600))
+    INCIDENT_REFRESH_DECAY = float(os.getenv('INCIDENT_REFRESH_DECAY', 0.1))
+    INCIDENT_STALE_AGE_HOURS = int(os.getenv('INCIDENT_STALE_AGE_HOURS', 72))
+    INCIDENT_STALE_REFRESH_INTERVAL = int(os.getenv('INCIDENT_STALE_REFRESH_INTERVAL', 21600))
+    # Celery queue each refresh tier is routed to, e.g. {"hot": "refresh-hot", "cold": "refresh-cold"}, tiers
+    # without a queue use the default queue. Workers have to consume the queues configured
+    INCIDENT_REFRESH_QUEUES = json.loads(os.getenv('INCIDENT_REFRESH_QUEUES', '{}'))
+    # Seconds before an abandoned refresh lease expires, a team or incident is not dispatched again while its
+    # previous refresh is queued or running
+    REFRESH_LEASE_TTL = int(os.getenv('REFRESH_LEASE_TTL', 600))
+
+    # Incidents returned per page when paging through /incidents/<team_id>, and the largest page a client may ask for
+    INCIDENT_PAGE_SIZE = int(os.getenv('INCIDENT_PAGE_SIZE', 500))
+    INCIDENT_MAX_PAGE_SIZE = int(os.getenv('INCIDENT_MAX_PAGE_SIZE', 5000))
+
+    # Response cache of /teams, /mostincidents and /incidents/<team_id>, "memory" keeps an LRU of
+    # RESPONSE_CACHE_MAX_ENTRIES responses in each process, "redis" shares the responses between processes and an
+    # empty value disables it. Entries are keyed by their team's data version, so changes are served at once, and
+    # expire after RESPONSE_CACHE_TTL seconds
+    RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'memory')
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 30))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+
+    # Concurrent identical requests to the cached endpoints wait on a single query, "memory" coalesces the requests
+    # of each process, "redis" those of every process through a Redis lock and an empty value disables it. A request
+    # waits at most SINGLEFLIGHT_TIMEOUT seconds before running the query itself
+    SINGLEFLIGHT = os.getenv('SINGLEFLIGHT', 'memory')
+    SINGLEFLIGHT_TIMEOUT = int(os.getenv('SINGLEFLIGHT_TIMEOUT', 30))
+
+    # JSON serialisation of the API, "orjson" uses orjson when it is installed and "json" the standard library
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'orjson')
+
+    # Rows fetched from the database at a time when exporting incidents
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+    # Number of teams or incidents handled by a single celery task when fanning out work
+    TEAM_CHUNK_SIZE = int(os.getenv('TEAM_CHUNK_SIZE', 10))
+    INCIDENT_CHUNK_SIZE = int(os.getenv('INCIDENT_CHUNK_SIZE', 100))
+
+    # Seconds before an abandoned per team ingestion lease expires
+    INGEST_LEASE_TTL = int(os.getenv('INGEST_LEASE_TTL', 1800))
+
+    # PagerDuty HTTP client, the connection pool is shared by every task in a worker process
+    PAGERDUTY_POOL_SIZE = int(os.getenv('PAGERDUTY_POOL_SIZE', 10))
+    PAGERDUTY_MAX_RETRIES = int(os.getenv('PAGERDUTY_MAX_RETRIES', 3))
+    # Pages of a backfill slice fetched from PagerDuty at once
+    PAGERDUTY_CONCURRENCY = int(os.getenv('PAGERDUTY_CONCURRENCY', 5))
+
+    # Requests per minute shared by every worker using the same API key, 0 disables the limiter
+    PAGERDUTY_RATE_LIMIT = int(os.getenv('PAGERDUTY_RATE_LIMIT', 900))
+    # Per API key overrides of PAGERDUTY_RATE_LIMIT, e.g. {"u+XXXXXXXXX": 300}
+    PAGERDUTY_RATE_LIMITS = json.loads(os.getenv('PAGERDUTY_RATE_LIMITS', '{}'))
+    # Longest a request waits in the worker for a token, a longer wait raises RateLimit and reschedules the task
+    PAGERDUTY_RATE_LIMIT_MAX_WAIT = float(os.getenv('PAGERDUTY_RATE_LIMIT_MAX_WAIT', 2))
+    # Times a rate limited task is rescheduled before giving up
+    PAGERDUTY_RATE_LIMIT_RETRIES = int(os.getenv('PAGERDUTY_RATE_LIMIT_RETRIES', 5))
+
     # Celery configuration
     BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/0')
 
+    REDIS_URL = os.getenv('REDIS_URL', BROKER_URL)
+
     CELERY_ACCEPT_CONTENT = ['application/json']
     CELERY_TASK_SERIALIZER = 'json'
     CELERY_RESULT_SERIALIZER = 'json'
@@ -36,13 +124,13 @@ class BaseConfig:
         },
         'populate_incidents': {
             'task': 'oncall.api.tasks.populate_incidents',
-            # Every 5 minutes
-            'schedule': crontab(minute='*/5'),
+            # Every minute, only teams that are due are polled
+            'schedule': crontab(minute='*'),
         },
         'update_incidents': {
             'task': 'oncall.api.tasks.update_incidents',
-            # Every 5 minutes
-            'schedule': crontab(minute='*/10'),
+            # Every minute, only incidents that are due are refreshed
+            'schedule': crontab(minute='*'),
         },
     }
 
@@ -53,6 +141,12 @@ class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:////tmp/test.db'
 
+    PAGERDUTY_RATE_LIMIT = 0
+
+    RESPONSE_CACHE = ''
+
+    PAGERDUTY_WEBHOOK_SECRETS = ['test-webhook-secret']
+
 
 class DevelopmentConfig(BaseConfig):
     """
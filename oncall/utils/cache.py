@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from http import HTTPStatus
+
+from flask import current_app, request
+
+from oncall.utils import metrics
+from oncall.utils.redis import get_redis
+from oncall.utils.singleflight import get_singleflight
+
+_caches_lock = threading.Lock()
+
+
+class MemoryCache:
+    """
+    In-process LRU cache whose entries expire after ttl seconds
+    """
+
+    def __init__(self, max_entries, ttl):
+        """
+        :param max_entries: (int) Entries kept before the least recently used is evicted
+        :param ttl: (int) Seconds an entry is served for
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached value
+
+        :param key: (str) Cache key
+
+        :return: (bytes) The value, None when missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        """
+        Cache a value, evicting the least recently used entries when full
+
+        :param key: (str) Cache key
+        :param value: (bytes) Value to cache
+
+        :return: None
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, name):
+        """
+        Increment a counter of this process, the cache does not depend on Redis
+
+        :param name: (str) Counter name
+
+        :return: None
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def counters(self):
+        """
+        Get the counters of this process
+
+        :return: (dict) Counter values keyed by name
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+class RedisCache:
+    """
+    Cache shared by every process through Redis, entries expire after ttl seconds
+    """
+
+    def __init__(self, redis, ttl, prefix='oncall:cache:'):
+        """
+        :param redis: (Redis) Redis client
+        :param ttl: (int) Seconds an entry is served for
+        :param prefix: (str) Prefix of the Redis keys
+        """
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        """
+        Get a cached value
+
+        :param key: (str) Cache key
+
+        :return: (bytes) The value, None when missing or expired
+        """
+        return self.redis.get(self.prefix + key)
+
+    def set(self, key, value):
+        """
+        Cache a value
+
+        :param key: (str) Cache key
+        :param value: (bytes) Value to cache
+
+        :return: None
+        """
+        self.redis.set(self.prefix + key, value, ex=self.ttl)
+
+    def count(self, name):
+        """
+        Increment a cluster wide counter
+
+        :param name: (str) Counter name
+
+        :return: None
+        """
+        metrics.incr(self.redis, name)
+
+    def counters(self):
+        """
+        Get the counters kept by the cache itself, none as they are in the cluster wide metrics
+
+        :return: (dict) Counter values keyed by name
+        """
+        return {}
+
+
+def get_cache():
+    """
+    Get the response cache configured by RESPONSE_CACHE
+
+    :return: (MemoryCache|RedisCache) The cache, None when caching is disabled
+    """
+    backend = current_app.config['RESPONSE_CACHE']
+
+    if not backend:
+        return None
+
+    if backend == 'redis':
+        return RedisCache(get_redis(), current_app.config['RESPONSE_CACHE_TTL'])
+
+    if backend != 'memory':
+        raise ValueError(f'Unknown response cache backend {backend}')
+
+    cache = current_app.extensions.get('response_cache')
+
+    if cache is None:
+        with _caches_lock:
+            cache = current_app.extensions.setdefault(
+                'response_cache',
+                MemoryCache(current_app.config['RESPONSE_CACHE_MAX_ENTRIES'], current_app.config['RESPONSE_CACHE_TTL']),
+            )
+
+    return cache
+
+
+def etag(version):
+    """
+    Build the strong ETag of the current request from its route, normalised parameters and data version
+
+    The ETag is also the key the response is cached under.
+
+    :param version: (str) Version of the data the response is built from
+
+    :return: (str) ETag
+    """
+    params = {
+        'endpoint': request.endpoint,
+        'view_args': request.view_args,
+        'args': sorted((name, sorted(values)) for name, values in request.args.to_dict(flat=False).items()),
+        'json': request.get_json(silent=True),
+        'version': version,
+    }
+
+    return hashlib.sha256(json.dumps(params, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _pack(response):
+    """
+    Pack a rendered response into bytes that can be shared between requests
+    """
+    return f'{response.status_code} {response.mimetype}\n'.encode() + response.get_data()
+
+
+def _unpack(value):
+    """
+    Build a response from one packed with _pack
+    """
+    head, body = value.split(b'\n', 1)
+    status, mimetype = head.decode().split(' ', 1)
+
+    return current_app.response_class(body, status=int(status), mimetype=mimetype)
+
+
+def conditional(version, cache=True):
+    """
+    Answer conditional requests and cache the successful JSON responses of a view until its data changes
+
+    The version is looked up before the view runs, a request whose If-None-Match matches
+    is answered with 304 Not Modified without running the view. Concurrent requests for
+    the same data are coalesced, only one of them runs the view.
+
+    :param version: Callable taking the view arguments and returning the version of the data the response is built
+        from, None when there is nothing to version (e.g. the team does not exist)
+    :param cache: (bool) Cache and coalesce the responses, streamed responses only get an ETag
+
+    :return: Decorator
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            current = version(**kwargs)
+
+            if current is None:
+                return view(**kwargs)
+
+            key = etag(current)
+
+            if request.if_none_match.contains(key):
+                response = current_app.response_class(status=HTTPStatus.NOT_MODIFIED)
+                response.set_etag(key)
+
+                return response
+
+            responses = get_cache() if cache else None
+
+            if responses is not None:
+                body = responses.get(key)
+
+                if body is not None:
+                    responses.count('response_cache_hits')
+
+                    response = current_app.response_class(body, mimetype='application/json')
+                    response.headers['X-Cache'] = 'HIT'
+                    response.set_etag(key)
+
+                    return response
+
+                responses.count('response_cache_misses')
+
+            def render():
+                response = current_app.make_response(view(**kwargs))
+
+                if responses is not None and response.status_code == HTTPStatus.OK and response.is_json:
+                    responses.set(key, response.get_data())
+
+                return response
+
+            flights = get_singleflight() if cache else None
+
+            if flights is None:
+                response = render()
+            else:
+                # Concurrent requests for the same data wait on a single render of the response
+                response = _unpack(flights.do(key, lambda: _pack(render())))
+
+            if responses is not None:
+                response.headers['X-Cache'] = 'MISS'
+
+            if response.status_code == HTTPStatus.OK:
+                response.set_etag(key)
+
+            return response
+
+        return wrapper
+
+    return decorator
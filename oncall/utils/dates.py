@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timezone
+
+
+def naive_utc(date):
+    """
+    Convert a datetime to the naive UTC form stored in the database
+
+    :param date: (datetime) Naive UTC or timezone aware time
+
+    :return: (datetime) Naive UTC time
+    """
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
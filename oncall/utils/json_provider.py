@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library is used without it
+    orjson = None
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider writing dates as ISO 8601, like every other time in the API
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return o.isoformat()
+
+        return _default(o)
+
+
+class ORJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, dates are written natively as ISO 8601
+
+    Output matches JSONProvider, apart from non-ASCII characters which are written as UTF-8 instead of being escaped.
+    """
+
+    @staticmethod
+    def _option(sort_keys, indent):
+        """
+        orjson options for the serialisation settings
+        """
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+
+        if indent:
+            option |= orjson.OPT_INDENT_2
+
+        return option
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialise data as a JSON string, sort_keys and indent are the only keyword arguments honoured
+
+        :param obj: Data to serialise
+
+        :return: (str) JSON
+        """
+        option = self._option(kwargs.get('sort_keys', self.sort_keys), kwargs.get('indent') is not None)
+
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        """
+        Deserialise JSON from a string or UTF-8 bytes
+
+        :param s: (str|bytes) JSON
+
+        :return: Data
+        """
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """
+        Serialise the arguments straight to the bytes of a JSON response
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+
+        body = orjson.dumps(obj, default=self.default, option=self._option(self.sort_keys, indent))
+
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def create_provider(app):
+    """
+    Create the JSON provider of an app, orjson when it is installed unless JSON_PROVIDER is set to "json"
+
+    :param app: (Flask) Application
+
+    :return: (JSONProvider) JSON provider
+    """
+    if orjson is not None and app.config['JSON_PROVIDER'] == 'orjson':
+        return ORJSONProvider(app)
+
+    return JSONProvider(app)
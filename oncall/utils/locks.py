@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from uuid import uuid4
+
+# Only delete the lease when it is still held by the caller
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+
+return 0
+"""
+
+
+class Lease:
+    """
+    Redis lease held by at most one owner at a time, expiring after ttl seconds
+    """
+
+    def __init__(self, redis, key, ttl, token=None):
+        """
+        :param redis: (Redis) Redis client
+        :param key: (str) Redis key holding the lease
+        :param ttl: (int) Seconds before an abandoned lease expires
+        :param token: (str) Owner token, pass the token of an existing lease to release it
+        """
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.token = token or uuid4().hex
+
+    def acquire(self):
+        """
+        Take the lease if nobody else holds it
+
+        :return: (bool) True when the lease was acquired
+        """
+        return bool(self.redis.set(self.key, self.token, nx=True, ex=self.ttl))
+
+    def release(self):
+        """
+        Give up the lease, leaving it alone if it expired and was taken by someone else
+
+        :return: (bool) True when the lease was released
+        """
+        return bool(self.redis.register_script(RELEASE_SCRIPT)(keys=[self.key], args=[self.token]))
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+METRICS_KEY = 'oncall:metrics'
+
+
+def incr(redis, name, amount=1):
+    """
+    Increment a cluster wide counter
+
+    :param redis: (Redis) Redis client
+    :param name: (str) Counter name
+    :param amount: (int) Amount to add
+
+    :return: None
+    """
+    redis.hincrby(METRICS_KEY, name, amount)
+
+
+def get_metrics(redis):
+    """
+    Get every counter
+
+    :param redis: (Redis) Redis client
+
+    :return: (dict) Counter values keyed by name
+    """
+    return {name.decode(): int(value) for name, value in redis.hgetall(METRICS_KEY).items()}
@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import datetime
+import hashlib
+import hmac
+import os
+import threading
+from email.utils import parsedate_to_datetime
 from http import HTTPStatus
 from urllib.parse import urljoin
 
 from requests import Request, Session
-from retry import retry
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class RequestFailure(Exception):
@@ -17,16 +24,136 @@ class InvalidTimeRange(Exception):
 
 
 class RateLimit(Exception):
-    pass
+    def __init__(self, message, retry_after=30):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size=10, max_retries=3):
+    """
+    Get the pooled HTTP session shared by every PagerDuty client in this process
+
+    Sessions are keyed by PID so a forked Celery worker never reuses sockets
+    inherited from its parent.
+
+    :param pool_size: (int) Number of keep-alive connections to hold per host
+    :param max_retries: (int) Retries for connection errors and 5xx responses
+
+    :return: (Session) Pooled session
+    """
+    key = (os.getpid(), pool_size, max_retries)
+
+    session = _sessions.get(key)
+
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+
+            if session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=pool_size,
+                    pool_maxsize=pool_size,
+                    max_retries=Retry(
+                        total=max_retries,
+                        backoff_factor=0.5,
+                        status_forcelist=(
+                            HTTPStatus.INTERNAL_SERVER_ERROR,
+                            HTTPStatus.BAD_GATEWAY,
+                            HTTPStatus.SERVICE_UNAVAILABLE,
+                            HTTPStatus.GATEWAY_TIMEOUT,
+                        ),
+                        allowed_methods=frozenset(['GET']),
+                        raise_on_status=False,
+                    ),
+                )
+
+                session = Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+
+                _sessions[key] = session
+
+    return session
+
+
+def close_sessions():
+    """
+    Close every pooled session, e.g. when a worker process shuts down
+
+    :return: None
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+
+        _sessions.clear()
+
+
+def verify_signature(secrets, body, header):
+    """
+    Verify the signature PagerDuty sends with a v3 webhook
+
+    :param secrets: (list) Webhook subscription secrets, any of which may have signed the body
+    :param body: (bytes) Raw request body
+    :param header: (str) X-PagerDuty-Signature header, one or more comma separated v1=<hex digest> signatures
+
+    :return: (bool) valid
+    """
+    signatures = [signature.strip() for signature in (header or '').split(',')]
+
+    for secret in secrets:
+        expected = 'v1=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+        if any(hmac.compare_digest(expected, signature) for signature in signatures):
+            return True
+
+    return False
 
 
 class PagerDuty:
     PAGERDUTY_ENDPOINT = 'https://api.pagerduty.com'
 
-    def __init__(self, api):
+    def __init__(self, api, endpoint=None, pool_size=10, max_retries=3, rate_limiter=None):
         self.api = api
+        self.endpoint = endpoint or self.PAGERDUTY_ENDPOINT
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+
+    @staticmethod
+    def _retry_after(headers, default=30):
+        """
+        Work out how long to back off from PagerDuty's rate limit headers
+
+        :param headers: Response headers
+        :param default: (int) Seconds to wait when no header is present
+
+        :return: (int) Seconds until the next request can be made
+        """
+        for header in ('Retry-After', 'ratelimit-reset'):
+            value = headers.get(header)
+
+            if value is None:
+                continue
+
+            try:
+                return max(1, int(float(value)))
+            except ValueError:
+                pass
+
+            try:
+                delta = parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)
+            except (TypeError, ValueError):
+                continue
+
+            return max(1, int(delta.total_seconds()))
+
+        return default
 
-    @retry(exceptions=RateLimit, tries=3, delay=30, backoff=2)
     def _query(self, method, endpoint, payload=None, timeout=5):
         """
         Make HTTPS request to PagerDuty
@@ -43,11 +170,14 @@ class PagerDuty:
             'Authorization': f'Token token={self.api}',
         }
 
-        session = Session()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        session = get_session(pool_size=self.pool_size, max_retries=self.max_retries)
 
         request = Request(
             method=method,
-            url=urljoin(self.PAGERDUTY_ENDPOINT, endpoint),
+            url=urljoin(self.endpoint, endpoint),
             params=payload,
             headers=headers,
         )
@@ -57,10 +187,13 @@ class PagerDuty:
 
         if resp.status_code != HTTPStatus.OK:
             if resp.status_code == HTTPStatus.TOO_MANY_REQUESTS:
-                raise RateLimit(f'{urljoin(self.PAGERDUTY_ENDPOINT, endpoint)} is being rate limited')
+                raise RateLimit(
+                    f'{urljoin(self.endpoint, endpoint)} is being rate limited',
+                    retry_after=self._retry_after(resp.headers),
+                )
 
             raise RequestFailure(
-                f'{urljoin(self.PAGERDUTY_ENDPOINT, endpoint)} returned a status code: {resp.status_code} ({resp.json().get("error", {}).get("message")})'
+                f'{urljoin(self.endpoint, endpoint)} returned a status code: {resp.status_code} ({resp.json().get("error", {}).get("message")})'
             )
 
         return resp.json()
@@ -114,6 +247,34 @@ class PagerDuty:
             if not incidents.get('more', False):
                 return
 
+    def get_incidents_by_status(self, team_id: str, statuses, offset=25):
+        """
+        Query a team's incidents that are currently in one of the given statuses
+
+        :param team_id: (str) Team ID
+        :param statuses: (list) Statuses to filter on, e.g. triggered and acknowledged
+        :param offset: (int) Pagination offset
+
+        :return: A generator of incidents
+        """
+        payload = {
+            'team_ids[]': team_id,
+            'statuses[]': list(statuses),
+            'date_range': 'all',
+            'time_zone': 'UTC',
+            'offset': 0,
+        }
+
+        while True:
+            incidents = self._query(method='GET', endpoint='incidents', payload=payload)
+
+            yield incidents.get('incidents', [])
+
+            payload['offset'] += offset
+
+            if not incidents.get('more', False):
+                return
+
     def get_incident(self, incident_id):
         """
         Get a specific incident
@@ -124,6 +285,36 @@ class PagerDuty:
         """
         return self._query(method='GET', endpoint=f'incidents/{incident_id}').get('incident', {})
 
+    def get_log_entries(self, since: datetime, until: datetime, offset=25):
+        """
+        Query the account's log entries, only the key incident changes
+
+        :param since: (datetime) Date in UTC to begin query
+        :param until: (datetime) Date in UTC to end query
+        :param offset: (int) Pagination offset
+
+        :return: A generator of log entries
+        """
+        self._check_date(since, until)
+
+        payload = {
+            'time_zone': 'UTC',
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+            'is_overview': 'true',
+            'offset': 0,
+        }
+
+        while True:
+            log_entries = self._query(method='GET', endpoint='log_entries', payload=payload)
+
+            yield log_entries.get('log_entries', [])
+
+            payload['offset'] += offset
+
+            if not log_entries.get('more', False):
+                return
+
     def get_teams(self, offset=25):
         """
         Get a list of teams
@@ -199,3 +390,200 @@ class PagerDuty:
                 'until': until.isoformat(),
             },
         )
+
+
+class AsyncPagerDuty(PagerDuty):
+    """
+    Asyncio variant of the PagerDuty client
+
+    Paginated endpoints ask for the total number of records with the first page
+    and then fetch the remaining offsets concurrently, never running more than
+    ``concurrency`` requests at once. Requests are sent from worker threads over
+    the pooled session so connections are still reused.
+    """
+
+    def __init__(self, api, concurrency=5, **kwargs):
+        super().__init__(api, **kwargs)
+        self.concurrency = concurrency
+
+    async def _aquery(self, method, endpoint, payload=None):
+        """
+        Make an HTTPS request to PagerDuty without blocking the event loop
+
+        :param method: HTTP method
+        :param endpoint: HTTP endpoint to
+        :return: Json Response
+        """
+        return await asyncio.to_thread(self._query, method=method, endpoint=endpoint, payload=payload)
+
+    async def _paginate(self, endpoint, key, payload, offset):
+        """
+        Fetch every page of a paginated endpoint
+
+        :param endpoint: HTTP endpoint to
+        :param key: (str) Key holding the records in each page
+        :param payload: (dict) Query parameters shared by every page
+        :param offset: (int) Pagination offset
+
+        :return: An async generator of pages, in offset order
+        """
+        first = await self._aquery(
+            method='GET',
+            endpoint=endpoint,
+            payload={**payload, 'offset': 0, 'limit': offset, 'total': 'true'},
+        )
+
+        yield first.get(key, [])
+
+        if not first.get('more', False):
+            return
+
+        total = first.get('total')
+
+        if total is None:
+            # PagerDuty did not return a total, fall back to walking the pages
+            page = {'more': True}
+            next_offset = offset
+
+            while page.get('more', False):
+                page = await self._aquery(
+                    method='GET',
+                    endpoint=endpoint,
+                    payload={**payload, 'offset': next_offset, 'limit': offset},
+                )
+
+                yield page.get(key, [])
+
+                next_offset += offset
+
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(page_offset):
+            async with semaphore:
+                return await self._aquery(
+                    method='GET',
+                    endpoint=endpoint,
+                    payload={**payload, 'offset': page_offset, 'limit': offset},
+                )
+
+        pages = [asyncio.ensure_future(fetch(page_offset)) for page_offset in range(offset, total, offset)]
+
+        try:
+            for page in pages:
+                yield (await page).get(key, [])
+        finally:
+            for page in pages:
+                page.cancel()
+
+    async def get_incidents(self, team_id: str, since: datetime, until: datetime, offset=25):
+        """
+        Query all the incidents for a specific team
+
+        :param team_id: (str) Team ID
+        :param since: (str) Date in UTC to begin query
+        :param until: (str) Date in UTC to end query
+        :param offset: (int) Pagination offset
+
+        :return: An async generator of incidents
+        """
+        self._check_date(since, until)
+
+        payload = {
+            'team_ids[]': team_id,
+            'time_zone': 'UTC',
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+        }
+
+        async for incidents in self._paginate('incidents', 'incidents', payload, offset):
+            yield incidents
+
+    async def get_incident(self, incident_id):
+        """
+        Get a specific incident
+
+        :param incident_id: (str) Incident ID
+
+        :return: (dict) incident details
+        """
+        return (await self._aquery(method='GET', endpoint=f'incidents/{incident_id}')).get('incident', {})
+
+    async def get_log_entries(self, since: datetime, until: datetime, offset=25):
+        """
+        Query the account's log entries, only the key incident changes
+
+        :param since: (datetime) Date in UTC to begin query
+        :param until: (datetime) Date in UTC to end query
+        :param offset: (int) Pagination offset
+
+        :return: An async generator of log entries
+        """
+        self._check_date(since, until)
+
+        payload = {
+            'time_zone': 'UTC',
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+            'is_overview': 'true',
+        }
+
+        async for log_entries in self._paginate('log_entries', 'log_entries', payload, offset):
+            yield log_entries
+
+    async def get_teams(self, offset=25):
+        """
+        Get a list of teams
+
+        :param offset: (int) Pagination offset
+
+        :return: An async generator of teams
+        """
+        async for teams in self._paginate('teams', 'teams', {}, offset):
+            yield teams
+
+    async def get_team(self, team_id):
+        """
+        Get a specific team
+
+        :param team_id: (str) Team ID
+
+        :return: (dict) Team
+        """
+        return await self._aquery(method='GET', endpoint=f'teams/{team_id}')
+
+    async def get_schedules(self, team_id, offset=25):
+        """
+        Get a teams list of schedules
+
+        :param team_id: (str) Team ID
+        :param offset: (int) Pagination offset
+
+        :return: An async generator of a teams schedules
+        """
+        async for schedules in self._paginate('schedules', 'schedules', {'team_ids[]': team_id}, offset):
+            yield schedules
+
+    async def get_schedule(self, schedule_id, since, until):
+        """
+        Get a specific schedule with a finalized oncall
+
+        :param schedule_id: (str) Schedule ID
+        :param since: (str) The starting timestamp for the oncall schedule
+        :param until: (str) The ending timestamp for the oncall schedule
+
+        :return: (dict) Finalized oncall schedule
+        """
+        self._check_date(since, until)
+
+        return await self._aquery(
+            method='GET',
+            endpoint=f'schedules/{schedule_id}',
+            payload={
+                'id': schedule_id,
+                'time_zone': 'UTC',
+                'since': since.isoformat(),
+                'until': until.isoformat(),
+            },
+        )
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    """
+    Encode the position after a row as an opaque keyset cursor
+
+    :param created_at: (datetime) created_at of the last row returned
+    :param row_id: (int) Primary key of the last row returned
+
+    :return: (str) Cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), row_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a keyset cursor
+
+    :param cursor: (str) Cursor built with encode_cursor
+
+    :return: (tuple) created_at and primary key of the last row returned
+    """
+    if not isinstance(cursor, str):
+        raise InvalidCursor(f'{cursor!r} is not a cursor')
+
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError) as err:
+        raise InvalidCursor(f'{cursor!r} is not a cursor') from err
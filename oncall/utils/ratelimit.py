@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import math
+import time
+
+from oncall.utils.pagerduty import RateLimit
+
+# Refill the bucket from the Redis clock so every worker agrees on the time, then
+# either take a token or reserve one in the future when the wait is acceptable.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+
+local wait = 0
+local granted = 1
+
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+
+    if wait > max_wait then
+        granted = 0
+    end
+end
+
+if granted == 1 then
+    tokens = tokens - 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+
+return {granted, tostring(wait)}
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket stored in Redis and shared by every process using the same key
+    """
+
+    def __init__(self, redis, key, rate, period=60, burst=None, max_wait=2):
+        """
+        :param redis: (Redis) Redis client
+        :param key: (str) Redis key holding the bucket
+        :param rate: (int) Requests allowed per period
+        :param period: (int) Period in seconds
+        :param burst: (int) Bucket capacity, defaults to the rate
+        :param max_wait: (float) Longest time in seconds a caller will sleep for a token, kept short so a worker
+            is not held waiting and longer waits are rescheduled instead
+        """
+        self.key = key
+        self.rate = rate / period
+        self.capacity = burst or rate
+        self.max_wait = max_wait
+
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @classmethod
+    def for_api_key(cls, redis, api_key, rate, **kwargs):
+        """
+        Create the bucket shared by every client using a PagerDuty API key
+
+        :param redis: (Redis) Redis client
+        :param api_key: (str) PagerDuty API key, only a digest is stored in Redis
+        :param rate: (int) Requests allowed per period
+
+        :return: (TokenBucket)
+        """
+        digest = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+        return cls(redis, f'oncall:ratelimit:{digest}', rate, **kwargs)
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available
+
+        :return: (float) Seconds spent waiting
+        """
+        granted, wait = self._script(keys=[self.key], args=[self.capacity, self.rate, self.max_wait])
+
+        wait = float(wait)
+
+        if not int(granted):
+            raise RateLimit(f'{self.key} has no budget for another {wait:.1f}s', retry_after=math.ceil(wait))
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
@@ -0,0 +1,30 @@
+import os
+import threading
+
+from flask import current_app
+from redis import Redis
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_redis(url=None):
+    """
+    Get a Redis client shared by everything in this process
+
+    :param url: (str) Redis URL, defaults to the application's REDIS_URL
+
+    :return: (Redis) Redis client
+    """
+    if url is None:
+        url = current_app.config['REDIS_URL']
+
+    key = (os.getpid(), url)
+
+    client = _clients.get(key)
+
+    if client is None:
+        with _clients_lock:
+            client = _clients.setdefault(key, Redis.from_url(url))
+
+    return client
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from flask import current_app
+
+from oncall.utils.locks import Lease
+from oncall.utils.redis import get_redis
+
+_flights_lock = threading.Lock()
+
+
+class _Call:
+    """
+    A computation in flight and the callers waiting on it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run a computation once for the concurrent callers of a process asking for the same key
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, compute):
+        """
+        Compute the value of a key, or wait on the caller already computing it
+
+        :param key: (str) Identifies the computation
+        :param compute: Callable computing the value
+
+        :return: The value, shared by every caller waiting on it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.value
+
+        try:
+            call.value = compute()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+        return call.value
+
+
+class RedisSingleFlight:
+    """
+    Run a computation once for the concurrent callers of every process asking for the same key
+
+    The first caller takes a Redis lease and publishes the value, the others poll for it. A
+    caller that waited timeout seconds, or saw the lease go without a value, computes the
+    value itself.
+    """
+
+    def __init__(self, redis, timeout, interval=0.05, prefix='oncall:singleflight:'):
+        """
+        :param redis: (Redis) Redis client
+        :param timeout: (int) Seconds a computation may take, and the longest a caller waits on it
+        :param interval: (float) Seconds between polls for the value
+        :param prefix: (str) Prefix of the Redis keys
+        """
+        self.redis = redis
+        self.timeout = timeout
+        self.interval = interval
+        self.prefix = prefix
+
+    def do(self, key, compute):
+        """
+        Compute the value of a key, or wait on the caller already computing it
+
+        :param key: (str) Identifies the computation
+        :param compute: Callable computing the value
+
+        :return: (bytes) The value, shared by every caller waiting on it
+        """
+        lease = Lease(self.redis, f'{self.prefix}lock:{key}', self.timeout)
+        result = f'{self.prefix}result:{key}'
+
+        if lease.acquire():
+            try:
+                value = compute()
+
+                # Callers that saw the lease are still polling, the value only has to outlive them
+                self.redis.set(result, value, ex=self.timeout)
+
+                return value
+            finally:
+                lease.release()
+
+        deadline = time.monotonic() + self.timeout
+
+        while time.monotonic() < deadline:
+            value = self.redis.get(result)
+
+            if value is not None:
+                return value
+
+            if not self.redis.exists(lease.key):
+                # The value is published before the lease is released
+                value = self.redis.get(result)
+
+                if value is not None:
+                    return value
+
+                break
+
+            time.sleep(self.interval)
+
+        return compute()
+
+
+def get_singleflight():
+    """
+    Get the request coalescing configured by SINGLEFLIGHT
+
+    :return: (SingleFlight|RedisSingleFlight) Request coalescing, None when disabled
+    """
+    backend = current_app.config['SINGLEFLIGHT']
+
+    if not backend:
+        return None
+
+    if backend == 'redis':
+        return RedisSingleFlight(get_redis(), current_app.config['SINGLEFLIGHT_TIMEOUT'])
+
+    if backend != 'memory':
+        raise ValueError(f'Unknown singleflight backend {backend}')
+
+    flights = current_app.extensions.get('singleflight')
+
+    if flights is None:
+        with _flights_lock:
+            flights = current_app.extensions.setdefault('singleflight', SingleFlight())
+
+    return flights
@@ -3,12 +3,15 @@ import pytest
 from oncall import create_app, db as _db
 
 from oncall.api.routes import api
+from oncall.api.webhooks import webhooks
+from oncall.utils.pagerduty import close_sessions
 
 
 @pytest.fixture
 def app():
     app = create_app('testing')
     app.register_blueprint(api)
+    app.register_blueprint(webhooks)
     return app
 
 
@@ -25,3 +28,13 @@ def db(app):
 
         _db.session.remove()
         _db.drop_all()
+
+
+@pytest.fixture(autouse=True)
+def pagerduty_sessions():
+    """
+    Drop pooled PagerDuty sessions so a mocked session never leaks between tests
+    """
+    yield
+
+    close_sessions()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+
+from mock import patch
+
+from oncall.api.backfill import backfill_slice, plan_slices
+from oncall.api.models import BackfillSlices, Incidents, Teams
+from oncall.utils.pagerduty import AsyncPagerDuty, RequestFailure
+
+
+def create_team(db):
+    """
+    Create a team to backfill
+    """
+    team = Teams(name='example', team_id='example-id', summary='example SRE', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    return team
+
+
+def incident(incident_id, created_at):
+    """
+    A PagerDuty incident
+    """
+    return {
+        'id': incident_id,
+        'summary': 'The server is on fire.',
+        'created_at': created_at,
+        'status': 'resolved',
+        'title': 'The server is on fire.',
+        'urgency': 'high',
+    }
+
+
+def incidents_page(payload, incidents, total):
+    """
+    A page of PagerDuty's incidents endpoint
+    """
+    return {'incidents': incidents, 'total': total, 'more': payload['offset'] + payload['limit'] < total}
+
+
+def test_plan_slices(db):
+    """
+    Test a range is split into slices aligned on the start of the range
+    """
+    team = create_team(db)
+
+    since = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    until = datetime(2023, 1, 3, 12, tzinfo=timezone.utc)
+
+    slice_ids = plan_slices(team.id, since, until, timedelta(days=1))
+    db.session.commit()
+
+    slices = [db.session.get(BackfillSlices, slice_id) for slice_id in slice_ids]
+
+    assert [(backfill.since, backfill.until) for backfill in slices] == [
+        (datetime(2023, 1, 1), datetime(2023, 1, 2)),
+        (datetime(2023, 1, 2), datetime(2023, 1, 3)),
+        (datetime(2023, 1, 3), datetime(2023, 1, 3, 12)),
+    ]
+
+
+def test_plan_slices_resumes(db):
+    """
+    Test planning the same range again only returns the slices that have not completed
+    """
+    team = create_team(db)
+
+    since = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    until = datetime(2023, 1, 4, tzinfo=timezone.utc)
+
+    first = plan_slices(team.id, since, until, timedelta(days=1))
+
+    db.session.get(BackfillSlices, first[1]).completed_at = datetime.now()
+    db.session.commit()
+
+    assert plan_slices(team.id, since, until, timedelta(days=1)) == [first[0], first[2]]
+    assert BackfillSlices.query.count() == 3
+
+
+def test_backfill_slice(db):
+    """
+    Test backfilling a slice stores its incidents and checkpoints it
+    """
+    team = create_team(db)
+
+    slice_ids = plan_slices(
+        team.id,
+        datetime(2023, 1, 1, tzinfo=timezone.utc),
+        datetime(2023, 1, 2, tzinfo=timezone.utc),
+        timedelta(days=1),
+    )
+    db.session.commit()
+
+    def query(method, endpoint, payload):
+        number = payload['offset'] // payload['limit']
+
+        return incidents_page(payload, [incident(f'P{number}', f'2023-01-01T1{number}:00:00Z')], total=75)
+
+    with patch.object(AsyncPagerDuty, '_query', side_effect=query) as mock_query:
+        pyduty = AsyncPagerDuty('abc123', concurrency=2)
+
+        assert backfill_slice(pyduty, slice_ids[0])
+
+        # The first page asks for the total, the remaining offsets are fetched concurrently
+        assert sorted(call.kwargs['payload']['offset'] for call in mock_query.call_args_list) == [0, 25, 50]
+        assert mock_query.call_args_list[0].kwargs['payload'] == {
+            'team_ids[]': 'example-id',
+            'time_zone': 'UTC',
+            'since': '2023-01-01T00:00:00+00:00',
+            'until': '2023-01-02T00:00:00+00:00',
+            'offset': 0,
+            'limit': 25,
+            'total': 'true',
+        }
+
+        assert sorted(incident.incident_id for incident in Incidents.query.all()) == [
+            'P0_example-id',
+            'P1_example-id',
+            'P2_example-id',
+        ]
+        assert db.session.get(BackfillSlices, slice_ids[0]).completed_at is not None
+
+        # A completed slice is not fetched again
+        assert backfill_slice(pyduty, slice_ids[0])
+
+        assert mock_query.call_count == 3
+
+
+def test_backfill_slice_failure(db):
+    """
+    Test a failed slice is left to be resumed
+    """
+    team = create_team(db)
+
+    slice_ids = plan_slices(
+        team.id,
+        datetime(2023, 1, 1, tzinfo=timezone.utc),
+        datetime(2023, 1, 2, tzinfo=timezone.utc),
+        timedelta(days=1),
+    )
+    db.session.commit()
+
+    with patch.object(AsyncPagerDuty, '_query', side_effect=RequestFailure('boom')):
+        assert not backfill_slice(AsyncPagerDuty('abc123'), slice_ids[0])
+
+    assert db.session.get(BackfillSlices, slice_ids[0]).completed_at is None
+
+
+@patch('oncall.utils.pagerduty.PagerDuty._query')
+def test_backfill_command(mock_query, app, db):
+    """
+    Test the backfill command fetches every slice when run synchronously
+    """
+    create_team(db)
+
+    mock_query.side_effect = lambda method, endpoint, payload: incidents_page(
+        payload, [incident(f'P{payload["since"][9]}', payload['since'])], total=1
+    )
+
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['backfill', 'example-id', '--since', '2023-01-01', '--until', '2023-01-03', '--sync'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Backfilled slice 2/2' in result.output
+
+    assert sorted(incident.incident_id for incident in Incidents.query.all()) == ['P1_example-id', 'P2_example-id']
+    assert BackfillSlices.query.filter(BackfillSlices.completed_at.is_(None)).count() == 0
+
+
+def test_backfill_command_unknown_team(app, db):
+    """
+    Test the backfill command rejects a team that does not exist
+    """
+    result = app.test_cli_runner().invoke(args=['backfill', 'missing', '--since', '2023-01-01'])
+
+    assert result.exit_code != 0
+    assert 'team missing does not exist' in result.output
@@ -0,0 +1,99 @@
+import threading
+from datetime import datetime
+from http import HTTPStatus
+
+from mock import patch
+from sqlalchemy import event
+
+from oncall.api.models import Incidents, Teams
+from oncall.api.rollups import daily_summary
+
+REQUESTS = 8
+
+
+def create_team_and_incident(db):
+    """
+    Create a team with a single incident
+    """
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime(2023, 8, 31))
+
+    db.session.add(team)
+    db.session.commit()
+
+    db.session.add(
+        Incidents(
+            incident_id='123_ABC123',
+            team=team.id,
+            title='Server on Fire',
+            summary='Servers on Fire',
+            description='Servers on Fire',
+            actionable=None,
+            status='resolved',
+            created_at=datetime(2023, 8, 25),
+            urgency='high',
+            annotation=None,
+        )
+    )
+    db.session.commit()
+
+    return team
+
+
+def test_concurrent_requests_query_once(app, db):
+    """
+    Test concurrent identical requests share a single run of the incident queries
+    """
+    team_id = create_team_and_incident(db).id
+
+    lock = threading.Lock()
+    versions, listings = [], []
+    arrived = threading.Event()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        with lock:
+            if 'SELECT teams.last_checked, teams.data_version' in statement:
+                versions.append(statement)
+
+                if len(versions) == REQUESTS:
+                    arrived.set()
+            elif 'FROM incidents LEFT OUTER JOIN annotations' in statement:
+                listings.append(statement)
+
+    def slow_summary(*args):
+        # Hold the first request in its query until every request has looked up the team's version
+        arrived.wait(5)
+
+        return daily_summary(*args)
+
+    responses = []
+
+    def request():
+        resp = app.test_client().post(
+            f'/api/v1/incidents/{team_id}', json={'since': '2023-08-20', 'until': '2023-08-31'}
+        )
+
+        with lock:
+            responses.append(resp)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+
+    try:
+        with patch('oncall.api.routes.daily_summary', side_effect=slow_summary) as mock_summary:
+            threads = [threading.Thread(target=request) for _ in range(REQUESTS)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join(10)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert len(responses) == REQUESTS
+    assert {resp.status_code for resp in responses} == {HTTPStatus.OK}
+    assert all(resp.json == responses[0].json for resp in responses)
+    assert len(responses[0].json['incidents']) == 1
+
+    assert len(versions) == REQUESTS
+    assert mock_summary.call_count == 1
+    assert len(listings) == 1
@@ -0,0 +1,185 @@
+from datetime import datetime
+from http import HTTPStatus
+
+from mock import MagicMock, patch
+from sqlalchemy import event
+
+from oncall.api.models import Incidents, Teams
+from oncall.api.tasks import ingest_team, refresh_incident
+from oncall.api.versions import team_version, touch_teams
+
+QUERY = {'since': '2023-08-20', 'until': '2023-08-31'}
+
+
+def create_team_and_incident(db, team_id='ABC123'):
+    """
+    Create a team with a single triggered incident
+    """
+    team = Teams(name=f'team-{team_id}', team_id=team_id, summary='', last_checked=datetime(2023, 8, 31))
+
+    db.session.add(team)
+    db.session.commit()
+
+    db.session.add(
+        Incidents(
+            incident_id=f'123_{team_id}',
+            team=team.id,
+            title='Server on Fire',
+            summary='Servers on Fire',
+            description='Servers on Fire',
+            actionable=None,
+            status='triggered',
+            created_at=datetime(2023, 8, 25),
+            urgency='high',
+            annotation=None,
+        )
+    )
+    db.session.commit()
+
+    return team
+
+
+def test_touch_teams(db):
+    """
+    Test touching a team only changes that team's version
+    """
+    team = create_team_and_incident(db)
+    other = create_team_and_incident(db, team_id='DEF456')
+
+    version, other_version = team_version(team.id), team_version(other.id)
+
+    touch_teams([team.id])
+    db.session.commit()
+
+    assert team_version(team.id) != version
+    assert team_version(other.id) == other_version
+    assert team_version(404) is None
+
+
+def test_incidents_not_modified(app, db):
+    """
+    Test a matching If-None-Match is answered with 304 after a single lookup of the team
+    """
+    team = create_team_and_incident(db)
+
+    client = app.test_client()
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', json=QUERY)
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers['ETag']
+
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+
+    try:
+        cached = client.post(
+            f'/api/v1/incidents/{team.id}', json=QUERY, headers={'If-None-Match': resp.headers['ETag']}
+        )
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert cached.status_code == HTTPStatus.NOT_MODIFIED
+    assert cached.headers['ETag'] == resp.headers['ETag']
+    assert cached.data == b''
+
+    assert len(executed) == 1
+    assert 'FROM teams' in executed[0]
+    assert 'incidents' not in executed[0]
+
+
+def test_incidents_etag_follows_parameters(app, db):
+    """
+    Test the ETag ignores the order of the parameters but not their values
+    """
+    team = create_team_and_incident(db)
+
+    client = app.test_client()
+
+    etag = client.post(f'/api/v1/incidents/{team.id}', json=QUERY).headers['ETag']
+
+    assert client.post(f'/api/v1/incidents/{team.id}', json=dict(reversed(QUERY.items()))).headers['ETag'] == etag
+
+    resp = client.post(
+        f'/api/v1/incidents/{team.id}', json={**QUERY, 'timezone': 'Australia/Sydney'}, headers={'If-None-Match': etag}
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers['ETag'] != etag
+
+
+def test_incidents_etag_changes_on_writes(app, db):
+    """
+    Test the annotation and actionable endpoints change the team's ETag
+    """
+    team = create_team_and_incident(db)
+
+    client = app.test_client()
+
+    etags = [client.post(f'/api/v1/incidents/{team.id}', json=QUERY).headers['ETag']]
+
+    client.post('/api/v1/incident/123_ABC123/actionable', json={'actionable': 'true'})
+
+    etags.append(client.post(f'/api/v1/incidents/{team.id}', json=QUERY).headers['ETag'])
+
+    client.post('/api/v1/incident/123_ABC123/annotation', json={'annotation': 'Test annotation'})
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', json=QUERY, headers={'If-None-Match': etags[-1]})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json['incidents'][0]['annotation']['summary'] == 'Test annotation'
+
+    etags.append(resp.headers['ETag'])
+
+    assert len(set(etags)) == 3
+
+
+def test_incidents_etag_changes_on_ingestion(app, db):
+    """
+    Test polling a team and refreshing its incidents change the team's ETag
+    """
+    team = create_team_and_incident(db)
+
+    client = app.test_client()
+
+    etags = [client.post(f'/api/v1/incidents/{team.id}', json=QUERY).headers['ETag']]
+
+    pyduty = MagicMock()
+    pyduty.get_incidents.return_value = [[]]
+    pyduty.get_incident.return_value = {'status': 'resolved'}
+
+    assert ingest_team(pyduty, team.id, datetime(2023, 8, 31), datetime(2023, 9, 1))
+
+    etags.append(client.post(f'/api/v1/incidents/{team.id}', json=QUERY).headers['ETag'])
+
+    assert refresh_incident(pyduty, Incidents.query.one().id)
+
+    etags.append(client.post(f'/api/v1/incidents/{team.id}', json=QUERY).headers['ETag'])
+
+    assert len(set(etags)) == 3
+
+
+@patch('oncall.api.routes._seven_days_ago', return_value=datetime(2023, 8, 24))
+def test_teams_not_modified(mock_seven_days_ago, app, db):
+    """
+    Test the ETag of the endpoints covering every team changes when a team is added
+    """
+    create_team_and_incident(db)
+
+    client = app.test_client()
+
+    for url in ('/api/v1/teams', '/api/v1/mostincidents', '/api/v1/export/incidents'):
+        etag = client.get(url).headers['ETag']
+
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == HTTPStatus.NOT_MODIFIED
+
+    etags = [client.get(url).headers['ETag'] for url in ('/api/v1/teams', '/api/v1/mostincidents')]
+
+    create_team_and_incident(db, team_id='DEF456')
+
+    for url, etag in zip(('/api/v1/teams', '/api/v1/mostincidents'), etags):
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == HTTPStatus.OK
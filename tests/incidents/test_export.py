@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from oncall.api.models import Annotations, Incidents, Teams
+
+
+def create_incidents(db):
+    """
+    Create two teams with incidents to export
+    """
+    for team_id in ('ABC123', 'DEF456'):
+        db.session.add(Teams(name=team_id, team_id=team_id, summary='', last_checked=datetime.now()))
+
+    annotation = Annotations(annotation='Known issue')
+
+    for number, (team, created_at) in enumerate(
+        [(1, '2023-01-01T10:00:00'), (2, '2023-01-02T10:00:00'), (1, '2023-01-03T10:00:00')]
+    ):
+        db.session.add(
+            Incidents(
+                title='The server is on fire.',
+                description='The server is on fire.',
+                summary=f'[#{number}] The server is on fire.',
+                status='resolved',
+                created_at=datetime.fromisoformat(created_at),
+                incident_id=f'P{number}_{"ABC123" if team == 1 else "DEF456"}',
+                actionable=number == 0,
+                annotation=annotation if number == 0 else None,
+                urgency='high',
+                team=team,
+            )
+        )
+
+    db.session.commit()
+
+
+def test_export_ndjson(app, db):
+    """
+    Test every team's incidents are streamed as NDJSON
+    """
+    create_incidents(db)
+
+    resp = app.test_client().get('/api/v1/export/incidents')
+
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.mimetype == 'application/x-ndjson'
+    assert resp.headers['Content-Disposition'] == 'attachment; filename=incidents.ndjson'
+
+    incidents = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+    assert [incident['incident_id'] for incident in incidents] == ['P0', 'P1', 'P2']
+    assert incidents[0] == {
+        'id': 1,
+        'incident_id': 'P0',
+        'team': 1,
+        'title': 'The server is on fire.',
+        'description': 'The server is on fire.',
+        'summary': '[#0] The server is on fire.',
+        'status': 'resolved',
+        'urgency': 'high',
+        'actionable': True,
+        'created_at': '2023-01-01T10:00:00',
+        'annotation': 'Known issue',
+    }
+
+
+def test_export_csv(app, db):
+    """
+    Test a team's incidents within a range are streamed as CSV, in batches
+    """
+    create_incidents(db)
+
+    app.config['EXPORT_BATCH_SIZE'] = 1
+
+    resp = app.test_client().get('/api/v1/export/incidents?format=csv&team=1&since=2023-01-01T11:00:00%2B00:00')
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/csv'
+
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+    assert [(row['incident_id'], row['team'], row['annotation']) for row in rows] == [('P2', '1', '')]
+
+    resp = app.test_client().get('/api/v1/export/incidents?format=csv&team=1&since=2024-01-01')
+
+    assert resp.get_data(as_text=True).splitlines() == [
+        'id,incident_id,team,title,description,summary,status,urgency,actionable,created_at,annotation'
+    ]
+
+
+def test_export_fields(app, db):
+    """
+    Test only the requested fields are exported, in the order requested
+    """
+    create_incidents(db)
+
+    client = app.test_client()
+
+    resp = client.get('/api/v1/export/incidents?format=csv&fields=created_at,incident_id,annotation')
+
+    assert resp.get_data(as_text=True).splitlines() == [
+        'created_at,incident_id,annotation',
+        '2023-01-01T10:00:00,P0,Known issue',
+        '2023-01-02T10:00:00,P1,',
+        '2023-01-03T10:00:00,P2,',
+    ]
+
+    resp = client.get('/api/v1/export/incidents?fields=urgency')
+
+    assert [json.loads(line) for line in resp.get_data(as_text=True).splitlines()] == [{'urgency': 'high'}] * 3
+
+    resp = client.get('/api/v1/export/incidents?fields=annotation&team=1')
+
+    assert [json.loads(line) for line in resp.get_data(as_text=True).splitlines()] == [
+        {'annotation': 'Known issue'},
+        {'annotation': None},
+    ]
+
+
+def test_export_invalid(app, db):
+    """
+    Test invalid exports are rejected
+    """
+    client = app.test_client()
+
+    resp = client.get('/api/v1/export/incidents?format=xml')
+
+    assert resp.status_code == 400
+    assert resp.json == {'error': 'format must be either ndjson or csv'}
+
+    resp = client.get('/api/v1/export/incidents?team=123')
+
+    assert resp.status_code == 404
+    assert resp.json == {'error': 'team does not exist'}
+
+    resp = client.get('/api/v1/export/incidents?since=01-01-2023')
+
+    assert resp.status_code == 400
+
+    resp = client.get('/api/v1/export/incidents?fields=incident_id,password')
+
+    assert resp.status_code == 400
+    assert resp.json['error'].startswith('fields must be a list of id, incident_id')
@@ -1,9 +1,12 @@
-from oncall.api.models import Teams
+from oncall.api.models import Annotations, Incidents, Teams
+from oncall.utils.pagination import decode_cursor
 
 from http import HTTPStatus
 
 from datetime import datetime
 
+from sqlalchemy import event
+
 
 def test_query_incidents(app, db):
     """
@@ -133,3 +136,335 @@ def test_query_incidents_since_greater_than_until(app, db):
 
     assert resp.status_code == 400
     assert resp.json == {'error': 'since cannot be greater than until'}
+
+
+def test_query_incidents_summary_only(app, db):
+    """
+    Test the incident list can be left out of the response
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    resp = client.post(
+        f'/api/v1/incidents/{team.id}',
+        content_type='application/json',
+        json={'since': '2023-01-01', 'until': '2023-01-02', 'include_incidents': False},
+    )
+
+    assert resp.status_code == 200
+    assert resp.json['summary'] == {'2023-01-01': {'high': 0, 'low': 0}, '2023-01-02': {'high': 0, 'low': 0}}
+    assert 'incidents' not in resp.json
+
+    resp = client.post(
+        f'/api/v1/incidents/{team.id}',
+        content_type='application/json',
+        json={'since': '2023-01-01', 'until': '2023-01-02', 'include_incidents': 'no'},
+    )
+
+    assert resp.status_code == 400
+    assert resp.json == {'error': 'include_incidents must be either true or false'}
+
+
+def test_query_incidents_paginated(app, db):
+    """
+    Test paging through a range with keyset cursors
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    # Incidents sharing a created_at are ordered by id
+    created = ['2023-01-01T10:00:00'] * 3 + ['2023-01-02T08:00:00', '2023-01-03T09:00:00']
+
+    for number, created_at in enumerate(created):
+        db.session.add(
+            Incidents(
+                title='The server is on fire.',
+                description='The server is on fire.',
+                summary='The server is on fire.',
+                status='resolved',
+                created_at=datetime.fromisoformat(created_at),
+                incident_id=f'P{number}_ABC123',
+                actionable=None,
+                annotation=None,
+                urgency='high',
+                team=team.id,
+            )
+        )
+
+    db.session.commit()
+
+    pages, cursor = [], None
+
+    while True:
+        body = {'since': '2023-01-01', 'until': '2023-01-07', 'page_size': 2}
+
+        if cursor is not None:
+            body['cursor'] = cursor
+
+        resp = client.post(f'/api/v1/incidents/{team.id}', content_type='application/json', json=body)
+
+        assert resp.status_code == 200
+
+        # The summary is only returned with the first page
+        assert ('summary' in resp.json) == (cursor is None)
+
+        pages.append([incident['incident_id'] for incident in resp.json['incidents']])
+        cursor = resp.json['next_cursor']
+
+        if cursor is None:
+            break
+
+    assert pages == [['P0', 'P1'], ['P2', 'P3'], ['P4']]
+
+
+def test_query_incidents_paginated_full_page(app, db):
+    """
+    Test the cursor of a full page points after its last incident, and a range ending on a full page has no next page
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    for number in range(4):
+        db.session.add(
+            Incidents(
+                title='The server is on fire.',
+                description='The server is on fire.',
+                summary='The server is on fire.',
+                status='resolved',
+                created_at=datetime(2023, 1, 1 + number, 10),
+                incident_id=f'P{number}_ABC123',
+                actionable=None,
+                annotation=None,
+                urgency='high',
+                team=team.id,
+            )
+        )
+
+    db.session.commit()
+
+    body = {'since': '2023-01-01', 'until': '2023-01-07', 'page_size': 2}
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', content_type='application/json', json=body)
+
+    assert resp.status_code == 200
+    assert [incident['incident_id'] for incident in resp.json['incidents']] == ['P0', 'P1']
+
+    last = Incidents.query.filter_by(incident_id='P1_ABC123').one()
+
+    assert decode_cursor(resp.json['next_cursor']) == (last.created_at, last.id)
+
+    body['cursor'] = resp.json['next_cursor']
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', content_type='application/json', json=body)
+
+    assert resp.status_code == 200
+    assert [incident['incident_id'] for incident in resp.json['incidents']] == ['P2', 'P3']
+    assert resp.json['next_cursor'] is None
+
+
+def test_query_incidents_paginated_invalid(app, db):
+    """
+    Test invalid page sizes and cursors are rejected
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    for body, error in (
+        ({'page_size': 0}, 'page_size must be a positive integer'),
+        ({'page_size': '10'}, 'page_size must be a positive integer'),
+        ({'cursor': 'not-a-cursor'}, 'invalid cursor'),
+        ({'cursor': 10}, 'invalid cursor'),
+    ):
+        resp = client.post(
+            f'/api/v1/incidents/{team.id}',
+            content_type='application/json',
+            json={'since': '2023-01-01', 'until': '2023-01-07', **body},
+        )
+
+        assert resp.status_code == 400
+        assert resp.json == {'error': error}
+
+
+def test_query_incidents_statement_count(app, db):
+    """
+    Test listing incidents runs the same number of SQL statements however many annotated incidents match
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    def add_incidents(start, count):
+        for number in range(start, start + count):
+            incident = Incidents(
+                title='The server is on fire.',
+                description='The server is on fire.',
+                summary='The server is on fire.',
+                status='resolved',
+                created_at=datetime(2023, 1, 2, 10, number),
+                incident_id=f'P{number}_ABC123',
+                actionable=None,
+                annotation=None,
+                urgency='high',
+                team=team.id,
+            )
+            incident.annotation = Annotations(annotation=f'Annotation {number}')
+
+            db.session.add(incident)
+
+        db.session.commit()
+
+    def statements():
+        executed = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+
+        try:
+            resp = client.post(
+                f'/api/v1/incidents/{team.id}',
+                content_type='application/json',
+                json={'since': '2023-01-01', 'until': '2023-01-07'},
+            )
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        assert resp.status_code == 200
+
+        return resp.json['incidents'], len(executed)
+
+    add_incidents(0, 1)
+
+    incidents, single = statements()
+
+    assert incidents[0]['annotation']['summary'] == 'Annotation 0'
+
+    add_incidents(1, 29)
+
+    incidents, many = statements()
+
+    assert len(incidents) == 30
+    assert [incident['annotation']['summary'] for incident in incidents] == [
+        f'Annotation {number}' for number in range(30)
+    ]
+    assert many == single
+
+
+def test_query_incidents_fields(app, db):
+    """
+    Test a sparse fieldset narrows the selected columns and the serialised keys
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    for number in range(3):
+        incident = Incidents(
+            title='The server is on fire.',
+            description='The server is on fire.',
+            summary='The server is on fire.',
+            status='resolved',
+            created_at=datetime(2023, 1, 2, 10, number),
+            incident_id=f'P{number}_ABC123',
+            actionable=None,
+            annotation=None,
+            urgency='high',
+            team=team.id,
+        )
+        incident.annotation = Annotations(annotation=f'Annotation {number}')
+
+        db.session.add(incident)
+
+    db.session.commit()
+
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+
+    try:
+        resp = client.post(
+            f'/api/v1/incidents/{team.id}',
+            content_type='application/json',
+            json={'since': '2023-01-01', 'until': '2023-01-07', 'fields': ['incident_id', 'urgency']},
+        )
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert resp.status_code == 200
+    assert resp.json['incidents'] == [{'incident_id': f'P{number}', 'urgency': 'high'} for number in range(3)]
+
+    listing = [statement for statement in executed if 'incidents.incident_id' in statement]
+
+    assert len(listing) == 1
+    assert 'incidents.title' not in listing[0]
+    assert 'annotations' not in listing[0]
+
+    # A comma separated string is accepted, and cursors still page through a sparse listing
+    pages, cursor = [], None
+
+    while True:
+        body = {'since': '2023-01-01', 'until': '2023-01-07', 'page_size': 2, 'fields': 'created_at,annotation'}
+
+        if cursor is not None:
+            body['cursor'] = cursor
+
+        resp = client.post(f'/api/v1/incidents/{team.id}', content_type='application/json', json=body)
+
+        assert resp.status_code == 200
+        assert all(set(incident) == {'created_at', 'annotation'} for incident in resp.json['incidents'])
+
+        pages.append([incident['annotation']['summary'] for incident in resp.json['incidents']])
+        cursor = resp.json['next_cursor']
+
+        if cursor is None:
+            break
+
+    assert pages == [['Annotation 0', 'Annotation 1'], ['Annotation 2']]
+
+
+def test_query_incidents_fields_invalid(app, db):
+    """
+    Test sparse fieldsets with unknown or no fields are rejected
+    """
+    client = app.test_client()
+
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime.now())
+
+    db.session.add(team)
+    db.session.commit()
+
+    for fields in (['incident_id', 'password'], [], '', [1], {'incident_id': True}):
+        resp = client.post(
+            f'/api/v1/incidents/{team.id}',
+            content_type='application/json',
+            json={'since': '2023-01-01', 'until': '2023-01-07', 'fields': fields},
+        )
+
+        assert resp.status_code == 400
+        assert resp.json['error'].startswith('fields must be a list of id, incident_id')
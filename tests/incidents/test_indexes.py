@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from oncall.api.models import Incidents, Teams
+from oncall.api.rollups import team_counts
+
+
+def query_plan(db, stmt):
+    """
+    Explain how SQLite runs a statement
+
+    :return: (str) Query plan details, one step per line
+    """
+    compiled = stmt.compile(db.session.get_bind())
+    params = compiled.construct_params()
+
+    plan = db.session.connection().exec_driver_sql(
+        f'EXPLAIN QUERY PLAN {compiled}', tuple(str(params[name]) for name in compiled.positiontup)
+    )
+
+    return '\n'.join(step[-1] for step in plan)
+
+
+def test_incident_lookup_uses_unique_index(db):
+    """
+    Test looking up an incident by its PagerDuty identifier searches the unique index
+    """
+    plan = query_plan(db, select(Incidents.id).where(Incidents.incident_id == 'PT4KHLK_example-id'))
+
+    assert 'USING COVERING INDEX ix_incidents_incident_id (incident_id=?)' in plan
+
+
+def test_team_range_uses_composite_index(db):
+    """
+    Test a team's incidents over a date range are searched on (team, created_at)
+    """
+    plan = query_plan(
+        db,
+        select(Incidents)
+        .where(Incidents.team == 1, Incidents.created_at.between(datetime(2023, 1, 1), datetime(2023, 1, 31)))
+        .order_by(Incidents.created_at),
+    )
+
+    assert 'USING INDEX ix_incidents_team_created_at (team=? AND created_at>? AND created_at<?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_unresolved_scan_uses_partial_index(db):
+    """
+    Test the refresh scan of unresolved incidents only reads the partial status index
+    """
+    plan = query_plan(db, select(Incidents.id, Incidents.team).where(Incidents.status != 'resolved'))
+
+    assert 'USING INDEX ix_incidents_unresolved' in plan
+
+
+def test_team_lookup_uses_unique_index(db):
+    """
+    Test looking up a team by its PagerDuty identifier searches the unique index
+    """
+    plan = query_plan(db, select(Teams).where(Teams.team_id == 'example-id'))
+
+    assert 'USING INDEX ix_teams_team_id (team_id=?)' in plan
+
+
+def test_team_counts_use_window_indexes(db):
+    """
+    Test the /mostincidents counts search the whole hours of the rollups and the partial hour of the incidents
+    """
+    plan = query_plan(db, select(team_counts(datetime.utcnow() - timedelta(days=7, minutes=30))))
+
+    assert 'SEARCH team_daily_rollups USING INDEX ix_team_daily_rollups_bucket (bucket>?)' in plan
+    assert 'SEARCH incidents USING COVERING INDEX ix_incidents_created_at_team (created_at>? AND created_at<?)' in plan
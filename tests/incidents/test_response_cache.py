@@ -0,0 +1,219 @@
+from datetime import datetime
+from http import HTTPStatus
+
+import pytest
+from mock import MagicMock, patch
+
+from oncall.api.models import Incidents, Teams
+from oncall.api.tasks import ingest_team
+from oncall.utils.cache import get_cache
+
+
+@pytest.fixture
+def cache(app):
+    """
+    Cache with an in-process backend and Redis unavailable, which it must not depend on
+    """
+    app.config['RESPONSE_CACHE'] = 'memory'
+
+    with patch('oncall.utils.cache.get_redis', side_effect=ConnectionError('Redis is down')):
+        yield
+
+
+def create_team_and_incident(db):
+    """
+    Create a team with a single incident
+    """
+    team = Teams(name='test-team', team_id='ABC123', summary='', last_checked=datetime(2023, 8, 31))
+
+    db.session.add(team)
+    db.session.commit()
+
+    db.session.add(
+        Incidents(
+            incident_id='123_ABC123',
+            team=team.id,
+            title='Server on Fire',
+            summary='Servers on Fire',
+            description='Servers on Fire',
+            actionable=None,
+            status='resolved',
+            created_at=datetime(2023, 8, 25),
+            urgency='high',
+            annotation=None,
+        )
+    )
+    db.session.commit()
+
+    return team
+
+
+def test_cached_incidents(app, db, cache):
+    """
+    Test repeated queries are answered from the cache, whatever the order of their parameters
+    """
+    team = create_team_and_incident(db)
+
+    client = app.test_client()
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers['X-Cache'] == 'MISS'
+
+    # An incident stored without bumping the team's data version is not seen until the entry expires
+    db.session.add(
+        Incidents(
+            incident_id='456_ABC123',
+            team=team.id,
+            title='Disk full',
+            summary='Disk full',
+            description='Disk full',
+            actionable=None,
+            status='resolved',
+            created_at=datetime(2023, 8, 26),
+            urgency='low',
+            annotation=None,
+        )
+    )
+    db.session.commit()
+
+    cached = client.post(f'/api/v1/incidents/{team.id}', json={'until': '2023-08-31', 'since': '2023-08-20'})
+
+    assert cached.headers['X-Cache'] == 'HIT'
+    assert cached.json == resp.json
+    assert len(cached.json['incidents']) == 1
+
+    assert get_cache().counters() == {'response_cache_misses': 1, 'response_cache_hits': 1}
+
+
+@patch('oncall.api.routes.get_redis')
+def test_cache_counters_in_metrics(mock_redis, app, db, cache):
+    """
+    Test the counters of the in-process cache are returned with the cluster wide ones
+    """
+    mock_redis.return_value.hgetall.return_value = {b'incidents_stored': b'3'}
+
+    client = app.test_client()
+
+    client.get('/api/v1/teams')
+    client.get('/api/v1/teams')
+
+    resp = client.get('/api/v1/metrics')
+
+    assert resp.json == {'metrics': {'incidents_stored': 3, 'response_cache_misses': 1, 'response_cache_hits': 1}}
+
+
+def test_cached_incidents_different_parameters(app, db, cache):
+    """
+    Test queries with different parameters are cached separately
+    """
+    team = create_team_and_incident(db)
+
+    client = app.test_client()
+
+    client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+    resp = client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-26', 'until': '2023-08-31'})
+
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert resp.json['incidents'] == []
+
+
+def test_cache_invalidated_by_actionable(app, db, cache):
+    """
+    Test marking an incident as actionable invalidates its team's responses only
+    """
+    team = create_team_and_incident(db)
+
+    other = Teams(name='other-team', team_id='DEF456', summary='', last_checked=datetime(2023, 8, 31))
+    db.session.add(other)
+    db.session.commit()
+
+    client = app.test_client()
+
+    client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+    client.post(f'/api/v1/incidents/{other.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    client.post('/api/v1/incident/123_ABC123/actionable', json={'actionable': 'true'})
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert resp.json['incidents'][0]['actionable'] is True
+
+    resp = client.post(f'/api/v1/incidents/{other.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    assert resp.headers['X-Cache'] == 'HIT'
+
+
+def test_cache_invalidated_by_annotation(app, db, cache):
+    """
+    Test annotating an incident invalidates the responses covering every team
+    """
+    create_team_and_incident(db)
+
+    client = app.test_client()
+
+    client.get('/api/v1/mostincidents')
+
+    assert client.get('/api/v1/mostincidents').headers['X-Cache'] == 'HIT'
+
+    client.post('/api/v1/incident/123_ABC123/annotation', json={'annotation': 'Test annotation'})
+
+    assert client.get('/api/v1/mostincidents').headers['X-Cache'] == 'MISS'
+
+
+def test_cache_invalidated_by_ingestion(app, db, cache):
+    """
+    Test ingesting new incidents invalidates the team's responses
+    """
+    team = create_team_and_incident(db)
+
+    pyduty = MagicMock()
+    pyduty.get_incidents.return_value = [
+        [
+            {
+                'id': '456',
+                'summary': 'Disk full',
+                'created_at': '2023-08-26T10:00:00Z',
+                'status': 'triggered',
+                'title': 'Disk full',
+                'urgency': 'low',
+            }
+        ]
+    ]
+
+    client = app.test_client()
+
+    client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    assert ingest_team(pyduty, team.id, datetime(2023, 8, 26), datetime(2023, 8, 27))
+
+    resp = client.post(f'/api/v1/incidents/{team.id}', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert len(resp.json['incidents']) == 2
+
+
+def test_cache_skips_errors(app, db, cache):
+    """
+    Test unsuccessful responses are not cached
+    """
+    client = app.test_client()
+
+    client.post('/api/v1/incidents/1', json={'since': '2023-08-20', 'until': '2023-08-31'})
+    resp = client.post('/api/v1/incidents/1', json={'since': '2023-08-20', 'until': '2023-08-31'})
+
+    assert resp.status_code == HTTPStatus.NOT_FOUND
+    assert 'X-Cache' not in resp.headers
+    assert 'ETag' not in resp.headers
+
+
+def test_cache_disabled(app, db):
+    """
+    Test responses are not cached when RESPONSE_CACHE is empty
+    """
+    resp = app.test_client().get('/api/v1/teams')
+
+    assert resp.status_code == HTTPStatus.OK
+    assert 'X-Cache' not in resp.headers
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+import pytz
+
+from oncall.api.ingest import incident_row, insert_incidents
+from oncall.api.models import TeamDailyRollups, Teams
+from oncall.api.rollups import local_times, rebuild_rollups, utc_offsets
+
+
+def create_team(db, team_id='example-id'):
+    """
+    Create a team to roll incidents up for
+    """
+    team = Teams(name=team_id, team_id=team_id, summary='example SRE', last_checked=datetime(2023, 1, 1))
+
+    db.session.add(team)
+    db.session.commit()
+
+    return team
+
+
+def ingest(db, team, *incidents):
+    """
+    Store incidents through the ingestion path
+
+    :param incidents: (tuple) PagerDuty incident ID, created_at and urgency of each incident
+    """
+    insert_incidents(
+        [
+            incident_row({'id': incident_id, 'created_at': created_at, 'urgency': urgency, 'status': 'resolved'}, team)
+            for incident_id, created_at, urgency in incidents
+        ]
+    )
+    db.session.commit()
+
+
+def rollups():
+    """
+    Every rollup row as comparable tuples
+    """
+    return sorted(
+        (rollup.team, rollup.bucket, rollup.urgency, rollup.incidents, rollup.actionable, rollup.not_actionable)
+        for rollup in TeamDailyRollups.query.all()
+    )
+
+
+def test_ingestion_updates_rollups(db):
+    """
+    Test stored incidents are counted into hourly rollups, and duplicates are not counted again
+    """
+    team = create_team(db)
+
+    ingest(
+        db,
+        team,
+        ('P1', '2023-01-01T10:05:00Z', 'high'),
+        ('P2', '2023-01-01T10:55:00Z', 'high'),
+        ('P3', '2023-01-01T10:30:00Z', 'low'),
+        ('P4', '2023-01-01T11:00:00Z', 'high'),
+    )
+    ingest(db, team, ('P1', '2023-01-01T10:05:00Z', 'high'), ('P5', '2023-01-01T10:15:00Z', 'high'))
+
+    assert rollups() == [
+        (team.id, datetime(2023, 1, 1, 10), 'high', 3, 0, 0),
+        (team.id, datetime(2023, 1, 1, 10), 'low', 1, 0, 0),
+        (team.id, datetime(2023, 1, 1, 11), 'high', 1, 0, 0),
+    ]
+
+
+def test_actionable_updates_rollups(app, db):
+    """
+    Test marking an incident actionable moves it between the rollup counts
+    """
+    team = create_team(db)
+
+    ingest(db, team, ('P1', '2023-01-01T10:05:00Z', 'high'), ('P2', '2023-01-01T10:15:00Z', 'high'))
+
+    client = app.test_client()
+
+    for incident_id, actionable in (('P1', 'true'), ('P2', 'true'), ('P2', 'false'), ('P2', 'false')):
+        resp = client.post(f'/api/v1/incident/{incident_id}_example-id/actionable', json={'actionable': actionable})
+
+        assert resp.status_code == HTTPStatus.OK
+
+    assert rollups() == [(team.id, datetime(2023, 1, 1, 10), 'high', 2, 1, 1)]
+
+
+def test_rebuild_rollups(app, db):
+    """
+    Test the rebuild recounts the same rollups the incremental updates maintain
+    """
+    team = create_team(db)
+    other = create_team(db, 'other-id')
+
+    ingest(db, team, ('P1', '2023-01-01T10:05:00Z', 'high'), ('P2', '2023-01-02T08:15:00Z', 'low'))
+    ingest(db, other, ('P3', '2023-01-01T10:05:00Z', 'high'))
+
+    app.test_client().post('/api/v1/incident/P1_example-id/actionable', json={'actionable': 'true'})
+
+    expected = rollups()
+
+    # Drift the rollups, then recount a single team and every team
+    db.session.query(TeamDailyRollups).update({'incidents': 100})
+    db.session.commit()
+
+    assert rebuild_rollups(team.id) == 2
+    db.session.commit()
+
+    assert [rollup[3] for rollup in rollups()] == [1, 1, 100]
+
+    result = app.test_cli_runner().invoke(args=['rollups', 'rebuild'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt 3 rollups' in result.output
+    assert rollups() == expected
+
+
+def test_rebuild_rollups_bumps_versions(app, db):
+    """
+    Test rebuilding the rollups invalidates the responses built from the rebuilt teams' old rollups
+    """
+    team = create_team(db)
+    other = create_team(db, 'other-id')
+
+    def versions():
+        db.session.expire_all()
+
+        return [db.session.get(Teams, team_id).data_version for team_id in (team.id, other.id)]
+
+    before = versions()
+
+    result = app.test_cli_runner().invoke(args=['rollups', 'rebuild', '--team', 'other-id'])
+
+    assert result.exit_code == 0, result.output
+    assert versions() == [before[0], before[1] + 1]
+
+    result = app.test_cli_runner().invoke(args=['rollups', 'rebuild'])
+
+    assert result.exit_code == 0, result.output
+    assert versions() == [before[0] + 1, before[1] + 2]
+
+
+def test_summary_from_rollups(app, db):
+    """
+    Test the summary adds whole hours from the rollups to the partial hours at either end
+    """
+    team = create_team(db)
+
+    ingest(
+        db,
+        team,
+        # Before the window
+        ('P0', '2023-01-01T09:59:00Z', 'high'),
+        # Partial first hour
+        ('P1', '2023-01-01T10:30:00Z', 'high'),
+        ('P2', '2023-01-01T10:10:00Z', 'high'),
+        # Whole hours
+        ('P3', '2023-01-01T11:00:00Z', 'low'),
+        ('P4', '2023-01-01T23:59:59Z', 'high'),
+        ('P5', '2023-01-02T13:00:00Z', 'low'),
+        # Partial last hour
+        ('P6', '2023-01-03T12:00:00Z', 'low'),
+        ('P7', '2023-01-03T12:14:00Z', 'high'),
+        # After the window
+        ('P8', '2023-01-03T12:16:00Z', 'high'),
+    )
+
+    resp = app.test_client().post(
+        f'/api/v1/incidents/{team.id}',
+        json={'since': '2023-01-01T10:10:00+00:00', 'until': '2023-01-03T12:15:00+00:00'},
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json['summary'] == {
+        '2023-01-01': {'high': 3, 'low': 1},
+        '2023-01-02': {'high': 0, 'low': 1},
+        '2023-01-03': {'high': 1, 'low': 1},
+    }
+    assert len(resp.json['incidents']) == 7
+
+
+def test_summary_from_rollups_timezones(app, db):
+    """
+    Test whole hour timezones are answered from the rollups and others fall back to the incidents
+    """
+    team = create_team(db)
+
+    ingest(
+        db,
+        team,
+        ('P1', '2023-01-01T04:59:00Z', 'high'),
+        ('P2', '2023-01-01T05:00:00Z', 'high'),
+        ('P3', '2023-01-01T18:40:00Z', 'low'),
+        ('P4', '2023-01-02T04:00:00Z', 'low'),
+    )
+
+    client = app.test_client()
+
+    resp = client.post(
+        f'/api/v1/incidents/{team.id}',
+        json={
+            'since': '2023-01-01T00:00:00-05:00',
+            'until': '2023-01-02T23:59:59-05:00',
+            'timezone': 'America/New_York',
+        },
+    )
+
+    assert resp.json['summary'] == {
+        '2023-01-01': {'high': 1, 'low': 2},
+        '2023-01-02': {'high': 0, 'low': 0},
+    }
+
+    # Kolkata is not a whole number of hours from UTC, prove its summary does not read the rollups
+    db.session.query(TeamDailyRollups).update({'incidents': 100})
+    db.session.commit()
+
+    resp = client.post(
+        f'/api/v1/incidents/{team.id}',
+        json={'since': '2023-01-01T00:00:00+00:00', 'until': '2023-01-02T23:59:59+00:00', 'timezone': 'Asia/Kolkata'},
+    )
+
+    assert resp.json['summary'] == {
+        '2023-01-01': {'high': 2, 'low': 0},
+        '2023-01-02': {'high': 0, 'low': 2},
+    }
+
+
+def test_most_incidents_from_rollups(app, db):
+    """
+    Test the teams with the most incidents over the last seven days are counted from the rollups
+    """
+    busy = create_team(db, 'busy-id')
+    quiet = create_team(db, 'quiet-id')
+    create_team(db, 'idle-id')
+
+    now = datetime.utcnow()
+
+    def created(delta):
+        return (now - delta).isoformat() + '+00:00'
+
+    ingest(
+        db,
+        busy,
+        ('P1', created(timedelta(minutes=1)), 'high'),
+        ('P2', created(timedelta(days=3)), 'low'),
+        ('P3', created(timedelta(days=6, hours=23, minutes=59)), 'high'),
+        ('P4', created(timedelta(days=8)), 'high'),
+    )
+    ingest(db, quiet, ('P5', created(timedelta(days=1)), 'high'))
+
+    resp = app.test_client().get('/api/v1/mostincidents')
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json == {
+        'teams': [
+            {'id': busy.id, 'name': 'busy-id', 'alias': None, 'incident_count': 3},
+            {'id': quiet.id, 'name': 'quiet-id', 'alias': None, 'incident_count': 1},
+            {'id': 3, 'name': 'idle-id', 'alias': None, 'incident_count': 0},
+        ]
+    }
+
+
+def test_utc_offsets():
+    """
+    Test the offsets a timezone uses over a window are found to the minute
+    """
+    new_york = pytz.timezone('America/New_York')
+
+    assert utc_offsets(new_york, datetime(2023, 1, 1), datetime(2023, 12, 1)) == [
+        (datetime(2023, 1, 1), -18000),
+        (datetime(2023, 3, 12, 7), -14400),
+        (datetime(2023, 11, 5, 6), -18000),
+    ]
+    assert utc_offsets(pytz.UTC, datetime(2023, 1, 1), datetime(2023, 12, 1)) == [(datetime(2023, 1, 1), 0)]
+
+
+def test_local_times():
+    """
+    Test times are converted with the offset in force when they happened, the way pytz converts them
+    """
+    adelaide = pytz.timezone('Australia/Adelaide')
+
+    local_time = local_times(adelaide, datetime(2023, 3, 1), datetime(2023, 5, 1))
+
+    for date in (
+        datetime(2023, 3, 1),
+        datetime(2023, 4, 1, 16, 29, 59),
+        datetime(2023, 4, 1, 16, 30),
+        datetime(2023, 5, 1),
+    ):
+        assert local_time(date).isoformat() == pytz.UTC.localize(date).astimezone(adelaide).isoformat()
+
+    assert local_time(datetime(2023, 4, 1, 16, 30)).isoformat() == '2023-04-02T02:00:00+09:30'
+
+
+def test_summary_across_daylight_saving(app, db):
+    """
+    Test incidents counted in SQL move to the offset in force when each was created
+    """
+    team = create_team(db)
+
+    # Adelaide moves from +10:30 to +09:30 at 2023-04-01T16:30:00Z
+    ingest(
+        db,
+        team,
+        ('P1', '2023-04-01T13:00:00Z', 'high'),
+        ('P2', '2023-04-01T14:00:00Z', 'high'),
+        ('P3', '2023-04-01T16:00:00Z', 'low'),
+        ('P4', '2023-04-02T14:20:00Z', 'low'),
+        ('P5', '2023-04-02T14:40:00Z', 'high'),
+    )
+
+    resp = app.test_client().post(
+        f'/api/v1/incidents/{team.id}',
+        json={
+            'since': '2023-04-01T00:00:00+10:30',
+            'until': '2023-04-03T23:59:59+09:30',
+            'timezone': 'Australia/Adelaide',
+            'include_incidents': False,
+        },
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json['summary'] == {
+        '2023-04-01': {'high': 1, 'low': 0},
+        '2023-04-02': {'high': 1, 'low': 2},
+        '2023-04-03': {'high': 1, 'low': 0},
+    }
+    assert 'incidents' not in resp.json
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from oncall.api.models import Incidents, Teams
+from oncall.api.scheduler import due_teams, next_poll_interval, refresh_tier, schedule_next_poll
+
+WINDOW = timedelta(hours=24)
+
+Incident = namedtuple('Incident', ['status', 'urgency', 'created_at', 'refreshed_at'])
+
+
+def create_team(db, name, next_poll_at=None, poll_interval=None):
+    """
+    Create a team with a poll schedule
+    """
+    team = Teams(name=name, team_id=f'{name}-id', summary=f'{name} SRE', last_checked=datetime(2023, 1, 1))
+    team.next_poll_at = next_poll_at
+    team.poll_interval = poll_interval
+
+    db.session.add(team)
+    db.session.commit()
+
+    return team
+
+
+def test_next_poll_interval_hot_team():
+    """
+    Test a team that just raised incidents is polled as often as allowed
+    """
+    assert next_poll_interval(1800, created=3, recent=10, min_interval=60, max_interval=1800, window=WINDOW) == 60
+
+
+def test_next_poll_interval_backs_off():
+    """
+    Test a quiet team backs off exponentially up to the maximum staleness
+    """
+    intervals, interval = [], None
+
+    for _ in range(7):
+        interval = next_poll_interval(interval, created=0, recent=0, min_interval=60, max_interval=1800, window=WINDOW)
+        intervals.append(interval)
+
+    assert intervals == [120, 240, 480, 960, 1800, 1800, 1800]
+
+
+def test_next_poll_interval_recent_rate():
+    """
+    Test the back off is capped by the team's average gap between incidents
+    """
+    # 96 incidents a day is one every 15 minutes
+    assert next_poll_interval(1800, created=0, recent=96, min_interval=60, max_interval=1800, window=WINDOW) == 900
+
+
+def test_schedule_next_poll(app, db):
+    """
+    Test the next poll time is recorded from the team's recent incidents
+    """
+    now = datetime(2023, 1, 2)
+
+    team = create_team(db, 'example', poll_interval=1800)
+
+    db.session.add_all(
+        Incidents(
+            title='The server is on fire.',
+            description='The server is on fire.',
+            summary='The server is on fire.',
+            status='resolved',
+            incident_id=f'P{number}_example-id',
+            created_at=now - timedelta(hours=number + 1),
+            urgency='high',
+            actionable=None,
+            annotation=None,
+            team=team.id,
+        )
+        for number in range(48)
+    )
+    db.session.commit()
+
+    # 24 of the incidents fall within the window, one an hour
+    assert schedule_next_poll(team, created=0, now=now, config=app.config) == 1800
+
+    team = db.session.get(Teams, team.id)
+
+    assert team.poll_interval == 1800
+    assert team.next_poll_at == now + timedelta(seconds=1800)
+
+
+def test_due_teams(db):
+    """
+    Test only teams that have never been scheduled or whose poll time has passed are due
+    """
+    now = datetime(2023, 1, 2)
+
+    create_team(db, 'new')
+    create_team(db, 'due', next_poll_at=now - timedelta(minutes=1))
+    create_team(db, 'later', next_poll_at=now + timedelta(minutes=1))
+
+    assert sorted(team.name for team in due_teams(now)) == ['due', 'new']
+
+
+def test_refresh_tier(app):
+    """
+    Test unresolved incidents are split into hot, warm and cold refresh tiers
+    """
+    now = datetime(2023, 1, 10)
+
+    def tier(status, urgency, age, refreshed=None):
+        refreshed_at = None if refreshed is None else now - refreshed
+
+        return refresh_tier(Incident(status, urgency, now - age, refreshed_at), now, app.config)
+
+    # Triggered or high urgency incidents are refreshed every cycle
+    assert tier('triggered', 'low', timedelta(minutes=2), refreshed=timedelta(seconds=1)) == 'hot'
+    assert tier('acknowledged', 'high', timedelta(hours=5), refreshed=timedelta(seconds=1)) == 'hot'
+
+    # Acknowledged low urgency incidents wait longer the older they are
+    assert tier('acknowledged', 'low', timedelta(minutes=30), refreshed=timedelta(minutes=5)) is None
+    assert tier('acknowledged', 'low', timedelta(minutes=30), refreshed=timedelta(minutes=10)) == 'warm'
+    assert tier('acknowledged', 'low', timedelta(hours=10), refreshed=timedelta(minutes=50)) is None
+    assert tier('acknowledged', 'low', timedelta(hours=10), refreshed=timedelta(hours=1)) == 'warm'
+
+    # Long stuck incidents are checked rarely whatever their urgency
+    assert tier('triggered', 'high', timedelta(days=4), refreshed=timedelta(hours=1)) is None
+    assert tier('triggered', 'high', timedelta(days=4), refreshed=timedelta(hours=6)) == 'cold'
+    assert tier('triggered', 'high', timedelta(days=4)) == 'cold'
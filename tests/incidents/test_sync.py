@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+
+from mock import MagicMock, patch
+
+from oncall.api.models import Incidents, SyncCursors, Teams
+from oncall.api.sync import latest_transitions, sync_log_entries
+from oncall.api.tasks import _sync_log_entries, update_incidents
+from oncall.utils.pagerduty import RequestFailure
+
+
+def log_entry(entry_type, incident_id, created_at, teams=('example-id',)):
+    """
+    A PagerDuty log entry
+    """
+    return {
+        'id': f'R{incident_id}{created_at}',
+        'type': entry_type,
+        'created_at': created_at,
+        'incident': {'id': incident_id, 'type': 'incident_reference'},
+        'teams': [{'id': team, 'type': 'team_reference'} for team in teams],
+    }
+
+
+def add_incident(db, incident_id, status, created_at=datetime(2023, 1, 1), updated_at=None):
+    """
+    Store an incident to sync
+    """
+    incident = Incidents(
+        title='Down Replica DB',
+        description='Down Replica DB',
+        summary='Down Replica DB',
+        status=status,
+        created_at=created_at,
+        incident_id=incident_id,
+        actionable=None,
+        annotation=None,
+        urgency='high',
+        team=1,
+    )
+    incident.updated_at = updated_at
+
+    db.session.add(incident)
+    db.session.commit()
+
+    return incident
+
+
+def test_latest_transitions():
+    """
+    Test log entries are reduced to the latest status of every incident and team
+    """
+    pages = [
+        [
+            log_entry('resolve_log_entry', 'P1', '2023-01-01T10:30:00Z'),
+            log_entry('annotate_log_entry', 'P1', '2023-01-01T10:20:00Z'),
+            log_entry('acknowledge_log_entry', 'P1', '2023-01-01T10:10:00Z'),
+        ],
+        [
+            log_entry('reassign_log_entry', 'P2', '2023-01-01T10:05:00Z', teams=('example-id', 'other-id')),
+            log_entry('trigger_log_entry', 'P1', '2023-01-01T10:00:00Z'),
+        ],
+    ]
+
+    assert latest_transitions(pages) == {
+        'P1_example-id': (datetime(2023, 1, 1, 10, 30), 'resolved'),
+        'P2_example-id': (datetime(2023, 1, 1, 10, 5), 'triggered'),
+        'P2_other-id': (datetime(2023, 1, 1, 10, 5), 'triggered'),
+    }
+
+
+def test_sync_log_entries(app, db):
+    """
+    Test the feed is read from the cursor and transitions are applied in bulk
+    """
+    db.session.add(Teams(name='example', team_id='example-id', summary='example SRE', last_checked=datetime.now()))
+    db.session.commit()
+
+    add_incident(db, 'P1_example-id', 'triggered')
+    add_incident(db, 'P2_example-id', 'acknowledged')
+    # Already moved on by a newer webhook
+    add_incident(db, 'P3_example-id', 'resolved', updated_at=datetime(2023, 1, 2, 10, 0))
+
+    db.session.add(SyncCursors(name='log_entries', position=datetime(2023, 1, 2, 8, 0)))
+    db.session.commit()
+
+    now = datetime(2023, 1, 2, 12, 0)
+
+    pyduty = MagicMock()
+    pyduty.get_log_entries.return_value = [
+        [
+            log_entry('resolve_log_entry', 'P1', '2023-01-02T11:00:00Z'),
+            log_entry('unacknowledge_log_entry', 'P2', '2023-01-02T11:00:00Z'),
+            log_entry('acknowledge_log_entry', 'P3', '2023-01-02T09:00:00Z'),
+            log_entry('resolve_log_entry', 'P9', '2023-01-02T09:00:00Z'),
+        ]
+    ]
+
+    reconcile = MagicMock()
+
+    assert sync_log_entries(pyduty, now, app.config, reconcile=reconcile) == 2
+
+    # The feed is read from the cursor, less the overlap
+    pyduty.get_log_entries.assert_called_once_with(
+        since=datetime(2023, 1, 2, 7, 59, tzinfo=timezone.utc), until=datetime(2023, 1, 2, 12, tzinfo=timezone.utc)
+    )
+    reconcile.assert_not_called()
+
+    statuses = {incident.incident_id: incident.status for incident in Incidents.query.all()}
+
+    assert statuses == {'P1_example-id': 'resolved', 'P2_example-id': 'triggered', 'P3_example-id': 'resolved'}
+    assert Incidents.query.filter_by(incident_id='P1_example-id').one().refreshed_at == now
+
+    assert SyncCursors.query.one().position == now
+
+    # The next sync carries on from the cursor
+    pyduty.get_log_entries.return_value = []
+
+    assert sync_log_entries(pyduty, now + timedelta(minutes=1), app.config) == 0
+
+    assert pyduty.get_log_entries.call_args.kwargs['since'] == (now - timedelta(seconds=60)).replace(
+        tzinfo=timezone.utc
+    )
+    assert SyncCursors.query.one().position == now + timedelta(minutes=1)
+
+
+def test_sync_log_entries_first_sync(app, db):
+    """
+    Test the first sync only reads the overlap and reconciles the teams with unresolved incidents
+    """
+    add_incident(db, 'P1_example-id', 'triggered')
+    add_incident(db, 'P2_example-id', 'acknowledged')
+    add_incident(db, 'P3_other-id', 'resolved').team = 2
+    db.session.commit()
+
+    now = datetime(2023, 6, 1, 12, 0)
+
+    pyduty = MagicMock()
+    pyduty.get_log_entries.return_value = []
+
+    reconcile = MagicMock()
+
+    assert sync_log_entries(pyduty, now, app.config, reconcile=reconcile) == 0
+
+    pyduty.get_log_entries.assert_called_once_with(
+        since=datetime(2023, 6, 1, 11, 59, tzinfo=timezone.utc), until=datetime(2023, 6, 1, 12, tzinfo=timezone.utc)
+    )
+    reconcile.assert_called_once_with([1])
+
+    assert SyncCursors.query.one().position == now
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._refresh_teams_chunk')
+@patch('oncall.api.tasks.PagerDuty')
+def test_sync_log_entries_task_reconciles(mock_pagerduty, mock_refresh_chunk, mock_chord, mock_redis, db):
+    """
+    Test the first sync task queues one refresh of the teams with unresolved incidents
+    """
+    mock_pagerduty.return_value.get_log_entries.return_value = []
+    mock_redis.return_value.set.return_value = True
+
+    add_incident(db, 'P1_example-id', 'triggered')
+
+    assert _sync_log_entries()
+
+    assert [team['team_id'] for team in mock_refresh_chunk.s.call_args.kwargs['teams']] == [1]
+
+    # Later syncs carry on from the cursor
+    assert _sync_log_entries()
+
+    mock_refresh_chunk.s.assert_called_once()
+
+
+@patch('oncall.api.tasks.PagerDuty')
+def test_sync_log_entries_failure(mock_pagerduty, db):
+    """
+    Test a failed read leaves the cursor where it was
+    """
+    mock_pagerduty.return_value.get_log_entries.side_effect = RequestFailure('boom')
+
+    assert not _sync_log_entries()
+
+    assert SyncCursors.query.count() == 0
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks._sync_log_entries')
+def test_update_incidents_log_entries(mock_sync, mock_redis, db):
+    """
+    Test the log entries mode replaces per incident refreshes with one feed read, unless one is already in progress
+    """
+    add_incident(db, 'P1_example-id', 'triggered')
+
+    mock_redis.return_value.set.side_effect = [True, False]
+
+    with patch.dict('oncall.api.tasks.app.config', {'INCIDENT_REFRESH_MODE': 'log_entries'}):
+        assert update_incidents()
+        assert update_incidents()
+
+    lease = mock_redis.return_value.set.call_args_list[0].args[1]
+
+    # Routed to the default queue unless the hot tier has a queue
+    mock_sync.apply_async.assert_called_once_with(kwargs={'lease': lease}, queue=None)
+    mock_redis.return_value.hincrby.assert_called_once_with('oncall:metrics', 'refresh_duplicates_skipped', 1)
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.PagerDuty')
+def test_sync_log_entries_releases_lease(mock_pagerduty, mock_redis, db):
+    """
+    Test the sync gives up its lease once it is done, even when the read fails
+    """
+    mock_pagerduty.return_value.get_log_entries.side_effect = RequestFailure('boom')
+
+    assert not _sync_log_entries(lease='token-1')
+
+    mock_redis.return_value.register_script.return_value.assert_called_once_with(
+        keys=['oncall:lease:refresh:log_entries'], args=['token-1']
+    )
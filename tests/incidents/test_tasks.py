@@ -1,24 +1,36 @@
 # -*- coding: utf-8 -*-
 
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from celery.exceptions import Retry
 from mock import MagicMock, patch
 
 from oncall.api.models import Incidents, Teams
 from oncall.api.tasks import (
-    _populate_incident,
-    _update_incident,
+    _populate_incidents_chunk,
+    _rate_limiter,
+    _record_processed,
+    _refresh_teams_chunk,
+    _update_incidents_chunk,
     populate_incidents,
     populate_teams,
+    update_incidents,
 )
+from oncall.utils.pagerduty import RateLimit, RequestFailure
 
 
-@patch('oncall.api.tasks._populate_incident')
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._populate_incidents_chunk')
 @patch('oncall.api.tasks.datetime')
-def test_populate_incidents(mock_datetime, mock_populate_incident, db):
+def test_populate_incidents(mock_datetime, mock_populate_chunk, mock_chord, mock_redis, db):
     """
     Test checking teams to populate incidents
     """
+    mock_redis.return_value.set.return_value = True
+
     current_time = datetime.now(timezone.utc)
 
     mock_datetime.now.return_value = current_time
@@ -35,16 +47,103 @@ def test_populate_incidents(mock_datetime, mock_populate_incident, db):
 
     assert populate_incidents()
 
-    mock_populate_incident.delay.assert_called_once_with(
-        since=current_time,
-        team_id=1,
-        until=current_time,
+    lease = mock_redis.return_value.set.call_args
+
+    assert lease.args[0] == 'oncall:lease:ingest:1'
+    assert lease.kwargs == {'nx': True, 'ex': 1800}
+
+    mock_populate_chunk.s.assert_called_once_with(
+        teams=[
+            {
+                'since': current_time,
+                'team_id': 1,
+                'until': current_time,
+                'lease': lease.args[1],
+            }
+        ]
     )
+    mock_chord.return_value.assert_called_once()
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._populate_incidents_chunk')
+def test_populate_incidents_coalesces_duplicates(mock_populate_chunk, mock_chord, mock_redis, db):
+    """
+    Test teams with an ingestion already queued or running are skipped and counted
+    """
+    # The first team's lease is still held by an earlier run
+    mock_redis.return_value.set.side_effect = [None, True]
+
+    for team_id in ('example-id', 'other-id'):
+        db.session.add(Teams(name=team_id, team_id=team_id, summary='', last_checked=datetime.now()))
+
+    db.session.commit()
+
+    assert populate_incidents()
+
+    assert [team['team_id'] for team in mock_populate_chunk.s.call_args.kwargs['teams']] == [2]
 
+    mock_redis.return_value.hincrby.assert_called_once_with('oncall:metrics', 'ingest_duplicates_skipped', 1)
 
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._populate_incidents_chunk')
+def test_populate_incidents_only_due_teams(mock_populate_chunk, mock_chord, mock_redis, db):
+    """
+    Test teams whose next poll is still in the future are not dispatched
+    """
+    mock_redis.return_value.set.return_value = True
+
+    for team_id, next_poll_at in (('example-id', datetime(2000, 1, 1)), ('other-id', datetime(2999, 1, 1))):
+        team = Teams(name=team_id, team_id=team_id, summary='', last_checked=datetime.now())
+        team.next_poll_at = next_poll_at
+
+        db.session.add(team)
+
+    db.session.commit()
+
+    assert populate_incidents()
+
+    assert [team['team_id'] for team in mock_populate_chunk.s.call_args.kwargs['teams']] == [1]
+    assert mock_redis.return_value.set.call_count == 1
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.ingest_team')
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_incidents_chunk_releases_leases(mock_pagerduty, mock_ingest_team, mock_redis, db):
+    """
+    Test each team's lease is released once it has been ingested, and a failing team does not stop the chunk
+    """
+    mock_ingest_team.side_effect = [True, ValueError('boom'), True]
+
+    release = mock_redis.return_value.register_script.return_value
+
+    assert (
+        _populate_incidents_chunk(
+            teams=[
+                {'team_id': 1, 'since': None, 'until': None, 'lease': 'token-1'},
+                {'team_id': 2, 'since': None, 'until': None, 'lease': 'token-2'},
+                {'team_id': 3, 'since': None, 'until': None, 'lease': 'token-3'},
+            ]
+        )
+        == 3
+    )
+
+    assert mock_ingest_team.call_count == 3
+    assert [call.kwargs for call in release.call_args_list] == [
+        {'keys': ['oncall:lease:ingest:1'], 'args': ['token-1']},
+        {'keys': ['oncall:lease:ingest:2'], 'args': ['token-2']},
+        {'keys': ['oncall:lease:ingest:3'], 'args': ['token-3']},
+    ]
+
+
+@patch('oncall.api.tasks.get_redis')
 @patch('oncall.api.tasks.PagerDuty')
 @patch('oncall.api.tasks.datetime')
-def test_populate_incident(mock_datetime, mock_pagerduty, db):
+def test_populate_incident(mock_datetime, mock_pagerduty, mock_redis, db):
     """
     Test populating alerts
     """
@@ -83,7 +182,7 @@ def test_populate_incident(mock_datetime, mock_pagerduty, db):
     )
     db.session.commit()
 
-    assert _populate_incident(team_id=1, since=current_time, until=current_time)
+    assert _populate_incidents_chunk(teams=[{'team_id': 1, 'since': current_time, 'until': current_time}]) == 1
 
     incident = Incidents.query.filter_by(incident_id='PT4KHLK_example-id').one_or_none()
 
@@ -95,9 +194,16 @@ def test_populate_incident(mock_datetime, mock_pagerduty, db):
     assert incident.description == 'No description'
     assert incident.status == 'resolved'
 
+    # A team that just raised an incident is polled again as soon as allowed
+    team = db.session.get(Teams, 1)
+
+    assert team.poll_interval == 60
+    assert team.next_poll_at == current_time + timedelta(seconds=60)
 
+
+@patch('oncall.api.tasks.backfill_team')
 @patch('oncall.api.tasks.PagerDuty')
-def test_populate_teams(mock_teams, db):
+def test_populate_teams(mock_teams, mock_backfill_team, db):
     """
     Test populating teams
     """
@@ -121,8 +227,9 @@ def test_populate_teams(mock_teams, db):
     assert populate_teams()
 
 
+@patch('oncall.api.tasks.get_redis')
 @patch('oncall.api.tasks.PagerDuty')
-def test_update_incident_helper_status_mismatch(mock_incident, db):
+def test_update_incident_helper_status_mismatch(mock_incident, mock_redis, db):
     """
     Test incident helper when the status does not match the status stored in the database
     """
@@ -170,9 +277,509 @@ def test_update_incident_helper_status_mismatch(mock_incident, db):
 
     incident = Incidents.query.filter_by(incident_id='PT4KHLK').one_or_none()
 
-    assert _update_incident(incident_id=incident.id)
-    db.session.commit()  # commit the changes that were applied in the _update_incident function
+    assert _update_incidents_chunk(incidents=[{'incident_id': incident.id}]) == 1
+    db.session.commit()  # commit the changes that were applied in the _update_incidents_chunk function
 
     assert Incidents.query.filter_by(id=incident.id).one().status == 'resolved'
 
     mock_incident_.get_incident.assert_called_once_with(incident_id='PT4KHLK')
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.PagerDuty')
+def test_update_incidents_chunk_request_failure(mock_pagerduty, mock_redis, db):
+    """
+    Test an incident PagerDuty fails to return does not stop the rest of its chunk being refreshed
+    """
+    mock_pagerduty.return_value.get_incident.side_effect = [
+        RequestFailure('404 Not Found'),
+        {'status': 'resolved'},
+        {'status': 'acknowledged'},
+    ]
+
+    db.session.add(Teams(name='example', team_id='example-id', summary='example SRE', last_checked=datetime.now()))
+    db.session.commit()
+
+    for incident_id in ('P1', 'P2', 'P3'):
+        db.session.add(
+            Incidents(
+                title='Down Replica DB',
+                description='Down Replica DB',
+                summary='Down Replica DB',
+                status='triggered',
+                created_at=datetime.now(),
+                incident_id=f'{incident_id}_example-id',
+                actionable=None,
+                annotation=None,
+                urgency='high',
+                team=1,
+            )
+        )
+    db.session.commit()
+
+    release = mock_redis.return_value.register_script.return_value
+
+    incidents = [{'incident_id': number, 'lease': f'token-{number}'} for number in (1, 2, 3)]
+
+    assert _update_incidents_chunk(incidents=incidents) == 3
+
+    assert [incident.status for incident in Incidents.query.order_by(Incidents.id)] == [
+        'triggered',
+        'resolved',
+        'acknowledged',
+    ]
+    assert [call.kwargs for call in release.call_args_list] == [
+        {'keys': [f'oncall:lease:refresh:incident:{number}'], 'args': [f'token-{number}']} for number in (1, 2, 3)
+    ]
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_incident_rate_limited(mock_pagerduty, mock_redis, db):
+    """
+    Test a rate limited ingestion is rescheduled through celery
+    """
+    mock_pagerduty.return_value.get_incidents.side_effect = RateLimit('rate limited', retry_after=12)
+
+    db.session.add(
+        Teams(
+            name='example',
+            team_id='example-id',
+            summary='example SRE',
+            last_checked=datetime.now(),
+        )
+    )
+    db.session.commit()
+
+    teams = [{'team_id': 1, 'since': datetime.now(), 'until': datetime.now()}]
+
+    with patch.object(_populate_incidents_chunk, 'retry', side_effect=Retry()) as mock_retry:
+        with pytest.raises(Retry):
+            _populate_incidents_chunk(teams=teams)
+
+    mock_retry.assert_called_once_with(
+        exc=mock_pagerduty.return_value.get_incidents.side_effect,
+        countdown=12,
+        max_retries=5,
+        kwargs={'teams': teams, 'processed': 0},
+    )
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.PagerDuty')
+def test_update_incident_rate_limited(mock_pagerduty, mock_redis, db):
+    """
+    Test a rate limited status refresh is rescheduled through celery
+    """
+    mock_pagerduty.return_value.get_incident.side_effect = RateLimit('rate limited', retry_after=7)
+
+    db.session.add(
+        Incidents(
+            title='Down Replica DB',
+            description='Down Replica DB',
+            summary='Down Replica DB',
+            status='triggered',
+            created_at=datetime.now(),
+            incident_id='PT4KHLK',
+            actionable=None,
+            annotation=None,
+            urgency='high',
+            team=1,
+        )
+    )
+    db.session.commit()
+
+    with patch.object(_update_incidents_chunk, 'retry', side_effect=Retry()) as mock_retry:
+        with pytest.raises(Retry):
+            _update_incidents_chunk(incidents=[{'incident_id': 1, 'lease': 'token-1'}])
+
+    assert mock_retry.call_args.kwargs['countdown'] == 7
+    assert mock_retry.call_args.kwargs['kwargs'] == {
+        'incidents': [{'incident_id': 1, 'lease': 'token-1'}],
+        'processed': 0,
+    }
+
+    # The incident keeps its lease for the retry
+    mock_redis.return_value.register_script.return_value.assert_not_called()
+
+
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_teams_rate_limited(mock_pagerduty, db):
+    """
+    Test a rate limited team sync is rescheduled through celery
+    """
+    mock_pagerduty.return_value.get_teams.side_effect = RateLimit('rate limited', retry_after=3)
+
+    with patch.object(populate_teams, 'retry', side_effect=Retry()) as mock_retry:
+        with pytest.raises(Retry):
+            populate_teams()
+
+    assert mock_retry.call_args.kwargs['countdown'] == 3
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_incident_skips_existing(mock_pagerduty, mock_redis, db):
+    """
+    Test ingestion only inserts incidents that are not already stored
+    """
+
+    def incident(incident_id):
+        return {
+            'id': incident_id,
+            'summary': f'[#{incident_id}] The server is on fire.',
+            'created_at': '2015-10-06T21:30:42Z',
+            'status': 'triggered',
+            'title': 'The server is on fire.',
+            'urgency': 'low',
+        }
+
+    mock_pagerduty.return_value.get_incidents.return_value = [
+        [incident('P1'), incident('P2'), incident('P2')],
+        [incident('P2'), incident('P3')],
+    ]
+
+    db.session.add(
+        Teams(
+            name='example',
+            team_id='example-id',
+            summary='example SRE',
+            last_checked=datetime.now(),
+        )
+    )
+    db.session.add(
+        Incidents(
+            title='Already stored',
+            description='Already stored',
+            summary='Already stored',
+            status='resolved',
+            created_at=datetime.now(),
+            incident_id='P1_example-id',
+            actionable=True,
+            annotation=None,
+            urgency='high',
+            team=1,
+        )
+    )
+    db.session.commit()
+
+    assert _populate_incidents_chunk(teams=[{'team_id': 1, 'since': datetime.now(), 'until': datetime.now()}]) == 1
+
+    incidents = {incident.incident_id: incident for incident in Incidents.query.all()}
+
+    assert sorted(incidents) == ['P1_example-id', 'P2_example-id', 'P3_example-id']
+    assert incidents['P1_example-id'].title == 'Already stored'
+    assert incidents['P1_example-id'].actionable is True
+    assert incidents['P3_example-id'].urgency == 'low'
+    assert incidents['P3_example-id'].team == 1
+
+
+@patch('oncall.api.tasks.backfill_team')
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_teams_sync(mock_teams, mock_backfill_team, db):
+    """
+    Test populating teams inserts new teams and refreshes existing ones
+    """
+    mock_teams.return_value.get_teams.return_value = [
+        [
+            {'id': 'PQ9K7I8', 'name': 'Engineering', 'summary': 'All engineering'},
+            {'id': 'PQ9K7I9', 'name': 'Database', 'summary': 'Database SRE'},
+        ],
+        [
+            {'id': 'PQ9K7J0', 'name': 'Networking', 'summary': 'Networking'},
+        ],
+    ]
+
+    last_checked = datetime(2023, 1, 1)
+
+    db.session.add(Teams(name='Eng', team_id='PQ9K7I8', summary='Engineering', last_checked=last_checked))
+    db.session.add(Teams(name='Database', team_id='PQ9K7I9', summary='Database SRE', last_checked=last_checked))
+    db.session.commit()
+
+    assert populate_teams()
+
+    teams = {team.team_id: team for team in Teams.query.all()}
+
+    assert len(teams) == 3
+
+    assert teams['PQ9K7I8'].name == 'Engineering'
+    assert teams['PQ9K7I8'].summary == 'All engineering'
+    assert teams['PQ9K7I8'].last_checked == last_checked
+
+    assert teams['PQ9K7J0'].name == 'Networking'
+    assert teams['PQ9K7J0'].created_at is not None
+    assert teams['PQ9K7J0'].last_checked < datetime.now()
+
+    # Only the new team is bootstrapped, through the backfill engine
+    backfill = mock_backfill_team.delay.call_args.kwargs
+
+    mock_backfill_team.delay.assert_called_once()
+
+    assert backfill['team_id'] == teams['PQ9K7J0'].id
+    assert (backfill['until'] - backfill['since']).days == 90
+    assert teams['PQ9K7J0'].last_checked == backfill['until'].replace(tzinfo=None)
+
+
+def _add_incident(db, incident_id, status, team=1, urgency='high', created_at=None):
+    """
+    Store an incident for a task test
+    """
+    incident = Incidents(
+        title='Down Replica DB',
+        description='Down Replica DB',
+        summary='Down Replica DB',
+        status=status,
+        created_at=created_at or datetime.now(),
+        incident_id=incident_id,
+        actionable=None,
+        annotation=None,
+        urgency=urgency,
+        team=team,
+    )
+
+    db.session.add(incident)
+    db.session.commit()
+
+    return incident
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._refresh_teams_chunk')
+def test_update_incidents_batched(mock_refresh_chunk, mock_chord, mock_redis, db):
+    """
+    Test the batched refresh queues the teams with unresolved incidents on the hot queue
+    """
+    mock_redis.return_value.set.return_value = True
+
+    _add_incident(db, 'P1_example-id', 'triggered', team=1)
+    _add_incident(db, 'P2_example-id', 'acknowledged', team=1)
+    _add_incident(db, 'P3_other-id', 'resolved', team=2)
+
+    with patch.dict('oncall.api.tasks.app.config', {'INCIDENT_REFRESH_QUEUES': {'hot': 'refresh-hot'}}):
+        assert update_incidents()
+
+    teams = mock_refresh_chunk.s.call_args.kwargs['teams']
+
+    mock_refresh_chunk.s.assert_called_once()
+    mock_refresh_chunk.s.return_value.set.assert_called_once_with(queue='refresh-hot')
+
+    assert [team['team_id'] for team in teams] == [1]
+    assert mock_redis.return_value.set.call_args.args == ('oncall:lease:refresh:team:1', teams[0]['lease'])
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._refresh_teams_chunk')
+def test_update_incidents_skips_refreshes_in_progress(mock_refresh_chunk, mock_chord, mock_redis, db):
+    """
+    Test a team whose previous refresh is still queued or running is not dispatched again
+    """
+    _add_incident(db, 'P1_example-id', 'triggered', team=1)
+    _add_incident(db, 'P2_other-id', 'triggered', team=2)
+
+    # Team 1 still holds its lease from the last cycle
+    mock_redis.return_value.set.side_effect = lambda key, *args, **kwargs: not key.endswith(':team:1')
+
+    assert update_incidents()
+
+    assert [team['team_id'] for team in mock_refresh_chunk.s.call_args.kwargs['teams']] == [2]
+
+    mock_redis.return_value.hincrby.assert_called_once_with('oncall:metrics', 'refresh_duplicates_skipped', 1)
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.PagerDuty')
+def test_refresh_team_incidents(mock_pagerduty, mock_redis, db):
+    """
+    Test a team's unresolved incidents are refreshed from the open incident list
+    """
+    mock_pagerduty.return_value.get_incidents_by_status.return_value = [
+        [{'id': 'P1', 'status': 'acknowledged'}, {'id': 'P2', 'status': 'triggered'}],
+        [{'id': 'P4', 'status': 'triggered'}],
+    ]
+    mock_pagerduty.return_value.get_incident.return_value = {'id': 'P3', 'status': 'resolved'}
+
+    db.session.add(Teams(name='example', team_id='example-id', summary='example SRE', last_checked=datetime.now()))
+    db.session.commit()
+
+    _add_incident(db, 'P1_example-id', 'triggered')
+    _add_incident(db, 'P2_example-id', 'triggered')
+    _add_incident(db, 'P3_example-id', 'acknowledged')
+    _add_incident(db, 'P5_example-id', 'resolved')
+
+    assert _refresh_teams_chunk(teams=[{'team_id': 1, 'lease': 'token-1'}]) == 1
+
+    statuses = {incident.incident_id: incident.status for incident in Incidents.query.all()}
+
+    assert statuses == {
+        'P1_example-id': 'acknowledged',
+        'P2_example-id': 'triggered',
+        'P3_example-id': 'resolved',
+        'P5_example-id': 'resolved',
+    }
+
+    mock_pagerduty.return_value.get_incidents_by_status.assert_called_once_with(
+        team_id='example-id', statuses=('triggered', 'acknowledged')
+    )
+    mock_pagerduty.return_value.get_incident.assert_called_once_with(incident_id='P3')
+
+    refreshed = {incident.incident_id: incident.refreshed_at for incident in Incidents.query.all()}
+
+    assert None not in [refreshed[f'P{number}_example-id'] for number in (1, 2, 3)]
+    assert refreshed['P5_example-id'] is None
+
+    # The team gives up its refresh lease once it has been refreshed
+    mock_redis.return_value.register_script.return_value.assert_called_once_with(
+        keys=['oncall:lease:refresh:team:1'], args=['token-1']
+    )
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._refresh_teams_chunk')
+def test_update_incidents_prioritised(mock_refresh_chunk, mock_chord, mock_redis, app, db):
+    """
+    Test teams are refreshed in the hottest tier of their due incidents, each tier on its own queue
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    # Team 1 has a fresh triggered incident and a long stuck one
+    _add_incident(db, 'P1_example-id', 'triggered', team=1, created_at=now)
+    _add_incident(db, 'P2_example-id', 'acknowledged', team=1, created_at=now - timedelta(days=7))
+    # Team 2 has an old low urgency acknowledged incident that was just refreshed, and one that is due
+    _add_incident(db, 'P3_other-id', 'acknowledged', team=2, urgency='low', created_at=now - timedelta(hours=10))
+    _add_incident(db, 'P4_other-id', 'acknowledged', team=3, urgency='low', created_at=now - timedelta(hours=10))
+    # Team 4 only has a long stuck incident
+    _add_incident(db, 'P5_last-id', 'triggered', team=4, created_at=now - timedelta(days=7))
+
+    db.session.get(Incidents, 3).refreshed_at = now - timedelta(minutes=30)
+    db.session.get(Incidents, 4).refreshed_at = now - timedelta(hours=2)
+    db.session.commit()
+
+    queues = {'hot': 'refresh-hot', 'warm': 'refresh-warm', 'cold': 'refresh-cold'}
+
+    with patch.dict('oncall.api.tasks.app.config', {'INCIDENT_REFRESH_QUEUES': queues}):
+        assert update_incidents()
+
+    assert [[team['team_id'] for team in call.kwargs['teams']] for call in mock_refresh_chunk.s.call_args_list] == [
+        [1],
+        [3],
+        [4],
+    ]
+    assert [call.kwargs for call in mock_refresh_chunk.s.return_value.set.call_args_list] == [
+        {'queue': 'refresh-hot'},
+        {'queue': 'refresh-warm'},
+        {'queue': 'refresh-cold'},
+    ]
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.chord')
+@patch('oncall.api.tasks._update_incidents_chunk')
+def test_update_incidents_individual_chunks(mock_update_chunk, mock_chord, mock_redis, app, db):
+    """
+    Test the individual refresh splits unresolved incidents into chunks
+    """
+    for number in range(5):
+        _add_incident(db, f'P{number}_example-id', 'triggered')
+
+    _add_incident(db, 'P5_example-id', 'resolved')
+
+    with patch.dict(
+        'oncall.api.tasks.app.config', {'INCIDENT_REFRESH_MODE': 'individual', 'INCIDENT_CHUNK_SIZE': 2}
+    ):
+        assert update_incidents()
+
+    assert [
+        [incident['incident_id'] for incident in call.kwargs['incidents']]
+        for call in mock_update_chunk.s.call_args_list
+    ] == [[1, 2], [3, 4], [5]]
+
+    mock_chord.return_value.assert_called_once_with(_record_processed.s(kind='incidents refreshed'))
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.ingest_team')
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_incidents_chunk_rate_limited(mock_pagerduty, mock_ingest_team, mock_redis, db):
+    """
+    Test a rate limited chunk only retries the teams it has not ingested yet
+    """
+    err = RateLimit('rate limited', retry_after=9)
+    mock_ingest_team.side_effect = [True, err]
+
+    teams = [
+        {'team_id': 1, 'since': None, 'until': None},
+        {'team_id': 2, 'since': None, 'until': None},
+        {'team_id': 3, 'since': None, 'until': None},
+    ]
+
+    with patch.object(_populate_incidents_chunk, 'retry', side_effect=Retry()) as mock_retry:
+        with pytest.raises(Retry):
+            _populate_incidents_chunk(teams=teams)
+
+    mock_retry.assert_called_once_with(exc=err, countdown=9, max_retries=5, kwargs={'teams': teams[1:], 'processed': 1})
+
+    # Only the team that finished gave up its lease
+    assert mock_redis.return_value.register_script.return_value.call_count == 1
+
+    mock_ingest_team.side_effect = None
+
+    assert _populate_incidents_chunk(teams=teams[1:], processed=1) == 3
+
+
+@patch('oncall.api.tasks.get_redis')
+@patch('oncall.api.tasks.ingest_team')
+@patch('oncall.api.tasks.PagerDuty')
+def test_populate_incidents_chunk_retries_exhausted(mock_pagerduty, mock_ingest_team, mock_redis, db):
+    """
+    Test the leases of the teams left are released when a chunk runs out of rate limit retries
+    """
+    err = RateLimit('rate limited', retry_after=9)
+    mock_ingest_team.side_effect = [True, err]
+
+    teams = [
+        {'team_id': 1, 'since': None, 'until': None, 'lease': 'token-1'},
+        {'team_id': 2, 'since': None, 'until': None, 'lease': 'token-2'},
+        {'team_id': 3, 'since': None, 'until': None, 'lease': 'token-3'},
+    ]
+
+    release = mock_redis.return_value.register_script.return_value
+
+    _populate_incidents_chunk.push_request(retries=5)
+
+    try:
+        with patch.object(_populate_incidents_chunk, 'retry', side_effect=err):
+            with pytest.raises(RateLimit):
+                _populate_incidents_chunk(teams=teams)
+    finally:
+        _populate_incidents_chunk.pop_request()
+
+    assert [call.kwargs for call in release.call_args_list] == [
+        {'keys': ['oncall:lease:ingest:1'], 'args': ['token-1']},
+        {'keys': ['oncall:lease:ingest:2'], 'args': ['token-2']},
+        {'keys': ['oncall:lease:ingest:3'], 'args': ['token-3']},
+    ]
+
+
+@patch('oncall.api.tasks.get_redis')
+def test_record_processed(mock_redis):
+    """
+    Test the fan-out callback totals the chunk results and counts them in the metrics
+    """
+    assert _record_processed([10, 10, 3], kind='incidents refreshed') == 23
+
+    mock_redis.return_value.hincrby.assert_called_once_with('oncall:metrics', 'incidents_refreshed', 23)
+
+
+@patch('oncall.api.tasks.get_redis')
+def test_rate_limiter_max_wait(mock_redis):
+    """
+    Test the workers' token bucket only sleeps briefly, longer waits are rescheduled
+    """
+    with patch.dict('oncall.api.tasks.app.config', {'PAGERDUTY_RATE_LIMIT': 60, 'PAGERDUTY_RATE_LIMIT_MAX_WAIT': 2}):
+        bucket = _rate_limiter('u+secret')
+
+    assert bucket.rate == 1
+    assert bucket.max_wait == 2
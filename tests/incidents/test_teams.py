@@ -4,6 +4,8 @@ from http import HTTPStatus
 
 from datetime import datetime
 
+from mock import patch
+
 
 def test_querying_teams(app, db):
     """
@@ -34,3 +36,18 @@ def test_querying_teams_none_exist(app, db):
 
     assert resp.status_code == HTTPStatus.OK
     assert resp.json == {'teams': []}
+
+
+@patch('oncall.api.routes.get_redis')
+def test_querying_metrics(mock_redis, app, db):
+    """
+    Test querying the ingestion counters
+    """
+    mock_redis.return_value.hgetall.return_value = {b'ingest_duplicates_skipped': b'4'}
+
+    client = app.test_client()
+
+    resp = client.get('/api/v1/metrics')
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json == {'metrics': {'ingest_duplicates_skipped': 4}}
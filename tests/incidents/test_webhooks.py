@@ -0,0 +1,213 @@
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from mock import MagicMock
+
+from oncall.api.models import Incidents, Teams
+from oncall.api.tasks import refresh_incident, refresh_team
+
+RECORDINGS = Path(__file__).parent / 'webhooks'
+SIGNATURES = json.loads((RECORDINGS / 'signatures.json').read_text())
+
+
+def deliver(client, event, signature=None):
+    """
+    Replay a recorded PagerDuty webhook delivery
+    """
+    return client.post(
+        '/webhooks/pagerduty',
+        data=(RECORDINGS / f'{event}.json').read_bytes(),
+        headers={
+            'Content-Type': 'application/json',
+            'X-PagerDuty-Signature': signature or SIGNATURES[f'{event}.json'],
+        },
+    )
+
+
+def create_team(db):
+    """
+    Create the team the recorded incident belongs to
+    """
+    team = Teams(name='Engineering', team_id='PFCVPS0', summary='Engineering', last_checked=datetime(2020, 4, 9))
+
+    db.session.add(team)
+    db.session.commit()
+
+    return team
+
+
+def test_webhook_creates_incident(app, db):
+    """
+    Test a triggered event stores the incident
+    """
+    create_team(db)
+
+    resp = deliver(app.test_client(), 'incident.triggered')
+
+    assert resp.status_code == 200
+    assert resp.json == {'incidents': 1}
+
+    incident = Incidents.query.filter_by(incident_id='PGR0VU2_PFCVPS0').one()
+
+    assert incident.status == 'triggered'
+    assert incident.title == 'A little bump in the road'
+    assert incident.summary == '[#2] A little bump in the road'
+    assert incident.urgency == 'high'
+    assert incident.created_at == datetime(2020, 4, 9, 15, 16, 27)
+
+    # Polling the team is pushed back to a reconciliation pass
+    assert db.session.get(Teams, 1).next_poll_at > datetime.utcnow()
+
+
+def test_webhook_status_transitions(app, db):
+    """
+    Test status transitions are applied, ignoring retried and out of order deliveries
+    """
+    create_team(db)
+
+    client = app.test_client()
+
+    for event in ('incident.triggered', 'incident.acknowledged', 'incident.resolved'):
+        assert deliver(client, event).json == {'incidents': 1}
+
+    # A retried or late delivery changes nothing
+    assert deliver(client, 'incident.resolved').json == {'incidents': 0}
+    assert deliver(client, 'incident.acknowledged').json == {'incidents': 0}
+
+    incident = Incidents.query.one()
+
+    assert incident.status == 'resolved'
+    assert incident.updated_at == datetime(2020, 4, 9, 15, 31, 44, 901000)
+
+
+def test_webhook_out_of_order_creates_incident(app, db):
+    """
+    Test an incident first seen through a later event is created with that event's status
+    """
+    create_team(db)
+
+    client = app.test_client()
+
+    assert deliver(client, 'incident.acknowledged').json == {'incidents': 1}
+    assert deliver(client, 'incident.triggered').json == {'incidents': 0}
+
+    assert Incidents.query.one().status == 'acknowledged'
+
+
+@pytest.mark.parametrize(
+    'refresh',
+    [
+        lambda pyduty, incident: refresh_team(pyduty, incident.team),
+        lambda pyduty, incident: refresh_incident(pyduty, incident.id),
+    ],
+    ids=['refresh_team', 'refresh_incident'],
+)
+@pytest.mark.parametrize(
+    'changed_at, updated_at',
+    [
+        ('2020-04-09T15:31:44Z', datetime(2020, 4, 9, 15, 31, 44)),
+        # Without PagerDuty's time of the change, the time of the poll is recorded
+        (None, None),
+    ],
+    ids=['changed_at', 'poll_time'],
+)
+def test_webhook_after_poll(app, db, refresh, changed_at, updated_at):
+    """
+    Test a delivery older than the status a poll applied does not move the incident back
+    """
+    create_team(db)
+
+    client = app.test_client()
+
+    assert deliver(client, 'incident.triggered').json == {'incidents': 1}
+
+    pyduty = MagicMock()
+    pyduty.get_incidents_by_status.return_value = [[]]
+    pyduty.get_incident.return_value = {'id': 'PGR0VU2', 'status': 'resolved', 'last_status_change_at': changed_at}
+
+    assert refresh(pyduty, Incidents.query.one())
+
+    assert deliver(client, 'incident.acknowledged').json == {'incidents': 0}
+
+    incident = Incidents.query.one()
+
+    assert incident.status == 'resolved'
+    assert incident.updated_at == (updated_at or incident.refreshed_at)
+
+
+def test_poll_after_webhook(app, db):
+    """
+    Test a poll returning a status older than the last delivery does not move the incident back
+    """
+    create_team(db)
+
+    client = app.test_client()
+
+    for event in ('incident.triggered', 'incident.resolved'):
+        assert deliver(client, event).json == {'incidents': 1}
+
+    pyduty = MagicMock()
+    pyduty.get_incident.return_value = {
+        'id': 'PGR0VU2',
+        'status': 'acknowledged',
+        'last_status_change_at': '2020-04-09T15:20:02Z',
+    }
+
+    assert refresh_incident(pyduty, Incidents.query.one().id)
+
+    assert Incidents.query.one().status == 'resolved'
+
+
+def test_webhook_ignores_other_events(app, db):
+    """
+    Test events that do not carry the incident are acknowledged without changes
+    """
+    create_team(db)
+
+    resp = deliver(app.test_client(), 'incident.annotated')
+
+    assert resp.status_code == 200
+    assert resp.json == {'incidents': 0}
+    assert Incidents.query.count() == 0
+
+
+def test_webhook_unknown_team(app, db):
+    """
+    Test events for teams that are not tracked are ignored
+    """
+    resp = deliver(app.test_client(), 'incident.triggered')
+
+    assert resp.status_code == 200
+    assert resp.json == {'incidents': 0}
+    assert Incidents.query.count() == 0
+
+
+def test_webhook_invalid_signature(app, db):
+    """
+    Test deliveries that are not signed with a subscription secret are rejected
+    """
+    create_team(db)
+
+    client = app.test_client()
+
+    assert deliver(client, 'incident.triggered', signature='v1=deadbeef').status_code == 401
+    assert deliver(client, 'incident.triggered', signature=SIGNATURES['incident.resolved.json']).status_code == 401
+
+    resp = client.post('/webhooks/pagerduty', data=(RECORDINGS / 'incident.triggered.json').read_bytes())
+
+    assert resp.status_code == 401
+    assert resp.json == {'error': 'invalid signature'}
+    assert Incidents.query.count() == 0
+
+
+def test_webhook_rotated_secret(app, db):
+    """
+    Test a delivery signed with several secrets is accepted when any of them match
+    """
+    create_team(db)
+
+    signature = f'v1=deadbeef, {SIGNATURES["incident.triggered.json"]}'
+
+    assert deliver(app.test_client(), 'incident.triggered', signature=signature).json == {'incidents': 1}
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from mock import MagicMock, patch
+
+from oncall.utils.cache import MemoryCache, RedisCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """
+    Test the least recently used entry is evicted once the cache is full
+    """
+    cache = MemoryCache(max_entries=2, ttl=60)
+
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+
+    assert cache.get('a') == b'1'
+
+    cache.set('c', b'3')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+
+
+@patch('oncall.utils.cache.time')
+def test_memory_cache_expires_entries(mock_time):
+    """
+    Test entries are no longer served after their ttl
+    """
+    mock_time.monotonic.return_value = 100
+
+    cache = MemoryCache(max_entries=10, ttl=30)
+    cache.set('a', b'1')
+
+    mock_time.monotonic.return_value = 129
+
+    assert cache.get('a') == b'1'
+
+    mock_time.monotonic.return_value = 130
+
+    assert cache.get('a') is None
+
+
+def test_memory_cache_counters():
+    """
+    Test the counters of an in-process cache are kept by the cache
+    """
+    cache = MemoryCache(max_entries=10, ttl=30)
+
+    cache.count('response_cache_misses')
+    cache.count('response_cache_hits')
+    cache.count('response_cache_hits')
+
+    assert cache.counters() == {'response_cache_misses': 1, 'response_cache_hits': 2}
+
+
+def test_redis_cache():
+    """
+    Test entries are stored in Redis with their ttl
+    """
+    redis = MagicMock()
+    redis.get.return_value = b'1'
+
+    cache = RedisCache(redis, ttl=30)
+    cache.set('a', b'1')
+
+    assert cache.get('a') == b'1'
+
+    redis.set.assert_called_once_with('oncall:cache:a', b'1', ex=30)
+    redis.get.assert_called_once_with('oncall:cache:a')
+
+
+def test_redis_cache_counters():
+    """
+    Test the counters of a Redis cache are kept in the cluster wide metrics
+    """
+    redis = MagicMock()
+
+    cache = RedisCache(redis, ttl=30)
+    cache.count('response_cache_hits')
+
+    redis.hincrby.assert_called_once_with('oncall:metrics', 'response_cache_hits', 1)
+    assert cache.counters() == {}
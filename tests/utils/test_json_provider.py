@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+import pytz
+from mock import patch
+
+from oncall import create_app
+from oncall.utils.json_provider import JSONProvider, ORJSONProvider
+
+PAYLOAD = {
+    'incidents': [
+        {
+            'id': 1,
+            'created_at': pytz.timezone('Australia/Adelaide').localize(datetime(2023, 8, 25, 10, 30)),
+            'annotation': {'summary': 'Disk full', 'created_at': datetime(2023, 8, 26, 1, 2, 3, 456789)},
+            'actionable': None,
+        }
+    ],
+    'summary': {'2023-08-25': {'low': 0, 'high': 1}},
+    'day': date(2023, 8, 25),
+    'ratio': Decimal('0.25'),
+    'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+}
+
+
+def test_orjson_provider_matches_json_provider(app):
+    """
+    Test orjson writes the same bytes as the standard library provider
+    """
+    pytest.importorskip('orjson')
+
+    with app.app_context():
+        expected = JSONProvider(app).response(PAYLOAD)
+        resp = ORJSONProvider(app).response(PAYLOAD)
+
+    assert resp.mimetype == 'application/json'
+    assert resp.get_data() == expected.get_data()
+    assert resp.json['incidents'][0]['created_at'] == '2023-08-25T10:30:00+09:30'
+    assert resp.json['incidents'][0]['annotation']['created_at'] == '2023-08-26T01:02:03.456789'
+    assert resp.json['ratio'] == '0.25'
+
+
+def test_orjson_provider_dumps_and_loads(app):
+    """
+    Test dumps honours sort_keys and indent and loads reads strings and bytes
+    """
+    pytest.importorskip('orjson')
+
+    provider = ORJSONProvider(app)
+
+    assert provider.dumps({'b': 1, 'a': 2}) == '{"a":2,"b":1}'
+    assert provider.dumps({'b': 1, 'a': 2}, sort_keys=False) == '{"b":1,"a":2}'
+    assert provider.dumps({'a': 1}, indent=2) == '{\n  "a": 1\n}'
+
+    assert provider.loads('{"a": 1}') == provider.loads(b'{"a": 1}') == {'a': 1}
+
+
+def test_create_app_json_provider():
+    """
+    Test orjson is used when installed
+    """
+    pytest.importorskip('orjson')
+
+    assert isinstance(create_app('testing').json, ORJSONProvider)
+
+
+def test_create_app_json_provider_fallback():
+    """
+    Test the standard library is used when orjson is not installed
+    """
+    with patch('oncall.utils.json_provider.orjson', None):
+        provider = create_app('testing').json
+
+    assert type(provider) is JSONProvider
+    assert provider.dumps({'day': date(2023, 8, 25)}) == '{"day": "2023-08-25"}'
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from mock import MagicMock
+
+from oncall.utils import metrics
+from oncall.utils.locks import Lease
+
+
+def test_lease_acquire():
+    """
+    Test a lease is only acquired when the key is free
+    """
+    redis = MagicMock()
+    redis.set.side_effect = [True, None]
+
+    lease = Lease(redis, 'lease', ttl=60)
+
+    assert lease.acquire()
+    assert not Lease(redis, 'lease', ttl=60).acquire()
+
+    redis.set.assert_any_call('lease', lease.token, nx=True, ex=60)
+
+
+def test_lease_release():
+    """
+    Test releasing a lease only deletes it for the owner's token
+    """
+    redis = MagicMock()
+    redis.register_script.return_value.return_value = 1
+
+    assert Lease(redis, 'lease', ttl=60, token='owner').release()
+
+    redis.register_script.return_value.assert_called_once_with(keys=['lease'], args=['owner'])
+
+
+def test_metrics():
+    """
+    Test incrementing and reading counters
+    """
+    redis = MagicMock()
+    redis.hgetall.return_value = {b'ingest_duplicates_skipped': b'3'}
+
+    metrics.incr(redis, 'ingest_duplicates_skipped', 3)
+
+    redis.hincrby.assert_called_once_with('oncall:metrics', 'ingest_duplicates_skipped', 3)
+
+    assert metrics.get_metrics(redis) == {'ingest_duplicates_skipped': 3}
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import threading
+import time
 import types
 import pytest
 
 import dateutil.parser
-from mock import PropertyMock, patch
+from mock import MagicMock, PropertyMock, patch
 
-from oncall.utils.pagerduty import PagerDuty, RequestFailure
+from oncall.utils.pagerduty import AsyncPagerDuty, PagerDuty, RateLimit, RequestFailure, close_sessions, get_session
 
 
 @patch('oncall.utils.pagerduty.PagerDuty._query')
@@ -367,3 +370,249 @@ def test_query_failure(mock_session, mock_request):
         params={'offset': 0},
         url='https://api.pagerduty.com/teams',
     )
+
+
+@patch('oncall.utils.pagerduty.Request')
+@patch('oncall.utils.pagerduty.Session')
+def test_query_reuses_session(mock_session, mock_request):
+    """
+    Test that consecutive queries share a single pooled session
+    """
+    mock_status = PropertyMock(return_value=200)
+    type(mock_session).status_code = mock_status
+
+    mock_session.send.return_value = mock_session
+    mock_session.json.return_value = {'teams': [], 'more': False}
+
+    mock_session.return_value = mock_session
+
+    pyduty = PagerDuty('abc123')
+
+    next(pyduty.get_teams())
+    next(PagerDuty('abc123').get_teams())
+
+    mock_session.assert_called_once_with()
+    assert mock_session.send.call_count == 2
+
+
+@patch('oncall.utils.pagerduty.Session')
+def test_get_session_pool_size(mock_session):
+    """
+    Test that the pooled session mounts an adapter sized to the pool
+    """
+    mock_session.return_value = mock_session
+
+    assert get_session(pool_size=4, max_retries=2) is get_session(pool_size=4, max_retries=2)
+
+    adapter = mock_session.mount.call_args_list[0].args[1]
+
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+
+    close_sessions()
+
+    mock_session.close.assert_called_once_with()
+
+
+def _collect(generator):
+    """
+    Drain an async generator
+    """
+
+    async def collect():
+        return [page async for page in generator]
+
+    return asyncio.run(collect())
+
+
+@patch('oncall.utils.pagerduty.PagerDuty._query')
+def test_async_get_incidents_concurrent_pages(mock_query_resp):
+    """
+    Test the async client fetches the remaining pages concurrently and in order
+    """
+    lock = threading.Lock()
+    running = {'now': 0, 'max': 0}
+
+    def query(method, endpoint, payload=None):
+        with lock:
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+
+        time.sleep(0.05)
+
+        with lock:
+            running['now'] -= 1
+
+        return {
+            'incidents': [{'id': payload['offset']}],
+            'total': 250,
+            'more': payload['offset'] + 25 < 250,
+        }
+
+    mock_query_resp.side_effect = query
+
+    pyduty = AsyncPagerDuty('abc123', concurrency=3)
+
+    pages = _collect(
+        pyduty.get_incidents(
+            'ABCXYZ',
+            since=dateutil.parser.parse('2019-01-01T06:42:09.668417+00:00'),
+            until=dateutil.parser.parse('2019-01-01T06:52:09.668417+00:00'),
+        )
+    )
+
+    assert pages == [[{'id': offset}] for offset in range(0, 250, 25)]
+    assert running['max'] == 3
+
+    mock_query_resp.assert_any_call(
+        method='GET',
+        endpoint='incidents',
+        payload={
+            'team_ids[]': 'ABCXYZ',
+            'time_zone': 'UTC',
+            'since': '2019-01-01T06:42:09.668417+00:00',
+            'until': '2019-01-01T06:52:09.668417+00:00',
+            'offset': 0,
+            'limit': 25,
+            'total': 'true',
+        },
+    )
+
+
+@patch('oncall.utils.pagerduty.PagerDuty._query')
+def test_async_get_teams_without_total(mock_query_resp):
+    """
+    Test the async client walks the pages when PagerDuty returns no total
+    """
+    mock_query_resp.side_effect = [
+        {'teams': [{'id': 'PQ9K7I8'}], 'total': None, 'more': True},
+        {'teams': [{'id': 'PQ9K7I9'}], 'total': None, 'more': False},
+    ]
+
+    pages = _collect(AsyncPagerDuty('abc123').get_teams())
+
+    assert pages == [[{'id': 'PQ9K7I8'}], [{'id': 'PQ9K7I9'}]]
+
+    mock_query_resp.assert_called_with(method='GET', endpoint='teams', payload={'offset': 25, 'limit': 25})
+
+
+@patch('oncall.utils.pagerduty.PagerDuty._query')
+def test_async_get_incident(mock_query_resp):
+    """
+    Test getting a single incident with the async client
+    """
+    mock_query_resp.return_value = {'incident': {'id': 'PT4KHLK', 'status': 'resolved'}}
+
+    incident = asyncio.run(AsyncPagerDuty('abc123').get_incident('PT4KHLK'))
+
+    assert incident == {'id': 'PT4KHLK', 'status': 'resolved'}
+
+    mock_query_resp.assert_called_once_with(method='GET', endpoint='incidents/PT4KHLK', payload=None)
+
+
+@patch('oncall.utils.pagerduty.Request')
+@patch('oncall.utils.pagerduty.Session')
+def test_query_rate_limiter(mock_session, mock_request):
+    """
+    Test a token is taken from the rate limiter before each request
+    """
+    mock_status = PropertyMock(return_value=200)
+    type(mock_session).status_code = mock_status
+
+    mock_session.send.return_value = mock_session
+    mock_session.json.return_value = {'teams': [], 'more': False}
+
+    mock_session.return_value = mock_session
+
+    rate_limiter = MagicMock()
+
+    pyduty = PagerDuty('abc123', rate_limiter=rate_limiter)
+    next(pyduty.get_teams())
+
+    rate_limiter.acquire.assert_called_once_with()
+
+
+@patch('oncall.utils.pagerduty.Request')
+@patch('oncall.utils.pagerduty.Session')
+def test_query_rate_limited(mock_session, mock_request):
+    """
+    Test a 429 raises immediately with the back off taken from PagerDuty's headers
+    """
+    mock_status = PropertyMock(return_value=429)
+    type(mock_session).status_code = mock_status
+
+    mock_session.headers = {'ratelimit-reset': '17'}
+    mock_session.send.return_value = mock_session
+
+    mock_session.return_value = mock_session
+
+    pyduty = PagerDuty('abc123')
+
+    with pytest.raises(RateLimit) as err:
+        next(pyduty.get_teams())
+
+    assert err.value.retry_after == 17
+    mock_session.send.assert_called_once()
+
+
+def test_retry_after():
+    """
+    Test parsing the rate limit back off headers
+    """
+    assert PagerDuty._retry_after({'Retry-After': '120'}) == 120
+    assert PagerDuty._retry_after({'ratelimit-reset': '0'}) == 1
+    assert PagerDuty._retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == 1
+    assert PagerDuty._retry_after({'Retry-After': 'soon'}) == 30
+    assert PagerDuty._retry_after({}) == 30
+
+
+@patch('oncall.utils.pagerduty.PagerDuty._query')
+def test_get_incidents_by_status(mock_query_resp):
+    """
+    Test listing a team's incidents filtered by status
+    """
+    mock_query_resp.side_effect = [
+        {'incidents': [{'id': 'PT4KHLK', 'status': 'triggered'}], 'more': True},
+        {'incidents': [{'id': 'PT4KHLL', 'status': 'acknowledged'}], 'more': False},
+    ]
+
+    pyduty = PagerDuty('abc123')
+
+    pages = list(pyduty.get_incidents_by_status('ABCXYZ', statuses=('triggered', 'acknowledged')))
+
+    assert pages == [[{'id': 'PT4KHLK', 'status': 'triggered'}], [{'id': 'PT4KHLL', 'status': 'acknowledged'}]]
+    assert mock_query_resp.call_count == 2
+
+    payload = mock_query_resp.call_args.kwargs['payload']
+
+    assert payload['team_ids[]'] == 'ABCXYZ'
+    assert payload['statuses[]'] == ['triggered', 'acknowledged']
+    assert payload['date_range'] == 'all'
+
+
+@patch('oncall.utils.pagerduty.PagerDuty._query')
+def test_get_log_entries(mock_query_resp):
+    """
+    Test reading the log entries feed
+    """
+    mock_query_resp.side_effect = [
+        {'log_entries': [{'id': 'R1', 'type': 'resolve_log_entry'}], 'more': True},
+        {'log_entries': [{'id': 'R2', 'type': 'trigger_log_entry'}], 'more': False},
+    ]
+
+    pyduty = PagerDuty('abc123')
+
+    since = dateutil.parser.parse('2019-01-01T06:42:09.668417+00:00')
+    until = dateutil.parser.parse('2019-01-01T06:52:09.668417+00:00')
+
+    pages = list(pyduty.get_log_entries(since=since, until=until))
+
+    assert pages == [[{'id': 'R1', 'type': 'resolve_log_entry'}], [{'id': 'R2', 'type': 'trigger_log_entry'}]]
+    assert mock_query_resp.call_count == 2
+
+    payload = mock_query_resp.call_args.kwargs['payload']
+
+    assert mock_query_resp.call_args.kwargs['endpoint'] == 'log_entries'
+    assert payload['since'] == since.isoformat()
+    assert payload['until'] == until.isoformat()
+    assert payload['is_overview'] == 'true'
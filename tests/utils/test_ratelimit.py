@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+from mock import MagicMock, patch
+
+from oncall.utils.pagerduty import RateLimit
+from oncall.utils.ratelimit import TokenBucket
+
+
+@pytest.fixture
+def redis():
+    """
+    In-memory Redis running the bucket's Lua script
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+
+    return fakeredis.FakeRedis()
+
+
+def test_token_bucket_for_api_key():
+    """
+    Test the bucket key is derived from a digest of the API key
+    """
+    redis = MagicMock()
+
+    bucket = TokenBucket.for_api_key(redis, 'u+secret', rate=120)
+
+    assert bucket.key.startswith('oncall:ratelimit:')
+    assert 'u+secret' not in bucket.key
+    assert bucket.key == TokenBucket.for_api_key(redis, 'u+secret', rate=60).key
+    assert bucket.key != TokenBucket.for_api_key(redis, 'u+other', rate=120).key
+
+    assert bucket.rate == 2
+    assert bucket.capacity == 120
+
+
+@patch('oncall.utils.ratelimit.time')
+def test_token_bucket_acquire(mock_time):
+    """
+    Test acquiring a token that is immediately available
+    """
+    redis = MagicMock()
+    redis.register_script.return_value.return_value = [1, '0']
+
+    bucket = TokenBucket(redis, 'bucket', rate=60, burst=10, max_wait=5)
+
+    assert bucket.acquire() == 0
+
+    redis.register_script.return_value.assert_called_once_with(keys=['bucket'], args=[10, 1.0, 5])
+    mock_time.sleep.assert_not_called()
+
+
+@patch('oncall.utils.ratelimit.time')
+def test_token_bucket_acquire_waits(mock_time):
+    """
+    Test acquiring a reserved token sleeps until it is due
+    """
+    redis = MagicMock()
+    redis.register_script.return_value.return_value = [1, '0.25']
+
+    bucket = TokenBucket(redis, 'bucket', rate=60)
+
+    assert bucket.acquire() == 0.25
+
+    mock_time.sleep.assert_called_once_with(0.25)
+
+
+def test_token_bucket_acquire_exhausted():
+    """
+    Test a bucket that cannot grant a token within the maximum wait
+    """
+    redis = MagicMock()
+    redis.register_script.return_value.return_value = [0, '45.0']
+
+    bucket = TokenBucket(redis, 'bucket', rate=60, max_wait=30)
+
+    with pytest.raises(RateLimit):
+        bucket.acquire()
+
+
+@patch('oncall.utils.ratelimit.time')
+def test_token_bucket_script_reserves_and_refuses(mock_time, redis):
+    """
+    Test an empty bucket reserves the next token within the maximum wait and refuses it beyond, without taking it
+    """
+    bucket = TokenBucket(redis, 'bucket', rate=1, burst=2, max_wait=90)
+
+    assert bucket.acquire() == bucket.acquire() == 0
+
+    # A token every minute, the next one is reserved
+    assert bucket.acquire() == pytest.approx(60, abs=1)
+    mock_time.sleep.assert_called_once()
+
+    # The one after would be due in two minutes
+    with pytest.raises(RateLimit) as err:
+        bucket.acquire()
+
+    assert err.value.retry_after == 120
+    assert float(redis.hget('bucket', 'tokens')) == pytest.approx(-1, abs=0.1)
+
+
+@patch('oncall.utils.ratelimit.time')
+def test_token_bucket_script_refills(mock_time, redis):
+    """
+    Test the bucket refills at its rate from the Redis clock, up to its capacity
+    """
+    bucket = TokenBucket(redis, 'bucket', rate=60, burst=10)
+
+    # Empty five seconds ago, a token a second has been added since
+    redis.hset('bucket', mapping={'tokens': '0', 'updated': str(time.time() - 5)})
+
+    assert [bucket.acquire() for _ in range(5)] == [0] * 5
+    assert bucket.acquire() == pytest.approx(1, abs=0.1)
+
+    # Empty long ago, the bucket is full again
+    redis.hset('bucket', mapping={'tokens': '0', 'updated': str(time.time() - 1000)})
+
+    assert [bucket.acquire() for _ in range(10)] == [0] * 10
+    assert bucket.acquire() == pytest.approx(1, abs=0.1)
+
+    assert 0 < redis.ttl('bucket') <= 70
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+from mock import MagicMock, patch
+
+from oncall.utils.singleflight import RedisSingleFlight, SingleFlight
+
+
+def test_single_flight_shares_value():
+    """
+    Test concurrent callers of the same key wait on a single computation
+    """
+    flights = SingleFlight()
+
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+
+        return b'value'
+
+    results = []
+
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', compute)))
+    leader.start()
+
+    assert started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for _ in range(5)]
+
+    for follower in followers:
+        follower.start()
+
+    release.set()
+
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert results == [b'value'] * 6
+    assert len(calls) == 1
+
+    # Nothing is remembered once the computation finished
+    assert flights.do('key', lambda: b'other') == b'other'
+
+
+def test_single_flight_shares_error():
+    """
+    Test a failed computation is raised to the callers waiting on it
+    """
+    flights = SingleFlight()
+
+    with pytest.raises(ValueError):
+        flights.do('key', MagicMock(side_effect=ValueError('boom')))
+
+    assert flights.do('key', lambda: 1) == 1
+
+
+def test_redis_single_flight_leader():
+    """
+    Test the caller taking the lease computes and publishes the value
+    """
+    redis = MagicMock()
+    redis.set.return_value = True
+
+    assert RedisSingleFlight(redis, timeout=30).do('key', lambda: b'value') == b'value'
+
+    redis.set.assert_any_call('oncall:singleflight:lock:key', redis.set.call_args_list[0].args[1], nx=True, ex=30)
+    redis.set.assert_any_call('oncall:singleflight:result:key', b'value', ex=30)
+    redis.register_script.return_value.assert_called_once()
+
+
+@patch('oncall.utils.singleflight.time')
+def test_redis_single_flight_follower(mock_time):
+    """
+    Test a caller that did not take the lease waits for the published value
+    """
+    mock_time.monotonic.return_value = 0
+
+    redis = MagicMock()
+    redis.set.return_value = None
+    redis.get.side_effect = [None, b'value']
+    redis.exists.return_value = 1
+
+    compute = MagicMock()
+
+    assert RedisSingleFlight(redis, timeout=30).do('key', compute) == b'value'
+
+    compute.assert_not_called()
+    mock_time.sleep.assert_called_once_with(0.05)
+
+
+@patch('oncall.utils.singleflight.time')
+def test_redis_single_flight_leader_gone(mock_time):
+    """
+    Test a caller computes the value itself when the lease is released without a value
+    """
+    mock_time.monotonic.return_value = 0
+
+    redis = MagicMock()
+    redis.set.return_value = None
+    redis.get.return_value = None
+    redis.exists.return_value = 0
+
+    assert RedisSingleFlight(redis, timeout=30).do('key', lambda: b'value') == b'value'